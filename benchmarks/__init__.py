@@ -0,0 +1 @@
+"""pdt-client benchmarks."""
@@ -0,0 +1,37 @@
+"""Benchmark child process: run the pdt-client command and write its resource usage.
+
+Usage: python -m benchmarks.child <usage file> <pdt-client arguments>...
+"""
+import json
+import resource
+import sys
+
+
+def get_max_rss():
+    """Get the peak resident memory of the process in bytes."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac os
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def main():
+    """Run the command, record its exit code and peak memory."""
+    path = sys.argv[1]
+    sys.argv = ['pdt-client'] + sys.argv[2:]
+    exit_code = 0
+    try:
+        from pdt_client.script import main
+        main()
+    except SystemExit as exc:
+        exit_code = exc.code if isinstance(exc.code, int) else int(exc.code is not None)
+    except BaseException:
+        exit_code = 1
+        raise
+    finally:
+        with open(path, 'w') as fd:
+            json.dump(dict(max_rss=get_max_rss(), exit_code=exit_code), fd)
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""Run the pdt-client benchmarks against the fake deployment tool server.
+
+Every scenario runs the pdt-client command in a fresh process and directory, and measures the wall time including
+the startup, the number of requests the server got and the peak memory of the process. Results are written to a
+json file per pdt-client version, so versions can be compared with --compare.
+
+Usage: python -m benchmarks.run [--revisions 5000] [--latency 0.01] [--compare .benchmarks/1.5.0.json]
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from .server import FakePDT, start_server
+from .tree import generate_tree
+
+SCENARIOS = ('startup', 'migrate', 'push', 'push-cached', 'get-not-reviewed', 'check', 'graph', 'deploy')
+METRICS = ('wall_time', 'requests', 'max_rss')
+# scenarios which exit with the number of the found cases or migrations
+COUNTING_SCENARIOS = ('get-not-reviewed', 'check')
+
+
+def get_commands(scenario, config, log):
+    """Get the pdt-client arguments of the scenario.
+
+    :param scenario: scenario name
+    :param config: alembic config path of the generated revision tree
+    :param log: deployment log path
+    :return: tuple of the list of the untimed setup commands and the timed command
+    """
+    push = ['migration-data', 'push', '--alembic-config', config]
+    commands = {
+        'startup': ([], ['--help']),
+        'migrate': ([], [
+            'migrate', '--instance', 'bench', '--phase', 'before-deploy', '--release', '1',
+            '--connection-string', 'sqlite:///bench.db', '--migrations-dir', '.']),
+        'push': ([], push),
+        'push-cached': ([push], push),
+        'get-not-reviewed': ([], [
+            'migration-data', 'get-not-reviewed', '--alembic-config', config, '--ci-project', 'bench']),
+        'check': ([], [
+            'check', '--alembic-config', config, '--ci-project', 'bench', '--instance', 'bench', '--release', '1']),
+        'graph': ([], ['graph', '--filename', 'graph.dot', '--alembic-config', config, '--quiet']),
+        'deploy': ([], ['deploy', '--instance', 'bench', '--status', 'dpl', '--case', '1', log]),
+    }
+    return commands[scenario]
+
+
+def run_command(server, args, cwd):
+    """Run the pdt-client command in a child process.
+
+    :return: dict of the wall time, peak memory and exit code of the command
+    """
+    usage = os.path.join(cwd, '.usage.json')
+    url = 'http://{0}:{1}'.format(*server.server_address)
+    command = [sys.executable, '-m', 'benchmarks.child', usage, '--url', url, '--username', 'bench',
+               '--password', 'bench'] + args
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.environ.get('PYTHONPATH')])))
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        subprocess.call(command, cwd=cwd, env=env, stdout=devnull, stderr=devnull)
+        wall_time = time.time() - start
+    with open(usage) as fd:
+        result = json.load(fd)
+    result['wall_time'] = wall_time
+    return result
+
+
+def run_scenario(scenario, args, config, log):
+    """Run the scenario `args.repeat` times against a fresh fake server each time.
+
+    :return: result of the fastest run, or of the first failed run with `failed` set
+    """
+    best = None
+    for _ in range(args.repeat):
+        pdt = FakePDT(latency=args.latency, max_page_size=args.max_page_size, failure_rate=args.failure_rate)
+        pdt.add_migrations(args.migrations, branches=args.branches)
+        server = start_server(pdt)
+        cwd = tempfile.mkdtemp(prefix='pdt-bench-')
+        try:
+            setup, command = get_commands(scenario, config, log)
+            failed = False
+            for setup_command in setup:
+                if run_command(server, setup_command, cwd)['exit_code']:
+                    failed = True
+            pdt.reset()
+            result = run_command(server, command, cwd)
+        finally:
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(cwd)
+        result.update(requests=pdt.requests, failures=pdt.failures, received=pdt.received)
+        if failed or result['exit_code'] and scenario not in COUNTING_SCENARIOS:
+            result['failed'] = True
+            return result
+        if best is None or result['wall_time'] < best['wall_time']:
+            best = result
+    return best
+
+
+def format_value(metric, value):
+    """Format the metric value for the table."""
+    if value is None:
+        return '-'
+    if metric == 'wall_time':
+        return '{0:.3f}s'.format(value)
+    if metric == 'max_rss':
+        return '{0:.1f}MiB'.format(value / 1024.0 / 1024)
+    return str(value)
+
+
+def print_results(results, previous=None):
+    """Print the results table, with the ratios to the previous results if given.
+
+    Failed scenarios are not compared.
+    """
+    rows = [['scenario', 'metric', 'value'] + (['previous', 'ratio'] if previous else [])]
+    for scenario, result in results.items():
+        if result.get('failed'):
+            rows.append([scenario, 'failed', 'exit code {0}'.format(result['exit_code'])])
+            continue
+        for metric in METRICS:
+            row = [scenario, metric, format_value(metric, result[metric])]
+            if previous:
+                old_result = previous.get(scenario, {})
+                old = None if old_result.get('failed') else old_result.get(metric)
+                row += [format_value(metric, old), '{0:.2f}'.format(float(result[metric]) / old) if old else '-']
+            rows.append(row)
+    widths = [max(len(row[index]) for row in rows if index < len(row)) for index in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+
+def main():
+    """Generate the revision tree and the deployment log, run the scenarios, store and print the results."""
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run')
+    parser.add_argument('--scenario', dest='scenarios', action='append', choices=SCENARIOS,
+                        help='scenario to run, can be repeated. Defaults to all of them')
+    parser.add_argument('--revisions', type=int, default=1000, help='number of the generated alembic revisions')
+    parser.add_argument('--migrations', type=int, default=1000, help='number of the not applied server migrations')
+    parser.add_argument('--branches', type=int, default=1, help='number of the independent chains of migrations')
+    parser.add_argument('--latency', type=float, default=0, help='seconds every server request waits')
+    parser.add_argument('--max-page-size', type=int, default=1000, help='maximum server list page size')
+    parser.add_argument('--failure-rate', type=float, default=0, help='probability of a server request failing')
+    parser.add_argument('--log-size', type=int, default=16 * 1024 * 1024, help='deployment log size in bytes')
+    parser.add_argument('--repeat', type=int, default=1, help='number of runs per scenario, the fastest is kept')
+    parser.add_argument('--output', help='results file. Defaults to .benchmarks/<pdt-client version>.json')
+    parser.add_argument('--compare', metavar='PATH', help='previous results file to compare with')
+    args = parser.parse_args()
+
+    from pdt_client import __version__
+
+    path = tempfile.mkdtemp(prefix='pdt-bench-tree-')
+    try:
+        print('Generating revisions with count: {0}'.format(args.revisions))
+        config = generate_tree(path, args.revisions, branches=args.branches)
+        log = os.path.join(path, 'deploy.log')
+        with open(log, 'w') as fd:
+            line = 'Deploying the release, step output line.\n'
+            for _ in range(args.log_size // len(line)):
+                fd.write(line)
+        results = collections.OrderedDict()
+        for scenario in args.scenarios or SCENARIOS:
+            print('Running scenario: {0}'.format(scenario))
+            results[scenario] = run_scenario(scenario, args, config, log)
+            if results[scenario].get('failed'):
+                print('Scenario failed with exit code: {0}'.format(results[scenario]['exit_code']))
+    finally:
+        shutil.rmtree(path)
+    output = args.output or os.path.join('.benchmarks', '{0}.json'.format(__version__))
+    if os.path.dirname(output) and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    parameters = dict(
+        (name, value) for name, value in vars(args).items() if name not in ('scenarios', 'output', 'compare'))
+    with open(output, 'w') as fd:
+        json.dump(dict(
+            version=__version__, python=platform.python_version(), time=time.time(), parameters=parameters,
+            results=results), fd, indent=2, sort_keys=True)
+    previous = None
+    if args.compare:
+        with open(args.compare) as fd:
+            previous = json.load(fd)['results']
+    print_results(results, previous)
+    print('Results are written to: {0}'.format(output))
+    failed = [scenario for scenario, result in results.items() if result.get('failed')]
+    if failed:
+        print('Failed scenarios: {0}'.format(', '.join(failed)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
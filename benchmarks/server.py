@@ -0,0 +1,195 @@
+"""Fake deployment tool server for the benchmarks."""
+import json
+import random
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, urlencode, urlparse
+
+
+class FakePDT(object):
+
+    """State of the fake deployment tool: migrations, applied steps and request statistics.
+
+    The migrations list is paginated with limit and offset like the real one, `max_page_size` caps the limit.
+    Every request waits `latency` seconds, and fails with 503 with the `failure_rate` probability.
+    """
+
+    def __init__(self, latency=0, max_page_size=1000, failure_rate=0, seed=0):
+        """Create the empty state.
+
+        :param latency: seconds every request waits
+        :param max_page_size: maximum number of the list items per page
+        :param failure_rate: probability of a request failing with 503
+        :param seed: random seed of the failures
+        """
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.migrations = []
+        self.applied = set()
+        self.reset()
+
+    def reset(self):
+        """Reset the request statistics."""
+        with self.lock:
+            self.requests = 0
+            self.failures = 0
+            self.received = 0
+
+    def add_migrations(self, count, branches=1):
+        """Add the not applied migrations, each with one SQL step creating its own table.
+
+        :param count: number of the migrations
+        :param branches: number of the independent chains of the migrations
+        """
+        for number in range(count):
+            parent = number - branches
+            self.migrations.append({
+                'uid': 'm{0:06d}'.format(number),
+                'parent': 'm{0:06d}'.format(parent) if parent >= 0 else None,
+                'case': {'id': 10000 + number},
+                'pre_deploy_steps': [{
+                    'id': number, 'position': 0, 'type': 'sqlite',
+                    'code': 'CREATE TABLE table_{0} (id INTEGER)'.format(number),
+                }],
+                'post_deploy_steps': [],
+                'final_steps': [],
+            })
+
+    def list_migrations(self, query):
+        """Get the migrations matching the query."""
+        migrations = self.migrations
+        if query.get('exclude_status') == 'apl':
+            migrations = [
+                migration for migration in migrations
+                if not all(step['id'] in self.applied for step in migration['pre_deploy_steps'])]
+        return migrations
+
+    def report_step(self, data):
+        """Record the step report."""
+        if data['status'] == 'apl':
+            with self.lock:
+                self.applied.add(data['step']['id'])
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """Request handler of the fake deployment tool API."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        """Don't log the requests."""
+
+    def reply(self, status, data=None):
+        """Send the json reply."""
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        """Read the request body, also the chunked one."""
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                if not size:
+                    break
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.pdt.received += len(body)
+        return body
+
+    def start(self):
+        """Count the request, wait for the latency, fail it randomly.
+
+        :return: True if the request should be handled
+        """
+        pdt = self.server.pdt
+        with pdt.lock:
+            pdt.requests += 1
+            failed = pdt.random.random() < pdt.failure_rate
+            if failed:
+                pdt.failures += 1
+        if pdt.latency:
+            time.sleep(pdt.latency)
+        if failed:
+            self.reply(503, {'detail': 'Service unavailable'})
+        return not failed
+
+    def do_GET(self):
+        """List the migrations or the cases."""
+        if not self.start():
+            return
+        url = urlparse(self.path)
+        query = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+        pdt = self.server.pdt
+        if url.path == '/api/migrations/':
+            items = pdt.list_migrations(query)
+        elif url.path == '/api/cases/':
+            items = []
+        else:
+            return self.reply(404, {'detail': 'Not found'})
+        if 'limit' not in query:
+            return self.reply(200, items)
+        limit = min(int(query['limit']), pdt.max_page_size)
+        offset = int(query.get('offset', 0))
+        next_url = None
+        if offset + limit < len(items):
+            query.update(limit=limit, offset=offset + limit)
+            host, port = self.server.server_address
+            next_url = 'http://{0}:{1}{2}?{3}'.format(host, port, url.path, urlencode(sorted(query.items())))
+        self.reply(200, {'count': len(items), 'next': next_url, 'results': items[offset:offset + limit]})
+
+    def do_POST(self):
+        """Record the pushed migrations and the reports."""
+        body = self.read_body()
+        if not self.start():
+            return
+        path = urlparse(self.path).path
+        if path == '/api/migration-step-reports/':
+            self.server.pdt.report_step(json.loads(self.decode(body)))
+        elif path == '/api/migration-step-reports/bulk/':
+            for data in json.loads(self.decode(body)):
+                self.server.pdt.report_step(data)
+        elif path not in ('/api/migrations/', '/api/deployment-reports/'):
+            return self.reply(404, {'detail': 'Not found'})
+        self.reply(201, {})
+
+    def decode(self, body):
+        """Decode the possibly compressed request body."""
+        if self.headers.get('Content-Encoding') == 'gzip':
+            import zlib
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        return body.decode('utf-8')
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    """Threaded HTTP server of the fake deployment tool."""
+
+    daemon_threads = True
+
+
+def start_server(pdt, host='127.0.0.1', port=0):
+    """Start the fake deployment tool server in a background thread.
+
+    :param pdt: `FakePDT` state
+    :return: server, its url is 'http://{server.server_address[0]}:{server.server_address[1]}'
+    """
+    server = Server((host, port), Handler)
+    server.pdt = pdt
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,75 @@
+"""Generated alembic revision tree for the benchmarks."""
+import os
+
+ALEMBIC_INI = """[alembic]
+script_location = {script_location}
+sqlalchemy.url = {url}
+phases = before-deploy after-deploy final
+default-phase = before-deploy
+script-attributes = case_id
+"""
+
+ENV_PY = """from alembic import context
+
+
+def run_migrations_offline():
+    context.configure(url=context.config.get_main_option('sqlalchemy.url'), literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+run_migrations_offline()
+"""
+
+REVISION_PY = """revision = {revision!r}
+down_revision = {down_revision!r}
+case_id = {case_id}
+
+from alembic import op
+
+
+def upgrade():
+    op.execute('CREATE TABLE table_{number} (id INTEGER)')
+
+
+def downgrade():
+    op.execute('DROP TABLE table_{number}')
+"""
+
+
+def get_revision(number):
+    """Get the revision id of the generated revision."""
+    return 'r{0:06d}'.format(number)
+
+
+def generate_tree(path, revisions, branches=1, url='sqlite://'):
+    """Generate the alembic config and the script directory with the revisions.
+
+    Every revision creates its own table. With `branches` above 1 the revisions after the first one form that
+    many independent chains starting from the first revision.
+
+    :param path: directory to generate the tree in
+    :param revisions: number of the revisions
+    :param branches: number of the independent chains of the revisions
+    :param url: database url of the alembic config
+    :return: path of the alembic config
+    """
+    script_location = os.path.join(path, 'migrations')
+    versions = os.path.join(script_location, 'versions')
+    os.makedirs(versions)
+    with open(os.path.join(script_location, 'env.py'), 'w') as fd:
+        fd.write(ENV_PY)
+    for number in range(revisions):
+        if number == 0:
+            down_revision = None
+        else:
+            parent = number - branches
+            down_revision = get_revision(parent if parent > 0 else 0)
+        with open(os.path.join(versions, '{0}.py'.format(get_revision(number))), 'w') as fd:
+            fd.write(REVISION_PY.format(
+                revision=get_revision(number), down_revision=down_revision, case_id=10000 + number // 2,
+                number=number))
+    config = os.path.join(path, 'alembic.ini')
+    with open(config, 'w') as fd:
+        fd.write(ALEMBIC_INI.format(script_location=script_location, url=url))
+    return config
@@ -1,9 +1,18 @@
 """pdt-client public interface."""
-__version__ = '1.6.0'
+import sys
 
-try:
-    from .commands import migrate
+__version__ = '1.6.0'
+__all__ = ['migrate']
 
-    __all__ = [migrate.__name__]
-except ImportError:  # pragma: no cover
-    pass
+if sys.version_info < (3, 7):  # pragma: no cover
+    try:
+        from .commands import migrate  # noqa
+    except ImportError:
+        __all__ = []
+else:
+    def __getattr__(name):
+        """Import the commands only when they are used."""
+        if name == 'migrate':
+            from .commands import migrate  # noqa: F811
+            return migrate
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
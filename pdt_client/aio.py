@@ -0,0 +1,79 @@
+"""pdt-client asyncio interface, Python 3.5+ only.
+
+The blocking client is run in a thread pool, this is not an asynchronous HTTP transport.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .client import Client, DEFAULT_POOL_SIZE
+
+
+class AsyncClient(object):
+
+    """Deployment tool API client for asyncio code.
+
+    Requests go through the keep-alive connection pool of the `Client`, they are sent from a thread pool of the
+    connection pool size, so at most `pool_size` requests are in flight at a time and the event loop is never
+    blocked. Commands of `pdt_client.commands` are run the same way with this client.
+    """
+
+    def __init__(self, url, username, password, pool_size=DEFAULT_POOL_SIZE, **kwargs):
+        """Create the client and the thread pool.
+
+        :param url: deployment tool url
+        :param username: deployment tool username
+        :param password: deployment tool password
+        :param pool_size: maximum number of requests in flight and connections kept alive
+        :param kwargs: other `Client` arguments
+        """
+        self.client = Client(url=url, username=username, password=password, pool_size=pool_size, **kwargs)
+        self.executor = ThreadPoolExecutor(pool_size)
+
+    async def call(self, func, *args, **kwargs):
+        """Call the blocking function in the thread pool."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def get(self, endpoint, params=None):
+        """Get decoded data from the API endpoint."""
+        return await self.call(self.client.get, endpoint, params=params)
+
+    async def post(self, endpoint, data):
+        """Post data to the API endpoint as json."""
+        return await self.call(self.client.post, endpoint, data)
+
+    async def post_many(self, endpoint, items):
+        """Post the items to the API endpoint concurrently.
+
+        :return: list of the responses and of the exceptions of the failed posts, in the order of the items
+        """
+        return await asyncio.gather(*[self.post(endpoint, data) for data in items], return_exceptions=True)
+
+    async def list(self, endpoint, params=None):
+        """Get all the items of the API endpoint list, requested page by page."""
+        return await self.call(lambda: list(self.client.iterate(endpoint, params=params)))
+
+    async def run(self, command, **kwargs):
+        """Run the command of `pdt_client.commands` with this client.
+
+        :param command: command function
+        :param kwargs: command arguments other than the deployment tool url and credentials
+        """
+        loop = asyncio.get_event_loop()
+        # commands may use the thread pool themselves, so they don't take its threads
+        return await loop.run_in_executor(None, partial(
+            command, url=self.client.url, username=None, password=None, client=self.client, **kwargs))
+
+    async def close(self):
+        """Wait for the running requests and close all pooled connections."""
+        self.executor.shutdown(wait=True)
+        self.client.close()
+
+    async def __aenter__(self):
+        """Use the client as an async context manager."""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        """Close the client."""
+        await self.close()
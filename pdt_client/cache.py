@@ -0,0 +1,309 @@
+"""pdt-client local caches."""
+import hashlib
+import json
+import os
+import time
+
+DEFAULT_PUSH_CACHE = '.pdt-push-cache.json'
+DEFAULT_SCAN_CACHE = '.pdt-scan-cache.json'
+SCAN_CACHE_VERSION = 1
+DEFAULT_HTTP_CACHE = '.pdt-http-cache'
+DEFAULT_HTTP_CACHE_TTL = 0
+DEFAULT_HTTP_CACHE_SIZE = 50 * 1024 * 1024
+
+
+def get_migration_data(config, revision):
+    """Parse the revision file with alembic-offline, which is imported only when it's needed."""
+    from alembic_offline import get_migration_data
+    return get_migration_data(config, revision)
+
+
+def get_hash(data):
+    """Get the content hash of the json serializable data."""
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_file_state(path, previous=None):
+    """Get the modification time, size and content hash of the file.
+
+    :param path: file path
+    :param previous: previous state of the file, its hash is reused if the modification time and size are the same
+    :return: dict in form: {'stat': [<mtime>, <size>], 'hash': <sha1>}, None if the file doesn't exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = [stat.st_mtime, stat.st_size]
+    if previous and previous['stat'] == key:
+        return previous
+    with open(path, 'rb') as fd:
+        return dict(stat=key, hash=hashlib.sha1(fd.read()).hexdigest())
+
+
+def write_json(path, data):
+    """Write the data to the json file atomically, so an interrupted write never leaves a broken file."""
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as fd:
+        json.dump(data, fd, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def remove(path):
+    """Remove the file if it still exists."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def read_json(path):
+    """Read the json file, the missing or broken file is read as an empty dict."""
+    try:
+        with open(path) as fd:
+            data = json.load(fd)
+    except (IOError, OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class PushCache(object):
+
+    """Content hashes of the migration data pushed to the deployment tool, by revision.
+
+    The cache is keyed by the deployment tool url as well, so pushing to another deployment tool pushes everything.
+    """
+
+    def __init__(self, path, url):
+        """Read the cache file.
+
+        :param path: cache file path
+        :param url: deployment tool url
+        """
+        self.path = path
+        self.url = url
+        self.hashes = read_json(path).get(url, {})
+        self.changed = False
+
+    def is_pushed(self, uid, data):
+        """Check if the same migration data was pushed already."""
+        return self.hashes.get(str(uid)) == get_hash(data)
+
+    def pushed(self, uid, data):
+        """Record that the migration data was pushed."""
+        self.hashes[str(uid)] = get_hash(data)
+        self.changed = True
+
+    def forget(self, uid):
+        """Forget the migration, so it's pushed again."""
+        if self.hashes.pop(str(uid), None) is not None:
+            self.changed = True
+
+    def save(self):
+        """Write the cache file if anything was pushed."""
+        if not self.changed:
+            return
+        caches = read_json(self.path)
+        caches[self.url] = self.hashes
+        write_json(self.path, caches)
+        self.changed = False
+
+
+class ScanCache(object):
+
+    """Parsed migration data of the alembic revision files.
+
+    Entries are keyed by the revision file path and are valid while the content of the revision file and of the
+    scripts its steps refer to didn't change. Modification times and sizes are checked first, files are hashed only
+    when they differ. The whole cache is dropped when the alembic config or env.py changed.
+    The cache also has the index of the revision files by the case id.
+    """
+
+    def __init__(self, path):
+        """Store the cache file path.
+
+        :param path: cache file path
+        """
+        self.path = path
+
+    def clear(self):
+        """Remove the cache file."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def scan(self, config, case=None):
+        """Get the migration data of the revisions, parsing only the changed revision files.
+
+        :param config: alembic config
+        :param case: case id to get only the migrations of the case
+        :return: migration data list in the order of `alembic_offline.get_migrations_data`
+        """
+        from alembic.script import ScriptDirectory
+
+        script_directory = ScriptDirectory.from_config(config)
+        fingerprint = [
+            SCAN_CACHE_VERSION,
+            os.path.abspath(config.config_file_name),
+            get_file_state(config.config_file_name),
+            get_file_state(os.path.join(script_directory.dir, 'env.py')),
+        ]
+        cache = read_json(self.path)
+        if cache.get('fingerprint') != json.loads(json.dumps(fingerprint)):
+            cache = dict(fingerprint=fingerprint, entries={}, order=[], cases={})
+        entries = cache['entries']
+        paths = set()
+        for location in script_directory.version_locations or [os.path.join(script_directory.dir, 'versions')]:
+            for name in os.listdir(location):
+                if name.endswith('.py') and name != '__init__.py':
+                    paths.add(os.path.abspath(os.path.join(location, name)))
+        removed = set(entries) - paths
+        for path in removed:
+            del entries[path]
+        changed = set(removed)
+        stale = []
+        for path in sorted(paths):
+            entry = entries.get(path)
+            if entry is None:
+                stale.append(path)
+                continue
+            state = get_file_state(path, entry['state'])
+            scripts = dict(
+                (script, get_file_state(os.path.join(script_directory.dir, script), script_state))
+                for script, script_state in entry['scripts'].items())
+            if state['hash'] != entry['state']['hash'] or any(
+                    script_state is None or script_state['hash'] != entry['scripts'][script]['hash']
+                    for script, script_state in scripts.items()):
+                stale.append(path)
+            elif state != entry['state'] or scripts != entry['scripts']:
+                entry.update(state=state, scripts=scripts)
+                changed.add(path)
+        if stale:
+            print('-- Parsing changed revision files with count: {0}'.format(len(stale)))
+            scripts = list(reversed(list(script_directory.walk_revisions())))
+            revisions = dict((os.path.abspath(script.path), script.revision) for script in scripts)
+            for path in stale:
+                if path not in revisions:
+                    # not a revision file, kept to not walk the revisions for it every time
+                    entries[path] = dict(state=get_file_state(path), scripts={}, data=None)
+                    continue
+                data = get_migration_data(config, revisions[path])
+                entries[path] = dict(
+                    state=get_file_state(path),
+                    scripts=dict(
+                        (step['path'], get_file_state(os.path.join(script_directory.dir, step['path'])))
+                        for phase in data['phases'].values() for step in phase['steps'] if 'path' in step),
+                    data=data)
+            cache['order'] = [os.path.abspath(script.path) for script in scripts]
+        elif removed:
+            cache['order'] = [path for path in cache['order'] if path not in removed]
+        if stale or removed:
+            cases = {}
+            for path in cache['order']:
+                cases.setdefault(str(entries[path]['data']['attributes'].get('case_id')), []).append(path)
+            cache['cases'] = cases
+        if stale or changed:
+            write_json(self.path, cache)
+        paths = cache['order'] if case is None else cache['cases'].get(str(case), [])
+        return [entries[path]['data'] for path in paths]
+
+
+class ResponseCache(object):
+
+    """Deployment tool responses to GET requests, one json file per request in the cache directory.
+
+    A response younger than `ttl` seconds is used without a request. An older one is revalidated with the
+    If-None-Match and If-Modified-Since headers when the server sent an ETag or Last-Modified header, and is used
+    again if the server replies with 304 Not Modified. Expired responses which can't be revalidated are evicted, and
+    the least recently used ones are evicted when the cache is larger than `max_size` bytes.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_HTTP_CACHE_TTL, max_size=DEFAULT_HTTP_CACHE_SIZE):
+        """Store the cache parameters.
+
+        :param path: cache directory path, created when the first response is cached
+        :param ttl: number of seconds a response is used without a request
+        :param max_size: maximum size of the cache in bytes
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def get_path(self, key):
+        """Get the file path of the cached response."""
+        return os.path.join(self.path, get_hash(key) + '.json')
+
+    def load(self, key):
+        """Get the cached response entry, the expired one which can't be revalidated is evicted.
+
+        :return: entry dict, None if there's none
+        """
+        path = self.get_path(key)
+        entry = read_json(path)
+        if not entry:
+            return None
+        if not self.is_fresh(entry) and not self.get_validators(entry):
+            remove(path)
+            return None
+        # the least recently used responses are evicted first
+        os.utime(path, None)
+        return entry
+
+    def is_fresh(self, entry):
+        """Check if the response can be used without a request."""
+        return time.time() - entry['time'] < self.ttl
+
+    def get_validators(self, entry):
+        """Get the conditional request headers for revalidating the response."""
+        headers = {}
+        if entry['headers'].get('etag'):
+            headers['If-None-Match'] = entry['headers']['etag']
+        if entry['headers'].get('last-modified'):
+            headers['If-Modified-Since'] = entry['headers']['last-modified']
+        return headers
+
+    def get_response(self, entry):
+        """Get the response object of the cached response."""
+        import requests
+        from requests.structures import CaseInsensitiveDict
+
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry['url']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = 'utf-8'
+        response._content = entry['content'].encode('utf-8')
+        return response
+
+    def store(self, key, response):
+        """Cache the response if it can be used again, evict the old responses."""
+        headers = dict(
+            (name.lower(), value) for name, value in response.headers.items()
+            if name.lower() in ('etag', 'last-modified', 'content-type'))
+        entry = dict(url=response.url, time=time.time(), headers=headers, content=response.content.decode('utf-8'))
+        if response.status_code == 200 and (self.ttl > 0 or self.get_validators(entry)):
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            write_json(self.get_path(key), entry)
+            self.prune()
+
+    def touch(self, key, entry):
+        """Mark the revalidated response as fresh."""
+        entry['time'] = time.time()
+        write_json(self.get_path(key), entry)
+
+    def prune(self):
+        """Evict the least recently used responses while the cache is larger than the maximum size."""
+        files = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed by a concurrent run
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        size = 0
+        for mtime, file_size, path in sorted(files, reverse=True):
+            size += file_size
+            if size > self.max_size:
+                remove(path)
@@ -0,0 +1,287 @@
+"""pdt-client HTTP client."""
+import hashlib
+import json
+import pprint
+import random
+import time
+import zlib
+
+from six.moves.urllib.parse import urlparse
+
+from .profiling import span
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.5
+DEFAULT_RETRY_STATUSES = (502, 503, 504)
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+DEFAULT_COMPRESS_THRESHOLD = 0
+COMPRESSION_REJECTED_STATUSES = (400, 415)
+
+
+def iterate_json(data, field, chunks):
+    """Encode the data as a json object which string field is streamed.
+
+    :param data: dict of the other fields
+    :param field: name of the streamed string field
+    :param chunks: iterable of the field value chunks
+    :return: generator of utf-8 encoded json chunks
+    """
+    head = json.dumps(data, sort_keys=True)[:-1]
+    yield u'{0}{1}{2}: "'.format(head, ', ' if data else '', json.dumps(field)).encode('utf-8')
+    for chunk in chunks:
+        yield json.dumps(chunk)[1:-1].encode('utf-8')
+    yield b'"}'
+
+
+def gzip_compress(data):
+    """Compress the bytes to the gzip format."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def gzip_stream(chunks):
+    """Compress the bytes chunks to the gzip format incrementally.
+
+    :param chunks: iterable of bytes
+    :return: generator of the compressed chunks
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class Client(object):
+
+    """Deployment tool API client.
+
+    Holds a single keep-alive connection pool which is shared by all the API calls.
+    Requests failed with a connection error or a retryable status are retried with exponential backoff and full
+    jitter. Posts carry an idempotency key, so the deployment tool records a retried post only once.
+    With a compression threshold set, post bodies above it are sent gzip compressed, until the deployment tool
+    rejects one with 415 Unsupported Media Type or 400 Bad Request, which is what Django REST framework replies to a
+    body it can't parse; then it's sent again uncompressed, and so are all the next ones.
+    """
+
+    def __init__(
+            self, url, username, password, pool_size=DEFAULT_POOL_SIZE, timeout=None, page_size=DEFAULT_PAGE_SIZE,
+            retries=DEFAULT_RETRIES, retry_backoff=DEFAULT_RETRY_BACKOFF, retry_statuses=DEFAULT_RETRY_STATUSES,
+            cache=None, compress_threshold=DEFAULT_COMPRESS_THRESHOLD):
+        """Create the session and mount the connection pool.
+
+        :param url: deployment tool url
+        :param username: deployment tool username
+        :param password: deployment tool password
+        :param pool_size: maximum number of connections kept alive per host
+        :param timeout: request timeout in seconds, None for no timeout
+        :param page_size: number of list items requested per page, None to request the whole list at once
+        :param retries: maximum number of retries of a failed request, 0 to not retry
+        :param retry_backoff: maximum delay before the first retry in seconds, doubled for every next retry
+        :param retry_statuses: response status codes after which the request is retried
+        :param cache: `ResponseCache` for the read-only queries, None to not cache responses
+        :param compress_threshold: size of the post body in bytes from which it's compressed, 0 to not compress
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.url = url
+        self.timeout = timeout
+        self.page_size = page_size
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.retry_statuses = frozenset(retry_statuses)
+        self.cache = cache
+        self.username = username
+        self.compress_threshold = compress_threshold
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        self.session.headers['content-type'] = 'application/json'
+        self.session.headers['accept-encoding'] = 'gzip, deflate'
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_url(self, endpoint):
+        """Get full url of the API endpoint."""
+        return '{url}/api/{endpoint}/'.format(url=self.url, endpoint=endpoint)
+
+    def request(self, method, endpoint, **kwargs):
+        """Perform the API request.
+
+        :raises: Exception if PDT replied with an error
+        :return: response object
+        """
+        return self.send(method, self.get_url(endpoint), **kwargs)
+
+    def retry(self, method, attempt, kwargs, reason):
+        """Wait before retrying the request if it can be retried.
+
+        Only idempotent requests and requests with an idempotency key are retried.
+
+        :param attempt: number of the failed attempt, starting from 0
+        :param kwargs: request arguments
+        :param reason: description of the failure
+        :return: True if the request should be retried
+        """
+        if attempt >= self.retries:
+            return False
+        if method not in IDEMPOTENT_METHODS and IDEMPOTENCY_KEY_HEADER not in (kwargs.get('headers') or {}):
+            return False
+        delay = random.uniform(0, self.retry_backoff * 2 ** attempt)
+        print('Retrying the request in {0:.1f} seconds after: {1}'.format(delay, reason))
+        time.sleep(delay)
+        return True
+
+    def send(self, method, url, cache=False, plain_data=None, **kwargs):
+        """Perform the request to the given full url, retrying transient failures.
+
+        :param cache: use the response cache, only for GET requests of the data which doesn't change while the
+            command runs
+        :param plain_data: uncompressed body of the compressed request, sent if the compressed one is rejected, or
+            a function returning it
+        :raises: Exception if PDT replied with an error
+        :return: response object
+        """
+        import requests
+
+        entry = None
+        if cache and self.cache is not None and method == 'GET':
+            key = [self.username, url, sorted((kwargs.get('params') or {}).items())]
+            entry = self.cache.load(key)
+            if entry is not None:
+                if self.cache.is_fresh(entry):
+                    return self.cache.get_response(entry)
+                kwargs['headers'] = dict(kwargs.get('headers') or {}, **self.cache.get_validators(entry))
+        else:
+            cache = False
+        attempt = 0
+        while True:
+            try:
+                with span('http', '{0} {1}'.format(method, urlparse(url).path), method=method, attempt=attempt) as info:
+                    response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                    if info is not None:
+                        data = kwargs.get('data')
+                        info.update(
+                            status=response.status_code, received=len(response.content),
+                            sent=len(data) if isinstance(data, (bytes, str)) else None)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if not self.retry(method, attempt, kwargs, repr(exc)):
+                    raise
+            else:
+                if response.status_code not in self.retry_statuses or not self.retry(
+                        method, attempt, kwargs, 'HTTP {0}'.format(response.status_code)):
+                    break
+            attempt += 1
+        if plain_data is not None and response.status_code in COMPRESSION_REJECTED_STATUSES:
+            print('Compressed requests are not supported by the deployment tool, sending them uncompressed')
+            self.compress_threshold = 0
+            headers = dict(kwargs['headers'])
+            del headers['Content-Encoding']
+            kwargs.update(data=plain_data() if callable(plain_data) else plain_data, headers=headers)
+            return self.send(method, url, **kwargs)
+        try:
+            response.raise_for_status()
+        except Exception:
+            try:
+                pprint.pprint(response.json())
+            except ValueError:
+                # error pages of proxies are not json
+                print(response.text)
+            raise
+        if cache:
+            if entry is not None and response.status_code == 304:
+                self.cache.touch(key, entry)
+                return self.cache.get_response(entry)
+            self.cache.store(key, response)
+        return response
+
+    def get(self, endpoint, params=None, cache=False):
+        """Get decoded data from the API endpoint."""
+        return self.request('GET', endpoint, params=params, cache=cache).json()
+
+    def iterate_pages(self, endpoint, params=None, cache=False, counted=False):
+        """Iterate over the pages of the API endpoint list.
+
+        The first page is requested with the limit parameter, then the server's `next` link is followed, so both
+        limit/offset and cursor pagination are supported. A plain list reply of a server which doesn't paginate
+        is returned as a single page. Only one page is kept in memory at a time.
+
+        :param endpoint: API list endpoint name
+        :param params: query parameters
+        :param cache: use the response cache
+        :param counted: yield the total count of the list items the server replied with the page as well
+        :return: generator of lists of decoded items, with `counted` of tuples in form: (<count>, <items>), where
+            the count is None if the server didn't send it
+        """
+        params = dict(params or {})
+        if self.page_size:
+            params['limit'] = self.page_size
+        url = self.get_url(endpoint)
+        while url:
+            page = self.send('GET', url, params=params, cache=cache).json()
+            if isinstance(page, list):
+                yield (len(page), page) if counted else page
+                return
+            yield (page.get('count'), page['results']) if counted else page['results']
+            url = page.get('next')
+            # the next link already contains all the query parameters
+            params = None
+
+    def iterate(self, endpoint, params=None, cache=False):
+        """Iterate over the items of the API endpoint list page by page.
+
+        :param endpoint: API list endpoint name
+        :param params: query parameters
+        :param cache: use the response cache
+        :return: generator of decoded list items
+        """
+        for page in self.iterate_pages(endpoint, params=params, cache=cache):
+            for item in page:
+                yield item
+
+    def post(self, endpoint, data, idempotency_key=None):
+        """Post data to the API endpoint as json.
+
+        :param idempotency_key: key identifying the post, by default the hash of the endpoint and the data, so
+            posting the same data again, also by the next run, is recorded once
+        """
+        body = json.dumps(data, sort_keys=True)
+        if idempotency_key is None:
+            idempotency_key = hashlib.sha1(u'{0}\n{1}'.format(endpoint, body).encode('utf-8')).hexdigest()
+        headers = {IDEMPOTENCY_KEY_HEADER: idempotency_key}
+        encoded = body.encode('utf-8') if not isinstance(body, bytes) else body
+        if self.compress_threshold and len(encoded) >= self.compress_threshold:
+            headers['Content-Encoding'] = 'gzip'
+            return self.request('POST', endpoint, data=gzip_compress(encoded), headers=headers, plain_data=body)
+        return self.request('POST', endpoint, data=body, headers=headers)
+
+    def post_stream(self, endpoint, data, field, get_chunks):
+        """Post data to the API endpoint as json, streaming the value of one string field.
+
+        The body is sent with chunked transfer encoding, so it's never kept in memory as a whole. The chunks can't
+        be sent again, so the post is not retried. With a compression threshold set the body is compressed as it's
+        streamed, as its size is not known up front, and is streamed again uncompressed if the compressed one is
+        rejected.
+
+        :param data: dict of the other fields
+        :param field: name of the streamed string field
+        :param get_chunks: function returning an iterable of the field value chunks, called again for sending
+            the body uncompressed
+        """
+        def get_body():
+            return iterate_json(data, field, get_chunks())
+
+        if self.compress_threshold:
+            return self.request(
+                'POST', endpoint, data=gzip_stream(get_body()), headers={'Content-Encoding': 'gzip'},
+                plain_data=get_body)
+        return self.request('POST', endpoint, data=get_body())
+
+    def close(self):
+        """Close all pooled connections."""
+        self.session.close()
@@ -1,23 +1,27 @@
 """pdt-client commands."""
+import contextlib
+from functools import partial, wraps
 import json
-from functools import partial
 import os
 import pprint
 import sys
 import traceback
 
-from alembic.config import Config
-from alembic_offline import get_migrations_data, generate_migration_graph
-from capturer import CaptureOutput
-import requests
 import six
-import sqlalchemy
-
-try:
-    import subprocess32 as subprocess
-except ImportError:  # pragma: no cover
-    import subprocess
 
+from .cache import PushCache, ScanCache
+from .client import Client
+from .journal import open_journal
+from .process import read_log, run_script
+from .profiling import span
+from .reporting import (
+    DEFAULT_BATCH_INTERVAL,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_SPOOL,
+    SynchronizedStepReporter,
+    get_reporter,
+)
+from .scheduler import DEFAULT_CONCURRENCY, run_dag, run_parallel
 
 MIGRATION_PHASE_MAPPING = {
     'before-deploy': 'pre_deploy_steps',
@@ -25,34 +29,206 @@ MIGRATION_PHASE_MAPPING = {
     'final': 'final_steps',
 }
 
+DEFAULT_JOBS = 4
+DEFAULT_LOG = '{instance}.log'
+
+OUTPUT_FORMATS = ('text', 'jsonl')
+TRANSACTION_MODES = ('step', 'migration', 'phase')
+TRANSACTIONAL_DDL_DIALECTS = frozenset(('postgresql', 'sqlite', 'mssql'))
+
+
+def get_migrations_data(config):
+    """Parse all the revision files with alembic-offline, which is imported only when it's needed."""
+    from alembic_offline import get_migrations_data
+    return get_migrations_data(config)
+
+
+def with_client(func):
+    """Create the deployment tool client for the command unless one is passed, close the created one afterwards."""
+    @wraps(func)
+    def decorated(url, username, password, *args, **kwargs):
+        if kwargs.get('client') is not None:
+            return func(url, username, password, *args, **kwargs)
+        kwargs['client'] = client = Client(url=url, username=username, password=password)
+        try:
+            return func(url, username, password, *args, **kwargs)
+        finally:
+            client.close()
+
+    return decorated
+
+
+@contextlib.contextmanager
+def records_output(output):
+    """Stream the records of the query command as json lines to the standard output.
+
+    The messages of the command go to the standard error meanwhile, so the standard output has only the records.
+
+    :param output: output format, one of `OUTPUT_FORMATS`
+    :return: context manager yielding the records stream, None for the text output
+    """
+    if output != 'jsonl':
+        yield None
+        return
+    records = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        yield records
+    finally:
+        sys.stdout = records
+
+
+def write_record(records, record):
+    """Write the record as a json line, flushing it so a pipeline gets it at once."""
+    records.write(json.dumps(record, sort_keys=True) + '\n')
+    records.flush()
+
+
+def report_step(reporter, data, journal=None):
+    """Record the migration step report in the journal and report it."""
+    if journal is not None:
+        journal.step(data['step']['id'], data['status'], data)
+    reporter.report(data)
+
+
+class SQLTransaction(object):
+
+    """Execute SQL steps on one connection in one transaction.
+
+    Reports of the steps executed in the transaction are held until it's committed. When it's rolled back, they are
+    reported with the error status.
+    """
+
+    def __init__(self, engine, reporter, journal=None):
+        """Store the engine and the reporting objects."""
+        self.engine = engine
+        self.reporter = reporter
+        self.journal = journal
+        self.connection = None
+        self.transaction = None
+        self.reports = []
+
+    def execute(self, code):
+        """Execute SQL in the transaction, begin it if needed."""
+        if self.connection is None:
+            self.connection = self.engine.connect()
+        if self.transaction is None:
+            self.transaction = self.connection.begin()
+        return self.connection.execute(code)
+
+    def report(self, data):
+        """Hold the report until the transaction is committed, or report it if there's no transaction."""
+        if self.transaction is None:
+            report_step(self.reporter, data, self.journal)
+        else:
+            self.reports.append(data)
+
+    def end(self, action):
+        """End the transaction, report the held reports."""
+        if self.transaction is not None:
+            action(self.transaction)
+            self.transaction = None
+        reports, self.reports = self.reports, []
+        for data in reports:
+            report_step(self.reporter, data, self.journal)
+
+    def commit(self):
+        """Commit the transaction, if it was begun."""
+        if self.transaction is None:
+            return
+        print('-- Committing the transaction of steps with count: {0}'.format(len(self.reports)))
+        self.end(lambda transaction: transaction.commit())
+
+    def rollback(self):
+        """Roll the transaction back, report the steps executed in it with the error status."""
+        for data in self.reports:
+            if data['status'] == 'apl':
+                data['status'] = 'err'
+                data['log'] += '\nRolled back: a later step of the transaction failed'
+        self.end(lambda transaction: transaction.rollback())
+
+    def close(self):
+        """Close the connection."""
+        if self.connection is not None:
+            self.connection.close()
+
+
+@contextlib.contextmanager
+def sql_transaction(engine, mode, reporter, journal=None):
+    """Run SQL steps in one transaction, committed on success and rolled back on error.
+
+    :param mode: one of TRANSACTION_MODES, for `step` every SQL step is executed in autocommit and None is returned
+    """
+    if mode == 'step':
+        yield None
+        return
+    if engine.dialect.name not in TRANSACTIONAL_DDL_DIALECTS:
+        print('-- Transactions are not used, {0} has no transactional DDL'.format(engine.dialect.name))
+        yield None
+        return
+    transaction = SQLTransaction(engine, reporter, journal)
+    try:
+        yield transaction
+    except BaseException:
+        exc_info = sys.exc_info()
+        try:
+            transaction.rollback()
+        except Exception:
+            # the error of the step is the one to raise
+            print('-- Failed to roll the transaction back:')
+            traceback.print_exc()
+        six.reraise(*exc_info)
+    else:
+        transaction.commit()
+    finally:
+        transaction.close()
+
 
 def apply_migration_step(
-        url, username, password, migration, step, instance, phase, engine, migrations_dir, show):
-    """Apply migration step."""
+        reporter, migration, step, instance, phase, engine, migrations_dir, show, journal=None, transaction=None,
+        script_log=None):
+    """Apply migration step.
+
+    With the `transaction` SQL is executed in it, and the transaction is committed before running a script.
+    The script output is streamed to the console and to the `script_log` file, only its first and last lines are
+    reported.
+    """
+    if journal is not None and journal.applied(step['id']):
+        print("-- Skipping migration step applied by the previous run: id={step[id]}".format(step=step))
+        return
     print("-- Applying migration step: id={step[id]}, position={step[position]}".format(step=step))
     report = ''
-    exc = None
-    try:
-        if step['type'] == engine.dialect.name:
-            if show:
-                print(step['code'])
-            else:
-                report = 'Executed SQL with rowcount: {0}'.format(engine.execute(step['code']).rowcount)
-        else:
-            path = os.path.join(migrations_dir, step['path'])
-            args = [path]
-            if step['type'] == 'python':
-                args.insert(0, sys.executable)
-            if show:
-                print('-- Script to be executed: {0}'.format(' '.join(args)))
+    exc_info = None
+    kind = 'sql' if step['type'] == engine.dialect.name else 'script'
+    with span(kind, step['type'], migration=migration['uid'], step=step['id']) as info:
+        try:
+            if kind == 'sql':
+                if show:
+                    print(step['code'])
+                else:
+                    report = 'Executed SQL with rowcount: {0}'.format(
+                        (transaction or engine).execute(step['code']).rowcount)
             else:
-                with CaptureOutput() as capturer:
-                    subprocess.check_call(args)
-                    report = capturer.get_text()
-        status = 'apl'
-    except Exception as exc:
-        report = traceback.format_exc()
-        status = 'err'
+                path = os.path.join(migrations_dir, step['path'])
+                args = [path]
+                if step['type'] == 'python':
+                    args.insert(0, sys.executable)
+                if show:
+                    print('-- Script to be executed: {0}'.format(' '.join(args)))
+                else:
+                    if transaction is not None:
+                        transaction.commit()
+                    report = run_script(args, log=script_log)
+            status = 'apl'
+        except Exception:
+            exc_info = sys.exc_info()
+            report = traceback.format_exc()
+            output = getattr(exc_info[1], 'output', None)
+            if output:
+                report = u'{0}\n{1}'.format(output, report)
+            status = 'err'
+        if info is not None:
+            info.update(status=status, report=len(report))
     try:
         if not show:
             print('Applied migration step with status: {0}'.format(status))
@@ -72,59 +248,198 @@ def apply_migration_step(
                 "status": status,
                 "log": report
             }
-            response = requests.post(
-                '{url}/api/migration-step-reports/'.format(url=url),
-                auth=(username, password),
-                data=json.dumps(data, sort_keys=True),
-                headers={'content-type': 'application/json'}
-            )
-            try:
-                response.raise_for_status()
-            except Exception:
-                pprint.pprint(response.json())
-                raise
+            if transaction is not None:
+                transaction.report(data)
+            else:
+                report_step(reporter, data, journal)
     finally:
-        if exc:
-            six.reraise(exc, None, sys.exc_traceback)
+        if exc_info:
+            six.reraise(*exc_info)
 
 
-def apply_migration(url, username, password, migration, instance, phase, engine, migrations_dir, show):
+def apply_migration(
+        reporter, migration, instance, phase, engine, migrations_dir, show, journal=None, transaction=None,
+        script_log=None):
     """Apply migration."""
     print("-- Applying migration: {migration[uid]}".format(migration=migration))
     for step in migration[MIGRATION_PHASE_MAPPING[phase]]:
         apply_migration_step(
-            url=url, username=username, password=password,
-            migration=migration, step=step, instance=instance, phase=phase, engine=engine,
-            migrations_dir=migrations_dir, show=show)
+            reporter=reporter, migration=migration, step=step, instance=instance, phase=phase, engine=engine,
+            migrations_dir=migrations_dir, show=show, journal=journal, transaction=transaction, script_log=script_log)
+
+
+def iterate_not_applied(client, params):
+    """Iterate over not applied migrations while they are being applied.
+
+    Applied migrations drop out of the filtered list, so the pages shift under the offset once a page is applied.
+    The next pages are followed while the count of the list stays the same. When it changed after migrations
+    were yielded, or the server doesn't send it, the pages have shifted and the list is scanned again from the
+    first page, skipping the already seen migrations. The order is kept and no migration is skipped, while only
+    one page is kept in memory. The scan reaching the last page ends the iteration.
+
+    :param client: deployment tool client
+    :param params: migrations list query parameters
+    :return: generator of migration data dicts
+    """
+    seen = set()
+    shifted = True
+    while shifted:
+        shifted = False
+        count = yielded = None
+        for page_count, page in client.iterate_pages('migrations', params=params, counted=True):
+            if yielded and (page_count is None or page_count != count):
+                shifted = True
+                break
+            count = page_count
+            migrations = [migration for migration in page if migration['uid'] not in seen]
+            yielded = bool(migrations)
+            if migrations:
+                print('-- Got migration data with count: {0}'.format(len(migrations)))
+            for migration in migrations:
+                seen.add(migration['uid'])
+                yield migration
+
+
+def replay_journal(journal, reporter):
+    """Report the steps applied by the previous run which reports were not confirmed.
+
+    Reports which the reporter resends from its own spool file are not reported again.
+    """
+    spooled = frozenset(data['step']['id'] for data in reporter.pending)
+    reports = [data for data in journal.unsent() if data['step']['id'] not in spooled]
+    print('-- Resending step reports from the journal with count: {0}'.format(len(reports)))
+    for data in reports:
+        reporter.report(data)
 
 
+@with_client
 def migrate(
         url, username, password, instance, phase, connection_string, migrations_dir, release, case=None,
-        show=False):
-    """Apply previously not applied migrations."""
-    engine = sqlalchemy.create_engine(connection_string)
+        show=False, report_batch_size=DEFAULT_BATCH_SIZE, report_batch_interval=DEFAULT_BATCH_INTERVAL,
+        report_async=False, report_spool=DEFAULT_SPOOL, journal=None, resume=False, transaction='step',
+        db_pool_size=None, script_log=None, concurrency=DEFAULT_CONCURRENCY, client=None):
+    """Apply previously not applied migrations.
+
+    Step reports are posted in batches of `report_batch_size`, queued reports are posted at the latest when
+    `report_batch_interval` seconds passed, and in any case before the command exits.
+    With `report_async` step reports are posted from a background thread and kept in the `report_spool` file
+    until confirmed, the command exits when every report is confirmed or spooled.
+    Applied steps are recorded in the `journal` file, which is removed once the command succeeds. With `resume`
+    the reports of the previous run which were not sent are posted first, and the steps it applied are skipped.
+    With the `transaction` mode `migration` or `phase`, SQL steps of every migration or of the whole phase are
+    executed in one transaction on one connection, if the database has transactional DDL.
+    The full output of the scripts is written to the rotating `script_log` file.
+    With `concurrency` above 1 independent migrations are applied at the same time on separate connections, a
+    migration is applied only after its parents. The transaction mode `phase` is used per migration then.
+    """
+    import sqlalchemy
+
+    engine_kwargs = dict(pool_size=db_pool_size) if db_pool_size else {}
+    engine = sqlalchemy.create_engine(connection_string, **engine_kwargs)
     params = dict(
         reviewed=True, exclude_status='apl', instance=instance, release=release)
     if case:
         params['case'] = case
-    response = requests.get(
-        '{url}/api/migrations/'.format(url=url),
-        auth=(username, password),
-        params=params,
-        headers={'content-type': 'application/json'}
-    )
+    spool = report_spool.format(instance=instance) if report_async and not show else None
+    journal_path = journal.format(instance=instance) if journal and not show else None
+    with open_journal(journal_path, resume=resume) as journal, get_reporter(
+            client, batch_size=report_batch_size, batch_interval=report_batch_interval, spool=spool,
+            journal=journal) as reporter:
+        if resume and journal is not None:
+            replay_journal(journal, reporter)
+        apply = partial(
+            apply_migration, instance=instance, phase=phase, engine=engine, migrations_dir=migrations_dir, show=show,
+            journal=journal, script_log=script_log.format(instance=instance) if script_log else None)
+        if concurrency > 1 and not show:
+            migrations = list(client.iterate('migrations', params=params))
+            print('-- Got migration data with count: {0}'.format(len(migrations)))
+            reporter = SynchronizedStepReporter(reporter)
+            mode = 'migration' if transaction == 'phase' else transaction
+
+            def apply_in_transaction(migration):
+                with sql_transaction(engine, mode, reporter, journal) as unit:
+                    apply(reporter=reporter, migration=migration, transaction=unit)
+
+            run_dag(migrations, apply_in_transaction, concurrency=concurrency)
+            return
+        with sql_transaction(engine, 'step' if show else transaction, reporter, journal) as unit:
+            for migration in iterate_not_applied(client, params):
+                apply(reporter=reporter, migration=migration, transaction=unit)
+                if unit is not None and transaction == 'migration':
+                    unit.commit()
+
+
+def read_manifest(manifest):
+    """Read the instances manifest.
+
+    :param manifest: path to the json file with an object mapping instance names to connection strings
+    :return: sorted list of (instance, connection string) tuples
+    """
+    with open(manifest) as fd:
+        return sorted(json.load(fd).items())
+
+
+def _migrate_instance(kwargs):
+    """Apply the migrations to one instance in a pool process, writing the output to the instance log.
+
+    :return: tuple of the instance name and None on success, or formatted traceback on failure
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    log = open(kwargs.pop('log'), 'w')
+    # scripts write to the descriptors, python code to the sys streams
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    sys.stdout = sys.stderr = log
+    try:
+        migrate(**kwargs)
+        return kwargs['instance'], None
+    except BaseException:
+        traceback.print_exc()
+        return kwargs['instance'], traceback.format_exc()
+    finally:
+        log.close()
+
+
+def migrate_many(
+        url, username, password, manifest, phase, migrations_dir, release, jobs=DEFAULT_JOBS, log=DEFAULT_LOG,
+        client=None, **kwargs):
+    """Apply previously not applied migrations to all the instances of the manifest concurrently.
+
+    Every instance is migrated in its own pool process, so a failure of one instance doesn't affect the others.
+    The output of every instance is written to its own `log` file.
+
+    :param manifest: path to the json file with an object mapping instance names to connection strings
+    :param jobs: number of instances migrated at the same time
+    :param log: log file path, {instance} is replaced with the instance name
+    :param kwargs: other `migrate` arguments
+
+    :raises: SystemExit(<number>) - migration of <number> of instances failed
+    """
+    tasks = [
+        dict(
+            url=url, username=username, password=password, instance=instance, connection_string=connection_string,
+            phase=phase, migrations_dir=migrations_dir, release=release, log=log.format(instance=instance),
+            client=client, **kwargs)
+        for instance, connection_string in read_manifest(manifest)]
+    import multiprocessing
+
+    print('-- Migrating instances with count: {0}'.format(len(tasks)))
+    pool = multiprocessing.Pool(jobs, maxtasksperchild=1)
+    failed = []
     try:
-        response.raise_for_status()
-    except Exception:
-        pprint.pprint(response.json())
-        raise
-    migrations = response.json()
-    print('-- Got migration data with count: {0}'.format(len(migrations)))
-    for migration in migrations:
-        apply_migration(
-            url=url, username=username, password=password,
-            migration=migration, instance=instance, phase=phase, engine=engine,
-            migrations_dir=migrations_dir, show=show)
+        for instance, error in pool.imap_unordered(_migrate_instance, tasks):
+            if error:
+                failed.append(instance)
+                print('-- Failed to migrate instance: {0}, log: {1}'.format(instance, log.format(instance=instance)))
+            else:
+                print('-- Migrated instance: {0}'.format(instance))
+    finally:
+        pool.close()
+        pool.join()
+    if failed:
+        print('Failed to migrate these instances: {0}'.format(sorted(failed)))
+        sys.exit(len(failed))
 
 
 def get_phase_steps(migration, phase):
@@ -144,168 +459,304 @@ def get_phase_steps(migration, phase):
         yield dict(position=index, code=step['script'], type=step['type'], **kwargs)
 
 
-def push_data(url, username, password, alembic_config, case=None, show=False):
+def get_migrations(alembic_config, scan_cache=None, rescan=False, case=None):
+    """Get the migration data of the revisions.
+
+    :param alembic_config: alembic config path
+    :param scan_cache: scan cache file path, None to parse every revision file
+    :param rescan: clear the scan cache first
+    :param case: case id to get only the migrations of the case, the scan cache has them indexed
+    :return: migration data list
+    """
+    from alembic.config import Config
+
+    config = Config(alembic_config)
+    with span('scan', 'alembic', cached=bool(scan_cache)) as info:
+        if not scan_cache:
+            migrations = [
+                migration for migration in get_migrations_data(config)
+                if case is None or str(migration['attributes']['case_id']) == str(case)]
+        else:
+            cache = ScanCache(scan_cache)
+            if rescan:
+                cache.clear()
+            migrations = cache.scan(config, case=case)
+        if info is not None:
+            info['revisions'] = len(migrations)
+    return migrations
+
+
+@with_client
+def push_data(
+        url, username, password, alembic_config, case=None, show=False, push_cache=None, check_server=False,
+        scan_cache=None, rescan=False, concurrency=DEFAULT_CONCURRENCY, client=None):
     """Push migration data.
 
+    With the `push_cache` file only the migrations which data changed since they were pushed are pushed.
+    With `check_server` the migrations missing in the deployment tool are pushed even if the cache has them.
+    With the `scan_cache` file only the changed revision files are parsed, `rescan` parses all of them.
+
+    Migrations are pushed by `concurrency` threads at the same time, a migration is pushed after its parent.
+    Failed pushes don't stop the others, they are summarized at the end.
+    With the `case` all the migrations of the case are pushed.
+
     :args: command line arguments namespace object
 
-    :raises: Exception if PDT replied with an error
+    :raises: SystemExit(<number>) - pushing <number> of migrations failed
     """
-    config = Config(alembic_config)
-    for migration in get_migrations_data(config):
-        if case == migration['attributes']['case_id'] or not case:
-            print(
-                'Got migration data for migration: {migration[revision]}, case: {migration[attributes][case_id]}'
-                .format(migration=migration))
-            call_url = '{0}/api/migrations/'.format(url)
-            data = {
-                "uid": migration['revision'],
-                "parent": migration['down_revision'],
-                "case": {
-                    "id": str(migration['attributes']['case_id'])
-                },
-                "pre_deploy_steps": list(get_phase_steps(migration, 'before-deploy')),
-                "post_deploy_steps": list(get_phase_steps(migration, 'after-deploy')),
-                "final_steps": list(get_phase_steps(migration, 'final')),
-            }
-            if show:
-                print('URL: {call_url}, data: \n{data}'.format(call_url=call_url, data=pprint.pformat(data)))
-            else:
-                response = requests.post(
-                    call_url,
-                    auth=(username, password),
-                    data=json.dumps(data, sort_keys=True), headers={'content-type': 'application/json'})
-                try:
-                    response.raise_for_status()
-                    print(
-                        'Pushed migration data for migration: {migration[revision]}, '
-                        'case: {migration[attributes][case_id]}'
-                        .format(
-                            migration=migration))
-                except Exception:
-                    pprint.pprint(response.json())
-                    raise
-            if case:
-                break
+    cache = PushCache(push_cache, client.url) if push_cache else None
+    if cache is not None and check_server:
+        known = frozenset(str(migration['uid']) for migration in client.iterate('migrations'))
+        for uid in list(cache.hashes):
+            if uid not in known:
+                cache.forget(uid)
+    call_url = client.get_url('migrations')
+    payloads = []
+    skipped = 0
+    for migration in get_migrations(alembic_config, scan_cache=scan_cache, rescan=rescan, case=case or None):
+        print(
+            'Got migration data for migration: {migration[revision]}, case: {migration[attributes][case_id]}'
+            .format(migration=migration))
+        data = {
+            "uid": migration['revision'],
+            "parent": migration['down_revision'],
+            "case": {
+                "id": str(migration['attributes']['case_id'])
+            },
+            "pre_deploy_steps": list(get_phase_steps(migration, 'before-deploy')),
+            "post_deploy_steps": list(get_phase_steps(migration, 'after-deploy')),
+            "final_steps": list(get_phase_steps(migration, 'final')),
+        }
+        if cache is not None and cache.is_pushed(data['uid'], data):
+            skipped += 1
+        elif show:
+            print('URL: {call_url}, data: \n{data}'.format(call_url=call_url, data=pprint.pformat(data)))
+        else:
+            payloads.append(data)
+    if skipped:
+        print('Skipped not changed migrations with count: {0}'.format(skipped))
 
+    def push(data):
+        client.post('migrations', data)
+        if cache is not None:
+            cache.pushed(data['uid'], data)
+        print('Pushed migration data for migration: {data[uid]}, case: {data[case][id]}'.format(data=data))
 
-def get_not_reviewed(url, username, password, alembic_config, ci_project, case=None):
+    try:
+        failed = run_dag(payloads, push, concurrency=concurrency, keep_going=True)
+    finally:
+        if cache is not None:
+            cache.save()
+    if failed:
+        for data, exc_info in failed:
+            print('Failed to push migration: {0}, error: {1!r}'.format(data['uid'], exc_info[1]))
+        print('Failed to push these migrations: {0}'.format(sorted(data['uid'] for data, exc_info in failed)))
+        sys.exit(len(failed))
+
+
+@with_client
+def get_not_reviewed(
+        url, username, password, alembic_config, ci_project, case=None, scan_cache=None, rescan=False, output='text',
+        client=None):
     """Get not reviewed migrations.
 
     :args: command line arguments namespace object
+    :param output: with 'jsonl' a json object with the case id and the revisions is written per not reviewed case
 
     :raises:
         * Exception - PDT replied with an error
         * SystemExit(<number>) - found <number> of not reviewed migrations
     """
-    config = Config(alembic_config)
-    migrations = frozenset(migration['attributes']['case_id'] for migration in get_migrations_data(config))
-    params = dict(reviewed=True, ci_project=ci_project)
-    if case:
-        params['case'] = case
-    response = requests.get(
-        '{0}/api/migrations/'.format(url),
-        params=params,
-        auth=(username, password),
-        headers={'content-type': 'application/json'}
-    )
-    try:
-        response.raise_for_status()
+    with records_output(output) as records:
+        migrations = {}
+        for migration in get_migrations(alembic_config, scan_cache=scan_cache, rescan=rescan):
+            migrations.setdefault(migration['attributes']['case_id'], []).append(migration['revision'])
+        params = dict(reviewed=True, ci_project=ci_project)
+        if case:
+            params['case'] = case
+        response_migrations = frozenset(
+            migration['case']['id'] for migration in client.iterate('migrations', params=params, cache=True))
         print('Got migration data')
-    except Exception:
-        pprint.pprint(response.json())
-        raise
-    response_migrations = frozenset(migration['case']['id'] for migration in response.json())
-    diff = migrations - response_migrations
-    if diff:
-        print('Found not reviewed migrations for these cases: {0}'.format(sorted(diff)))
-        sys.exit(len(diff))
-    else:
-        print('No not reviewed migrations found so far')
+        diff = frozenset(migrations) - response_migrations
+        if diff:
+            print('Found not reviewed migrations for these cases: {0}'.format(sorted(diff)))
+            if records is not None:
+                for case_id in sorted(diff):
+                    write_record(records, dict(case=case_id, revisions=migrations[case_id]))
+            sys.exit(len(diff))
+        else:
+            print('No not reviewed migrations found so far')
 
 
-def get_not_applied(url, username, password, instance, release, case=None):
+@with_client
+def get_not_applied(url, username, password, instance, release, case=None, output='text', client=None):
     """Get not applied migrations.
 
     :args: command line arguments namespace object
+    :param output: with 'jsonl' every not applied migration is written as a json object as soon as it's received
 
     :raises:
         * Exception - PDT replied with an error
         * SystemExit(<number>) - found <number> of not applied migrations
     """
-    params = dict(
-        exclude_status='apl', instance=instance, release=release)
-    if case:
-        params['case'] = case
-    response = requests.get(
-        '{0}/api/migrations/'.format(url),
-        params=params,
-        auth=(username, password),
-        headers={'content-type': 'application/json'}
-    )
-    try:
-        response.raise_for_status()
+    with records_output(output) as records:
+        params = dict(
+            exclude_status='apl', instance=instance, release=release)
+        if case:
+            params['case'] = case
+        response_migrations = []
+        for migration in client.iterate('migrations', params=params, cache=True):
+            if records is not None:
+                write_record(records, migration)
+            response_migrations.append(migration['case']['id'])
+        response_migrations.sort()
         print('Got migration data')
-    except Exception:
-        pprint.pprint(response.json())
-        raise
-    response_migrations = sorted(migration['case']['id'] for migration in response.json())
-    if response_migrations:
-        print('Found not applied migrations for these cases: {0}'.format(response_migrations))
-        sys.exit(len(response_migrations))
-    else:
-        print('No not applied migrations found so far')
+        if response_migrations:
+            print('Found not applied migrations for these cases: {0}'.format(response_migrations))
+            sys.exit(len(response_migrations))
+        else:
+            print('No not applied migrations found so far')
 
 
-def get_not_deployed_cases(url, username, password, ci_project, release, instance, case=None):
+@with_client
+def get_not_deployed_cases(
+        url, username, password, ci_project, release, instance, case=None, output='text', client=None):
     """Get not deployed cases.
 
     :args: command line arguments namespace object
+    :param output: with 'jsonl' every case is written as a json object instead of a tab separated line
 
     :raises:
         * Exception - PDT replied with an error
         * SystemExit(<number>) - found <number> of not applied migrations
     """
-    params = dict(ci_project=ci_project, release=release, exclude_deployed_on=instance)
-    if case:
-        params['id'] = case
-    response = requests.get(
-        '{0}/api/cases/'.format(url),
-        params=params,
-        auth=(username, password),
-        headers={'content-type': 'application/json'}
-    )
+    with records_output(output) as records:
+        params = dict(ci_project=ci_project, release=release, exclude_deployed_on=instance)
+        if case:
+            params['id'] = case
+        for case in client.iterate('cases', params=params, cache=True):
+            if records is not None:
+                write_record(records, case)
+            else:
+                print('{case[id]}\t{case[revision]}\t{case[title]}'.format(case=case))
+
+
+def get_case_id(case_id):
+    """Get the case id as a number, so the ids of the revisions and of the deployment tool are the same."""
     try:
-        response.raise_for_status()
-        for case in response.json():
-            print('{case[id]}\t{case[revision]}\t{case[title]}'.format(case=case))
-    except Exception:
-        pprint.pprint(response.json())
-        raise
+        return int(case_id)
+    except (TypeError, ValueError):
+        return case_id
+
+
+@with_client
+def check(
+        url, username, password, alembic_config, ci_project, instance, release, case=None, scan_cache=None,
+        rescan=False, report=None, output='text', client=None):
+    """Run the checks of get-not-reviewed, get-not-applied and get-not-deployed at once.
+
+    The revisions are scanned while the deployment tool lists are requested, all at the same time, then the checks
+    run on one index of the revisions, migrations and cases by case id.
+
+    :param report: path of the json report file, '-' to print it
+    :param output: with 'jsonl' a json object with the case id and its checks is written per case
+    :raises:
+        * Exception - PDT replied with an error
+        * SystemExit(<number>) - found <number> of not reviewed cases and not applied migrations, 255 at most
+    """
+    with records_output(output) as records:
+        reviewed_params = dict(reviewed=True, ci_project=ci_project)
+        applied_params = dict(exclude_status='apl', instance=instance, release=release)
+        deployed_params = dict(ci_project=ci_project, release=release, exclude_deployed_on=instance)
+        if case:
+            reviewed_params['case'] = applied_params['case'] = deployed_params['id'] = case
+        data = run_parallel(dict(
+            revisions=partial(get_migrations, alembic_config, scan_cache=scan_cache, rescan=rescan, case=case),
+            reviewed=lambda: list(client.iterate('migrations', params=reviewed_params, cache=True)),
+            not_applied=lambda: list(client.iterate('migrations', params=applied_params, cache=True)),
+            not_deployed=lambda: list(client.iterate('cases', params=deployed_params, cache=True)),
+        ))
+        print('Got migration and case data')
+        cases = {}
+
+        def get_case(case_id):
+            return cases.setdefault(get_case_id(case_id), dict(
+                revisions=[], reviewed=False, not_applied=[], deployed=True, revision=None, title=None))
+
+        for migration in data['revisions']:
+            get_case(migration['attributes']['case_id'])['revisions'].append(migration['revision'])
+        for migration in data['reviewed']:
+            get_case(migration['case']['id'])['reviewed'] = True
+        for migration in data['not_applied']:
+            get_case(migration['case']['id'])['not_applied'].append(migration['uid'])
+        for item in data['not_deployed']:
+            get_case(item['id']).update(deployed=False, revision=item['revision'], title=item['title'])
+        case_ids = sorted(cases, key=lambda case_id: (not isinstance(case_id, int), case_id))
+        not_reviewed = [
+            case_id for case_id in case_ids if cases[case_id]['revisions'] and not cases[case_id]['reviewed']]
+        not_applied = [case_id for case_id in case_ids if cases[case_id]['not_applied']]
+        not_deployed = [case_id for case_id in case_ids if not cases[case_id]['deployed']]
+        if not_reviewed:
+            print('Found not reviewed migrations for these cases: {0}'.format(not_reviewed))
+        else:
+            print('No not reviewed migrations found so far')
+        if not_applied:
+            print('Found not applied migrations for these cases: {0}'.format(not_applied))
+        else:
+            print('No not applied migrations found so far')
+        for case_id in not_deployed:
+            print('{0}\t{1[revision]}\t{1[title]}'.format(case_id, cases[case_id]))
+        if records is not None:
+            for case_id in case_ids:
+                write_record(records, dict(cases[case_id], case=case_id))
+        status = min(len(not_reviewed) + sum(len(cases[case_id]['not_applied']) for case_id in not_applied), 255)
+        if report:
+            text = json.dumps(dict(
+                status=status, not_reviewed=not_reviewed, not_applied=not_applied, not_deployed=not_deployed,
+                cases=dict((str(case_id), value) for case_id, value in cases.items())), indent=2, sort_keys=True)
+            if report == '-':
+                print(text)
+            else:
+                with open(report, 'w') as fd:
+                    fd.write(text)
+        if status:
+            sys.exit(status)
+
+
+def count_size(chunks, info):
+    """Count the size of the streamed chunks as the `sent` attribute of the span."""
+    info['sent'] = 0
+    for chunk in chunks:
+        info['sent'] += len(chunk)
+        yield chunk
 
 
-def deploy(url, username, password, instance, status, log, cases):
-    """Report the deployment."""
+@with_client
+def deploy(url, username, password, instance, status, log, cases, max_log_size=None, client=None):
+    """Report the deployment.
+
+    The log is streamed from the file to the deployment tool, with `max_log_size` only its head and tail are sent.
+    """
     data = dict(
         status=status,
         instance=dict(name=instance),
         cases=[dict(id=case) for case in cases],
-        log=log.read(),
     )
-    response = requests.post(
-        '{url}/api/deployment-reports/'.format(url=url),
-        auth=(username, password),
-        data=json.dumps(data, sort_keys=True),
-        headers={'content-type': 'application/json'}
-    )
-    try:
-        response.raise_for_status()
-        print(
-            'Reported the deployment for instance: {instance[name]}, cases: {cases}'
-            .format(**data))
-    except Exception:
-        pprint.pprint(response.json())
-        raise
+    with span('deploy', status, instance=instance) as info:
+        calls = []
+
+        def get_chunks():
+            # the log is read again when the compressed body was rejected, which a log piped to stdin doesn't allow
+            if calls:
+                log.seek(0)
+            calls.append(None)
+            chunks = read_log(log, max_size=max_log_size)
+            return count_size(chunks, info) if info is not None else chunks
+
+        client.post_stream('deployment-reports', data, 'log', get_chunks)
+    print(
+        'Reported the deployment for instance: {instance[name]}, cases: {cases}'
+        .format(**data))
 
 
 def _label_callback(data, release_numbers=None):
@@ -330,28 +781,60 @@ def _label_callback(data, release_numbers=None):
     return u'{0}\n{1}'.format(data['revision'], '\n'.join(attributes))
 
 
-def graph(url, username, password, alembic_config, filename, verbose=True):
-    """Generate a dotfile with an overview of all the migrations."""
-    config = Config(alembic_config)
+def iterate_migration_graph(migrations, label_callback):
+    """Iterate over the chunks of the graphviz dot digraph of the revisions, for writing it as it's rendered.
+
+    :param migrations: migration data list
+    :param label_callback: function getting the label of the migration data
+    :return: generator of dot source chunks
+    """
+    yield u'digraph revisions {\n\t'
+    for index, migration in enumerate(migrations):
+        yield u'{0}"{1}" [label="{2}"];'.format(
+            u'\n\t' if index else u'', migration['revision'],
+            label_callback(migration).replace('"', '\\"').replace('\n', '\\n'))
+    yield u'\n\n\t'
+    edges = (migration for migration in migrations if migration['down_revision'])
+    for index, migration in enumerate(edges):
+        yield u'{0}"{1}" -> "{2}";'.format(
+            u'\n\t' if index else u'', migration['revision'], migration['down_revision'])
+    yield u'\n}'
+
+
+def generate_migration_graph(migrations, label_callback):
+    """Generate a graphviz dot digraph of the revisions, the same as `alembic_offline.generate_migration_graph`.
+
+    :param migrations: migration data list
+    :param label_callback: function getting the label of the migration data
+    :return: dot source
+    """
+    return u''.join(iterate_migration_graph(migrations, label_callback))
+
+
+@with_client
+def graph(
+        url, username, password, alembic_config, filename, verbose=True, scan_cache=None, rescan=False, client=None):
+    """Generate a dotfile with an overview of all the migrations.
+
+    The dotfile is written while it's rendered.
+    """
+    migrations = get_migrations(alembic_config, scan_cache=scan_cache, rescan=rescan)
 
-    response = requests.get(
-        '{0}/api/migrations/'.format(url),
-        auth=(username, password),
-        headers={'content-type': 'application/json'}
-    )
     release_numbers = {}
     try:
         release_numbers = dict(
             (migration['uid'], (migration.get('release') or {}).get('number'))
-            for migration in response.json()
+            for migration in client.iterate('migrations', cache=True)
         )
     except KeyError:
         pass
 
     label_callback = partial(_label_callback, release_numbers=release_numbers)
 
-    with open(filename, 'w') as fp:
-        fp.write(generate_migration_graph(config, label_callback))
+    with span('graph', 'render', revisions=len(migrations)):
+        with open(filename, 'w') as fp:
+            for chunk in iterate_migration_graph(migrations, label_callback):
+                fp.write(chunk)
 
     if verbose:
         print("Done")
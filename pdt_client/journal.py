@@ -0,0 +1,95 @@
+"""pdt-client migration step journal."""
+import collections
+import contextlib
+import json
+import os
+import threading
+
+DEFAULT_JOURNAL = 'pdt-journal-{instance}.log'
+
+
+class Journal(object):
+
+    """Append-only journal of the applied migration steps.
+
+    Every applied step is recorded with its status and report before the report is posted, and is marked as sent
+    once the deployment tool confirmed the report. Every entry is synced to the disk, so the journal of the run
+    which was killed tells which steps already ran and which reports were never sent.
+    """
+
+    def __init__(self, path, resume=False):
+        """Open the journal.
+
+        :param path: journal file path
+        :param resume: read the journal of the previous run, otherwise start an empty one
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.steps = collections.OrderedDict()
+        size = 0
+        if resume and os.path.exists(path):
+            with open(path, 'rb') as fd:
+                for line in fd:
+                    if not line.endswith(b'\n'):
+                        # the line being written when the process was killed
+                        break
+                    size += len(line)
+                    entry = json.loads(line.decode('utf-8'))
+                    if entry.get('sent'):
+                        if entry['step'] in self.steps:
+                            self.steps[entry['step']]['sent'] = True
+                    else:
+                        self.steps[entry['step']] = entry
+        self.file = open(path, 'a' if resume else 'w')
+        if resume:
+            # drop the torn line, so the next entry starts on its own line
+            self.file.truncate(size)
+
+    def write(self, entry):
+        """Append the entry to the journal and sync it to the disk."""
+        with self.lock:
+            self.file.write(json.dumps(entry, sort_keys=True) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def applied(self, step_id):
+        """Check if the step was applied successfully."""
+        return self.steps.get(step_id, {}).get('status') == 'apl'
+
+    def unsent(self):
+        """Get the reports of the applied steps which were not confirmed by the deployment tool."""
+        return [entry['report'] for entry in self.steps.values() if not entry.get('sent')]
+
+    def step(self, step_id, status, report):
+        """Record the applied step with its report."""
+        entry = dict(step=step_id, status=status, report=report)
+        self.write(entry)
+        self.steps[step_id] = entry
+
+    def sent(self, step_id):
+        """Record that the step report was confirmed by the deployment tool."""
+        self.write(dict(step=step_id, sent=True))
+        if step_id in self.steps:
+            self.steps[step_id]['sent'] = True
+
+    def close(self):
+        """Close the journal file."""
+        self.file.close()
+
+
+@contextlib.contextmanager
+def open_journal(path, resume=False):
+    """Open the journal, remove it when all the migrations were applied and reported.
+
+    :param path: journal file path, None to not keep the journal
+    :param resume: read the journal of the previous run
+    """
+    if not path:
+        yield None
+        return
+    journal = Journal(path, resume=resume)
+    try:
+        yield journal
+    finally:
+        journal.close()
+    os.remove(path)
@@ -0,0 +1,152 @@
+"""pdt-client metrics in the Prometheus text exposition format."""
+import collections
+import os
+import threading
+import time
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+SIZE_BUCKETS = tuple(256 * 4 ** power for power in range(10))
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METRICS = collections.OrderedDict((
+    ('pdt_client_step_duration_seconds', ('histogram', 'Migration step execution time by step type.')),
+    ('pdt_client_step_report_bytes', ('histogram', 'Size of the migration step reports by step type.')),
+    ('pdt_client_http_request_duration_seconds', ('histogram', 'Deployment tool request latency by endpoint.')),
+    ('pdt_client_http_requests_total', ('counter', 'Deployment tool requests by endpoint and status.')),
+    ('pdt_client_http_sent_bytes_total', ('counter', 'Deployment tool request body bytes by endpoint.')),
+    ('pdt_client_http_received_bytes_total', ('counter', 'Deployment tool response body bytes by endpoint.')),
+    ('pdt_client_deploy_log_bytes_total', ('counter', 'Deployment log characters reported by status.')),
+    ('pdt_client_command_duration_seconds', ('gauge', 'Duration of the last command run.')),
+    ('pdt_client_command_success', ('gauge', 'Whether the last command run succeeded.')),
+    ('pdt_client_command_last_run_timestamp_seconds', ('gauge', 'Time the last command run finished.')),
+))
+
+
+def format_labels(labels):
+    """Format the labels of the sample."""
+    if not labels:
+        return ''
+    return '{{{0}}}'.format(','.join(
+        '{0}="{1}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels))
+
+
+def format_value(value):
+    """Format the sample value."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics(object):
+
+    """Collector of the metrics of the command run.
+
+    The metrics are taken from the spans of `pdt_client.profiling`, so enable it with `profiling.enable`: step
+    execution time and report size by step type, deployment tool request latency, count and bytes by endpoint,
+    and the deployment log size.
+    """
+
+    def __init__(self, command):
+        """Create the empty metrics.
+
+        :param command: command name, the label of all the metrics
+        """
+        self.command = command
+        self.lock = threading.Lock()
+        self.counters = collections.defaultdict(float)
+        self.histograms = {}
+        self.gauges = {}
+        self.start = time.time()
+
+    def get_key(self, name, **labels):
+        """Get the key of the metric with the labels."""
+        return name, tuple(sorted((label, str(value)) for label, value in dict(labels, command=self.command).items()))
+
+    def inc(self, name, value=1, **labels):
+        """Increase the counter."""
+        self.counters[self.get_key(name, **labels)] += value
+
+    def observe(self, name, value, buckets, **labels):
+        """Add the value to the histogram."""
+        key = self.get_key(name, **labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = dict(buckets=buckets, counts=[0] * len(buckets), sum=0, count=0)
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                histogram['counts'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+    def record(self, kind, name, start, duration, attributes):
+        """Update the metrics with the finished span."""
+        with self.lock:
+            if kind in ('sql', 'script'):
+                labels = dict(kind=kind, type=name, status=attributes.get('status', 'err'))
+                self.observe('pdt_client_step_duration_seconds', duration, DURATION_BUCKETS, **labels)
+                if 'report' in attributes:
+                    self.observe('pdt_client_step_report_bytes', attributes['report'], SIZE_BUCKETS, **labels)
+            elif kind == 'http':
+                endpoint = name.split(' ', 1)[1]
+                self.observe(
+                    'pdt_client_http_request_duration_seconds', duration, DURATION_BUCKETS,
+                    method=attributes['method'], endpoint=endpoint)
+                self.inc(
+                    'pdt_client_http_requests_total', method=attributes['method'], endpoint=endpoint,
+                    status=attributes.get('status', attributes.get('error')))
+                self.inc('pdt_client_http_sent_bytes_total', attributes.get('sent') or 0, endpoint=endpoint)
+                self.inc('pdt_client_http_received_bytes_total', attributes.get('received') or 0, endpoint=endpoint)
+            elif kind == 'deploy':
+                self.inc('pdt_client_deploy_log_bytes_total', attributes.get('sent') or 0, status=name)
+
+    def finish(self, success):
+        """Record the duration and the result of the command run."""
+        with self.lock:
+            now = time.time()
+            key = self.get_key
+            self.gauges[key('pdt_client_command_duration_seconds')] = now - self.start
+            self.gauges[key('pdt_client_command_success')] = int(success)
+            self.gauges[key('pdt_client_command_last_run_timestamp_seconds')] = now
+
+    def format(self):
+        """Get the metrics in the Prometheus text exposition format."""
+        samples = collections.defaultdict(list)
+        with self.lock:
+            for (name, labels), value in sorted(list(self.counters.items()) + list(self.gauges.items())):
+                samples[name].append((name, labels, value))
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                bounds = histogram['buckets'] + (float('inf'),)
+                for bound, count in zip(bounds, histogram['counts'] + [histogram['count']]):
+                    samples[name].append((name + '_bucket', labels + (('le', format_value(bound)),), count))
+                samples[name].append((name + '_sum', labels, histogram['sum']))
+                samples[name].append((name + '_count', labels, histogram['count']))
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            if name not in samples:
+                continue
+            lines.append('# HELP {0} {1}'.format(name, description))
+            lines.append('# TYPE {0} {1}'.format(name, metric_type))
+            for sample, labels, value in samples[name]:
+                lines.append('{0}{1} {2}'.format(sample, format_labels(labels), format_value(value)))
+        return ''.join(line + '\n' for line in lines)
+
+    def write(self, path):
+        """Write the metrics file for the textfile collector of the node exporter atomically."""
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as fd:
+            fd.write(self.format())
+        os.rename(tmp, path)
+
+    def push(self, url, timeout=None):
+        """Push the metrics to the Pushgateway compatible url, replacing the metrics of the same grouping key.
+
+        :param url: url of the group, e.g. http://localhost:9091/metrics/job/pdt-client/instance/staging
+        :param timeout: request timeout
+        :raises: Exception if the gateway replied with an error
+        """
+        import requests
+
+        response = requests.put(
+            url, data=self.format().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE}, timeout=timeout)
+        response.raise_for_status()
@@ -0,0 +1,150 @@
+"""pdt-client script running."""
+import collections
+import sys
+
+try:
+    import subprocess32 as subprocess
+except ImportError:  # pragma: no cover
+    import subprocess
+
+DEFAULT_HEAD = 100
+DEFAULT_TAIL = 400
+DEFAULT_LOG_SIZE = 10 * 1024 * 1024
+DEFAULT_LOG_BACKUPS = 5
+MAX_LINE_SIZE = 64 * 1024
+LOG_CHUNK_SIZE = 64 * 1024
+DEFAULT_SCRIPT_LOG = 'pdt-scripts-{instance}.log'
+
+
+class OutputBuffer(object):
+
+    """Keep the first and the last lines of the output, count the lines in between."""
+
+    def __init__(self, head=DEFAULT_HEAD, tail=DEFAULT_TAIL):
+        """Create empty buffers.
+
+        :param head: number of the first lines kept
+        :param tail: number of the last lines kept
+        """
+        self.head_size = head
+        self.head = []
+        self.tail = collections.deque(maxlen=tail)
+        self.skipped = 0
+
+    def append(self, line):
+        """Add the output line."""
+        if len(self.head) < self.head_size:
+            self.head.append(line)
+            return
+        if len(self.tail) == self.tail.maxlen:
+            self.skipped += 1
+        self.tail.append(line)
+
+    def get_text(self, log=None):
+        """Get the kept output."""
+        lines = list(self.head)
+        if self.skipped:
+            lines.append('... skipped lines with count: {0}{1} ...\n'.format(
+                self.skipped, ', full output is in the log file: {0}'.format(log) if log else ''))
+        lines.extend(self.tail)
+        return ''.join(lines).rstrip('\n')
+
+
+def read_log(fd, max_size=None, chunk_size=LOG_CHUNK_SIZE):
+    """Read the log file chunk by chunk, keeping only its head and tail if it's too large.
+
+    The head is yielded as it's read, at most the tail and one chunk are kept in memory.
+
+    :param fd: log file object
+    :param max_size: maximum number of characters of the log, None for the whole log
+    :param chunk_size: number of characters read at once
+    :return: generator of log chunks
+    """
+    if not max_size:
+        for chunk in iter(lambda: fd.read(chunk_size), ''):
+            yield chunk
+        return
+    head = max_size // 2
+    read = 0
+    while read < head:
+        chunk = fd.read(min(chunk_size, head - read))
+        if not chunk:
+            return
+        read += len(chunk)
+        yield chunk
+    tail_max_size = max_size - head
+    tail = collections.deque()
+    tail_size = skipped = 0
+    for chunk in iter(lambda: fd.read(chunk_size), ''):
+        tail.append(chunk)
+        tail_size += len(chunk)
+        while tail_size > tail_max_size:
+            excess = min(tail_size - tail_max_size, len(tail[0]))
+            tail[0] = tail[0][excess:]
+            if not tail[0]:
+                tail.popleft()
+            tail_size -= excess
+            skipped += excess
+    if skipped:
+        yield '\n... skipped characters with count: {0} ...\n'.format(skipped)
+    for chunk in tail:
+        yield chunk
+
+
+def get_output_logger(path, max_bytes=DEFAULT_LOG_SIZE, backups=DEFAULT_LOG_BACKUPS):
+    """Get the logger writing the full script output to the rotating log file.
+
+    :param path: log file path
+    :param max_bytes: size of the log file after which it's rotated
+    :param backups: number of the rotated log files kept
+    """
+    import logging
+    import logging.handlers
+
+    logger = logging.getLogger('pdt_client.process.{0}'.format(path))
+    if not logger.handlers:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+def run_script(args, log=None, head=DEFAULT_HEAD, tail=DEFAULT_TAIL):
+    """Run the script, streaming its output line by line.
+
+    Output lines are written to the console and to the log file as soon as they are read, only the first and
+    the last lines are kept in memory.
+
+    :param args: script command line
+    :param log: path of the rotating log file for the full output, None to not write it
+    :param head: number of the first output lines returned
+    :param tail: number of the last output lines returned
+
+    :return: first and last output lines
+    :raises: subprocess.CalledProcessError if the script failed, the output lines are in its `output`
+    """
+    logger = get_output_logger(log) if log else None
+    if logger:
+        logger.info('-- Running script: %s', ' '.join(args))
+    output = OutputBuffer(head=head, tail=tail)
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        for line in iter(lambda: process.stdout.readline(MAX_LINE_SIZE), b''):
+            text = line.decode('utf-8', 'replace')
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            if logger:
+                logger.info(text.rstrip('\n'))
+            output.append(text)
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    text = output.get_text(log)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, args, output=text)
+    return text
@@ -0,0 +1,113 @@
+"""pdt-client timing instrumentation."""
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+profilers = []
+
+
+class Profiler(object):
+
+    """Collector of the timed spans of the command.
+
+    Spans are recorded by `span` while the profiler is enabled, from any thread. Spans of the processes started by
+    `migrate --manifest` are not collected.
+    """
+
+    def __init__(self):
+        """Create the empty profiler."""
+        self.spans = []
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+    def record(self, kind, name, start, duration, attributes):
+        """Record the finished span."""
+        with self.lock:
+            self.spans.append(dict(
+                kind=kind, name=name, start=start, duration=duration, thread=threading.current_thread().ident,
+                attributes=attributes))
+
+    def get_summary(self):
+        """Get the spans summary by kind and name.
+
+        :return: list of dicts with kind, name, count, total, mean and max durations in seconds, and bytes sent and
+            received, ordered by the total duration descending
+        """
+        groups = collections.OrderedDict()
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            group = groups.setdefault((span['kind'], span['name']), dict(
+                kind=span['kind'], name=span['name'], count=0, total=0.0, max=0.0, sent=0, received=0))
+            group['count'] += 1
+            group['total'] += span['duration']
+            group['max'] = max(group['max'], span['duration'])
+            group['sent'] += span['attributes'].get('sent') or 0
+            group['received'] += span['attributes'].get('received') or 0
+        for group in groups.values():
+            group['mean'] = group['total'] / group['count']
+        return sorted(groups.values(), key=lambda group: -group['total'])
+
+    def print_summary(self, file=None):
+        """Print the summary table of the spans."""
+        file = file or sys.stderr
+        rows = [('kind', 'name', 'count', 'total', 'mean', 'max', 'sent', 'received')]
+        for group in self.get_summary():
+            rows.append((
+                group['kind'], group['name'], str(group['count']), '{0:.3f}s'.format(group['total']),
+                '{0:.3f}s'.format(group['mean']), '{0:.3f}s'.format(group['max']), str(group['sent']),
+                str(group['received'])))
+        widths = [max(len(row[index]) for row in rows) for index in range(len(rows[0]))]
+        file.write('-- Profile of the command run in {0:.3f}s\n'.format(time.time() - self.start))
+        for row in rows:
+            file.write('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() + '\n')
+
+    def write_trace(self, path):
+        """Write the spans to the json file in the trace event format of chrome://tracing and Perfetto."""
+        with self.lock:
+            spans = list(self.spans)
+        events = [dict(
+            name=span['name'], cat=span['kind'], ph='X', pid=os.getpid(), tid=span['thread'],
+            ts=int((span['start'] - self.start) * 1e6), dur=int(span['duration'] * 1e6), args=span['attributes'])
+            for span in spans]
+        with open(path, 'w') as fd:
+            json.dump(dict(traceEvents=events), fd)
+
+
+def enable(profiler):
+    """Start recording the spans to the profiler, or to any object with the same `record` method."""
+    profilers.append(profiler)
+
+
+def disable(profiler):
+    """Stop recording the spans to the profiler."""
+    profilers.remove(profiler)
+
+
+@contextlib.contextmanager
+def span(kind, name, **attributes):
+    """Time the block as a span, when a profiler is enabled.
+
+    :param kind: span kind: http, sql, script, scan, graph or deploy
+    :param name: span name, spans of the same kind and name are summarized together
+    :param attributes: span attributes, the block can add more to the yielded dict
+    :return: context manager yielding the attributes dict, None when no profiler is enabled so the block doesn't
+        compute the attributes for nothing
+    """
+    if not profilers:
+        yield None
+        return
+    start = time.time()
+    try:
+        yield attributes
+    except Exception as exc:
+        attributes['error'] = type(exc).__name__
+        raise
+    finally:
+        duration = time.time() - start
+        for profiler in list(profilers):
+            profiler.record(kind, name, start, duration, attributes)
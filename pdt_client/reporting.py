@@ -0,0 +1,279 @@
+"""pdt-client migration step reporting."""
+import json
+import os
+import threading
+import time
+import traceback
+
+from six.moves import queue
+
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_BATCH_INTERVAL = 5
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 1
+DEFAULT_SPOOL = 'pdt-step-reports-{instance}.spool'
+
+
+class StepReporter(object):
+
+    """Report migration steps to the deployment tool one by one."""
+
+    def __init__(self, client, journal=None):
+        """Store the deployment tool client.
+
+        :param client: deployment tool client
+        :param journal: migration step journal to record the confirmed reports in
+        """
+        self.client = client
+        self.journal = journal
+        self.pending = []
+
+    def report(self, data):
+        """Report the migration step."""
+        self.client.post('migration-step-reports', data)
+        self.sent(data)
+
+    def sent(self, data):
+        """Record that the report was confirmed by the deployment tool."""
+        if self.journal is not None:
+            self.journal.sent(data['step']['id'])
+
+    def flush(self):
+        """Send all the queued reports."""
+
+    def close(self):
+        """Send all the queued reports before the reporter is dropped."""
+        self.flush()
+
+    def __enter__(self):
+        """Use the reporter as a context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        """Send the queued reports also when applying migrations failed, without hiding that failure."""
+        try:
+            self.close()
+        except Exception:
+            if exc_type is None:
+                raise
+            traceback.print_exc()
+
+
+class BatchStepReporter(StepReporter):
+
+    """Queue migration step reports and post them in batches.
+
+    The queue is flushed when it's full or when the oldest queued report waited longer than the interval.
+    Batches are posted to the bulk endpoint. If the deployment tool doesn't have one, the reports are posted
+    one by one.
+    """
+
+    def __init__(self, client, batch_size=DEFAULT_BATCH_SIZE, interval=DEFAULT_BATCH_INTERVAL, journal=None):
+        """Create an empty queue.
+
+        :param client: deployment tool client
+        :param batch_size: maximum number of queued reports
+        :param interval: maximum number of seconds a report is kept in the queue
+        :param journal: migration step journal to record the confirmed reports in
+        """
+        super(BatchStepReporter, self).__init__(client, journal=journal)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = []
+        self.queued_at = None
+        self.bulk = True
+
+    def report(self, data):
+        """Queue the migration step report, flush the queue if needed."""
+        if not self.queue:
+            self.queued_at = time.time()
+        self.queue.append(data)
+        if len(self.queue) >= self.batch_size or time.time() - self.queued_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Post all the queued reports."""
+        import requests
+
+        reports, self.queue = self.queue, []
+        if not reports:
+            return
+        if self.bulk:
+            try:
+                self.client.post('migration-step-reports/bulk', reports)
+                for data in reports:
+                    self.sent(data)
+                return
+            except requests.HTTPError as exc:
+                if exc.response is None or exc.response.status_code not in (404, 405):
+                    raise
+                print('Bulk step reports are not supported by the deployment tool, reporting one by one')
+                self.bulk = False
+        for data in reports:
+            super(BatchStepReporter, self).report(data)
+
+
+class SynchronizedStepReporter(object):
+
+    """Report migration steps applied in several threads through one reporter."""
+
+    def __init__(self, reporter):
+        """Wrap the reporter.
+
+        :param reporter: step reporter which is not thread safe
+        """
+        self.reporter = reporter
+        self.lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Get the reports the wrapped reporter resends."""
+        return self.reporter.pending
+
+    def report(self, data):
+        """Report the migration step, one thread at a time."""
+        with self.lock:
+            self.reporter.report(data)
+
+
+def read_spool(spool):
+    """Read the not confirmed reports from the spool file.
+
+    :param spool: spool file path
+    :return: list of report data dicts
+    """
+    reports = []
+    confirmed = 0
+    if os.path.exists(spool):
+        with open(spool) as fd:
+            for line in fd:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the line being written when the process was killed
+                    continue
+                if 'report' in entry:
+                    reports.append(entry['report'])
+                else:
+                    confirmed += 1
+    return reports[confirmed:]
+
+
+class ThreadedStepReporter(StepReporter):
+
+    """Post migration step reports from a background thread.
+
+    Reports are posted one by one in the order of the steps, so the next step doesn't wait for the deployment
+    tool. Every report is appended to the spool file before it's queued and is marked there once it's
+    confirmed, so the reports not confirmed when the process ended are posted by the next run first.
+    """
+
+    def __init__(
+            self, client, spool, queue_size=DEFAULT_QUEUE_SIZE, retries=DEFAULT_RETRIES,
+            retry_delay=DEFAULT_RETRY_DELAY, journal=None):
+        """Start the worker thread, queue the reports left in the spool file.
+
+        :param client: deployment tool client
+        :param spool: spool file path
+        :param queue_size: number of queued reports after which reporting blocks
+        :param retries: number of retries of a failed post
+        :param retry_delay: delay before the first retry in seconds, doubled for every next retry
+        :param journal: migration step journal to record the confirmed reports in
+        """
+        super(ThreadedStepReporter, self).__init__(client, journal=journal)
+        self.spool = spool
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.spooled = self.confirmed = 0
+        self.error = None
+        self.pending = pending = read_spool(spool)
+        with open(spool + '.tmp', 'w') as fd:
+            for data in pending:
+                fd.write(json.dumps(dict(report=data), sort_keys=True) + '\n')
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.rename(spool + '.tmp', spool)
+        self.spool_file = open(spool, 'a')
+        self.thread = threading.Thread(target=self.work)
+        self.thread.daemon = True
+        self.thread.start()
+        if pending:
+            print('Resending step reports from the spool file with count: {0}'.format(len(pending)))
+            self.spooled = len(pending)
+            for data in pending:
+                self.queue.put(data)
+
+    def write(self, entry):
+        """Append the entry to the spool file and sync it to the disk."""
+        with self.lock:
+            self.spool_file.write(json.dumps(entry, sort_keys=True) + '\n')
+            self.spool_file.flush()
+            os.fsync(self.spool_file.fileno())
+
+    def report(self, data):
+        """Spool and queue the migration step report."""
+        self.write(dict(report=data))
+        self.spooled += 1
+        self.queue.put(data)
+
+    def send(self, data):
+        """Post the report, retrying on errors."""
+        for attempt in range(self.retries + 1):
+            try:
+                return super(ThreadedStepReporter, self).report(data)
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+    def work(self):
+        """Post the queued reports until the stop marker is got."""
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            if self.error:
+                # keep the order, the rest stays in the spool file
+                continue
+            try:
+                self.send(data)
+            except Exception as exc:
+                traceback.print_exc()
+                self.error = exc
+            else:
+                self.write(dict(confirmed=True))
+                self.confirmed += 1
+
+    def close(self):
+        """Wait until all the queued reports are posted.
+
+        :raises: RuntimeError if some reports were not confirmed, they are kept in the spool file
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.spool_file.close()
+        if self.error:
+            raise RuntimeError(
+                'Step reports with count {0} were not confirmed by the deployment tool, '
+                'they are kept in the spool file: {1}'.format(self.spooled - self.confirmed, self.spool))
+        os.remove(self.spool)
+
+
+def get_reporter(
+        client, batch_size=DEFAULT_BATCH_SIZE, batch_interval=DEFAULT_BATCH_INTERVAL, spool=None, journal=None):
+    """Get the step reporter for the given batch size.
+
+    :param client: deployment tool client
+    :param batch_size: number of reports posted at once, 1 to post every report as soon as the step is applied
+    :param batch_interval: maximum number of seconds a report is queued
+    :param spool: spool file path to post the reports from the background thread, batches are not used then
+    :param journal: migration step journal to record the confirmed reports in
+    """
+    if spool:
+        return ThreadedStepReporter(client, spool, journal=journal)
+    if batch_size > 1:
+        return BatchStepReporter(client, batch_size=batch_size, interval=batch_interval, journal=journal)
+    return StepReporter(client, journal=journal)
@@ -0,0 +1,117 @@
+"""pdt-client migration scheduling."""
+import collections
+import sys
+import threading
+
+import six
+from six.moves import queue
+
+DEFAULT_CONCURRENCY = 1
+
+
+def get_parents(migration):
+    """Get the parent uids of the migration.
+
+    :param migration: migration data dict, its `parent` is a uid, a list of uids for a merge migration, or empty
+    :return: tuple of the parent uids
+    """
+    parent = migration.get('parent')
+    if not parent:
+        return ()
+    if isinstance(parent, (list, tuple)):
+        return tuple(parent)
+    return (parent,)
+
+
+def run_dag(migrations, apply, concurrency=DEFAULT_CONCURRENCY, keep_going=False):
+    """Apply the migrations concurrently, never a child before its parents.
+
+    Parents which are not in the list are considered applied. Migrations which are ready are started in the list
+    order. When a migration fails no more migrations are started, the running ones are waited for and the first
+    error is raised. With `keep_going` only the descendants of the failed migrations are not started, and the
+    failures are returned.
+
+    :param migrations: list of migration data dicts
+    :param apply: function applying one migration
+    :param concurrency: maximum number of migrations applied at the same time
+    :param keep_going: apply the migrations which don't depend on the failed ones
+    :return: list of (migration, exc_info) tuples of the failed migrations
+    :raises: ValueError if the parent links have a cycle
+    """
+    uids = frozenset(migration['uid'] for migration in migrations)
+    waiting = {}
+    children = collections.defaultdict(list)
+    ready = collections.deque()
+    for migration in migrations:
+        parents = set(parent for parent in get_parents(migration) if parent in uids)
+        waiting[migration['uid']] = parents
+        for parent in parents:
+            children[parent].append(migration)
+        if not parents:
+            ready.append(migration)
+    done = queue.Queue()
+
+    def work(migration):
+        try:
+            apply(migration)
+            done.put((migration, None))
+        except BaseException:
+            done.put((migration, sys.exc_info()))
+
+    running = applied = 0
+    error = None
+    failed = []
+    while running or (ready and error is None):
+        while ready and error is None and running < concurrency:
+            thread = threading.Thread(target=work, args=(ready.popleft(),))
+            thread.daemon = True
+            thread.start()
+            running += 1
+        migration, exc_info = done.get()
+        running -= 1
+        if exc_info is not None:
+            print('-- Failed to apply migration: {0}'.format(migration['uid']))
+            failed.append((migration, exc_info))
+            if not keep_going:
+                error = error or exc_info
+            continue
+        applied += 1
+        for child in children[migration['uid']]:
+            waiting[child['uid']].discard(migration['uid'])
+            if not waiting[child['uid']]:
+                ready.append(child)
+    if failed:
+        print('-- Migrations left not applied after the failure with count: {0}'.format(len(migrations) - applied))
+        if error is not None:
+            six.reraise(*error)
+        return failed
+    if applied != len(migrations):
+        raise ValueError('Migrations with count {0} have cyclic parent links'.format(len(migrations) - applied))
+    return failed
+
+
+def run_parallel(calls):
+    """Call the functions at the same time, each in its own thread.
+
+    :param calls: dict of the functions without arguments by name
+    :return: dict of the function results by name
+    :raises: the error of the first failed function, after all of them finished
+    """
+    results = {}
+    errors = []
+
+    def work(name, func):
+        try:
+            results[name] = func()
+        except BaseException:
+            errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=work, args=item) for item in calls.items()]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        six.reraise(*errors[0])
+    return results
@@ -1,7 +1,29 @@
 """pdt-client command line script."""
 import argparse
 
-from . import commands
+from . import commands, profiling
+from .cache import (
+    DEFAULT_HTTP_CACHE,
+    DEFAULT_HTTP_CACHE_SIZE,
+    DEFAULT_HTTP_CACHE_TTL,
+    DEFAULT_PUSH_CACHE,
+    DEFAULT_SCAN_CACHE,
+    ResponseCache,
+)
+from .client import (
+    Client,
+    DEFAULT_COMPRESS_THRESHOLD,
+    DEFAULT_PAGE_SIZE,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_RETRIES,
+    DEFAULT_RETRY_BACKOFF,
+    DEFAULT_RETRY_STATUSES,
+)
+from .journal import DEFAULT_JOURNAL
+from .metrics import Metrics
+from .process import DEFAULT_SCRIPT_LOG
+from .reporting import DEFAULT_BATCH_INTERVAL, DEFAULT_BATCH_SIZE, DEFAULT_SPOOL
+from .scheduler import DEFAULT_CONCURRENCY
 
 
 def main():
@@ -30,6 +52,131 @@ def main():
         required=False,
         default=deployment_url
     )
+    parser.add_argument(
+        "--pool-size",
+        dest="pool_size",
+        type=int,
+        metavar="SIZE",
+        help="Maximum number of kept alive deployment tool connections. Defaults to {0}".format(DEFAULT_POOL_SIZE),
+        required=False,
+        default=DEFAULT_POOL_SIZE
+    )
+    parser.add_argument(
+        "--timeout",
+        dest="timeout",
+        type=float,
+        metavar="SECONDS",
+        help="Deployment tool request timeout. Defaults to no timeout",
+        required=False,
+    )
+    parser.add_argument(
+        "--page-size",
+        dest="page_size",
+        type=int,
+        metavar="SIZE",
+        help="Number of items requested per deployment tool list page, 0 to request whole lists at once. "
+        "Defaults to {0}".format(DEFAULT_PAGE_SIZE),
+        required=False,
+        default=DEFAULT_PAGE_SIZE
+    )
+    parser.add_argument(
+        "--retries",
+        dest="retries",
+        type=int,
+        metavar="NUMBER",
+        help="Maximum number of retries of a failed deployment tool request. Defaults to {0}".format(DEFAULT_RETRIES),
+        required=False,
+        default=DEFAULT_RETRIES
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        dest="retry_backoff",
+        type=float,
+        metavar="SECONDS",
+        help="Maximum delay before the first retry, doubled for every next retry. "
+        "Defaults to {0}".format(DEFAULT_RETRY_BACKOFF),
+        required=False,
+        default=DEFAULT_RETRY_BACKOFF
+    )
+    parser.add_argument(
+        "--retry-status",
+        dest="retry_statuses",
+        type=int,
+        action="append",
+        metavar="STATUS",
+        help="Response status code after which the request is retried, can be repeated. "
+        "Defaults to {0}".format(', '.join(str(status) for status in DEFAULT_RETRY_STATUSES)),
+        required=False,
+    )
+    parser.add_argument(
+        "--compress-threshold",
+        dest="compress_threshold",
+        type=int,
+        metavar="BYTES",
+        help="Size of the deployment tool request body from which it's sent gzip compressed, 0 to not compress. "
+        "The deployment tool has to accept gzip compressed requests. "
+        "Defaults to {0}".format(DEFAULT_COMPRESS_THRESHOLD),
+        required=False,
+        default=DEFAULT_COMPRESS_THRESHOLD
+    )
+    parser.add_argument(
+        "--http-cache",
+        dest="http_cache",
+        metavar="PATH",
+        help="Directory of the cached deployment tool responses to the read-only queries, pass an empty value to not "
+        "cache them. Defaults to {0}".format(DEFAULT_HTTP_CACHE),
+        required=False,
+        default=DEFAULT_HTTP_CACHE
+    )
+    parser.add_argument(
+        "--http-cache-ttl",
+        dest="http_cache_ttl",
+        type=float,
+        metavar="SECONDS",
+        help="Number of seconds a cached response is used without asking the deployment tool, older ones are "
+        "revalidated. Defaults to {0}".format(DEFAULT_HTTP_CACHE_TTL),
+        required=False,
+        default=DEFAULT_HTTP_CACHE_TTL
+    )
+    parser.add_argument(
+        "--http-cache-size",
+        dest="http_cache_size",
+        type=int,
+        metavar="BYTES",
+        help="Maximum size of the response cache. Defaults to {0}".format(DEFAULT_HTTP_CACHE_SIZE),
+        required=False,
+        default=DEFAULT_HTTP_CACHE_SIZE
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        help="Print the time spent in the deployment tool requests, SQL and script steps, revision scanning and "
+        "graph rendering when the command exits",
+    )
+    parser.add_argument(
+        "--profile-trace",
+        dest="profile_trace",
+        metavar="PATH",
+        help="Write the timed spans of --profile to the json file in the trace event format",
+        required=False,
+    )
+    parser.add_argument(
+        "--metrics-file",
+        dest="metrics_file",
+        metavar="PATH",
+        help="Write the step, request and deployment log metrics to the file in the Prometheus text format, "
+        "e.g. to the directory of the node exporter textfile collector",
+        required=False,
+    )
+    parser.add_argument(
+        "--metrics-push",
+        dest="metrics_push",
+        metavar="URL",
+        help="Push the metrics to the Pushgateway compatible url, "
+        "e.g. http://localhost:9091/metrics/job/pdt-client/instance/staging",
+        required=False,
+    )
     subparsers = parser.add_subparsers(help="sub-command help", dest='command')
     subparsers.required = True
     add_subparser_migrate(subparsers)
@@ -37,9 +184,91 @@ def main():
     add_subparser_case_data(subparsers)
     add_subparser_deploy(subparsers)
     add_subparser_graph(subparsers)
+    add_subparser_check(subparsers)
     args = parser.parse_args()
     if hasattr(args, 'func'):
-        args.func(args)
+        profiler = None
+        if args.profile or args.profile_trace:
+            profiler = profiling.Profiler()
+            profiling.enable(profiler)
+        collector = None
+        if args.metrics_file or args.metrics_push:
+            collector = Metrics(' '.join(filter(None, (
+                args.command, getattr(args, 'migration_data_command', None),
+                getattr(args, 'case_data_command', None)))))
+            profiling.enable(collector)
+        args.client = get_client(args)
+        success = False
+        try:
+            args.func(args)
+            success = True
+        except SystemExit as exc:
+            success = not exc.code
+            raise
+        finally:
+            args.client.close()
+            if profiler is not None:
+                profiling.disable(profiler)
+                profiler.print_summary()
+                if args.profile_trace:
+                    profiler.write_trace(args.profile_trace)
+            if collector is not None:
+                profiling.disable(collector)
+                collector.finish(success)
+                if args.metrics_file:
+                    collector.write(args.metrics_file)
+                if args.metrics_push:
+                    collector.push(args.metrics_push, timeout=args.timeout)
+
+
+def get_client(args):
+    """Create the deployment tool client from the command line arguments."""
+    return Client(
+        url=args.url,
+        username=args.username,
+        password=args.password,
+        pool_size=args.pool_size,
+        timeout=args.timeout,
+        page_size=args.page_size,
+        retries=args.retries,
+        retry_backoff=args.retry_backoff,
+        retry_statuses=args.retry_statuses or DEFAULT_RETRY_STATUSES,
+        cache=ResponseCache(
+            args.http_cache, ttl=args.http_cache_ttl, max_size=args.http_cache_size) if args.http_cache else None,
+        compress_threshold=args.compress_threshold,
+    )
+
+
+def add_scan_cache_arguments(parser):
+    """Add the alembic revision scan cache arguments to the subparser."""
+    parser.add_argument(
+        "--scan-cache",
+        dest="scan_cache",
+        metavar="PATH",
+        help="file with the parsed migration data of the revision files, only changed revision files are parsed, "
+        "pass an empty value to parse all of them. Defaults to {0}".format(DEFAULT_SCAN_CACHE),
+        required=False,
+        default=DEFAULT_SCAN_CACHE,
+    )
+    parser.add_argument(
+        "--rescan",
+        dest="rescan",
+        action="store_true",
+        help="clear the scan cache and parse all the revision files",
+    )
+
+
+def add_output_argument(parser):
+    """Add the output format argument to the query command subparser."""
+    parser.add_argument(
+        "--output",
+        dest="output",
+        choices=commands.OUTPUT_FORMATS,
+        help="output format, jsonl streams a json object per migration or case to the standard output and the "
+        "messages to the standard error. Defaults to text",
+        required=False,
+        default='text',
+    )
 
 
 def add_subparser_migrate(subparsers):
@@ -49,8 +278,8 @@ def add_subparser_migrate(subparsers):
         "--instance",
         dest="instance",
         metavar="INSTANCE_NAME",
-        help="instance for migration",
-        required=True,
+        help="instance for migration, required unless --manifest is used",
+        required=False,
     )
     phase_options = sorted(commands.MIGRATION_PHASE_MAPPING.keys())
     parser_migrate.add_argument(
@@ -86,8 +315,34 @@ def add_subparser_migrate(subparsers):
         "--connection-string",
         dest="connection_string",
         metavar="CONNECTION_STRING",
-        help="connection string",
-        required=True,
+        help="connection string, required unless --manifest is used",
+        required=False,
+    )
+    parser_migrate.add_argument(
+        "--manifest",
+        dest="manifest",
+        metavar="PATH",
+        help="json file with an object mapping instance names to connection strings, to migrate all the instances",
+        required=False,
+    )
+    parser_migrate.add_argument(
+        "--jobs",
+        dest="jobs",
+        type=int,
+        metavar="NUMBER",
+        help="number of instances of the manifest migrated at the same time. Defaults to {0}".format(
+            commands.DEFAULT_JOBS),
+        required=False,
+        default=commands.DEFAULT_JOBS,
+    )
+    parser_migrate.add_argument(
+        "--log",
+        dest="log",
+        metavar="PATH",
+        help="log file of the instance of the manifest, {{instance}} is replaced with the instance name. "
+        "Defaults to {0}".format(commands.DEFAULT_LOG),
+        required=False,
+        default=commands.DEFAULT_LOG,
     )
     parser_migrate.add_argument(
         "--migrations-dir",
@@ -96,18 +351,125 @@ def add_subparser_migrate(subparsers):
         help="migrations directory",
         required=True,
     )
-    parser_migrate.set_defaults(func=lambda args: commands.migrate(
-        url=args.url,
-        username=args.username,
-        password=args.password,
-        instance=args.instance,
-        phase=args.phase,
-        connection_string=args.connection_string,
-        migrations_dir=args.migrations_dir,
-        release=args.release,
-        case=args.case,
-        show=args.show)
+    parser_migrate.add_argument(
+        "--report-batch-size",
+        dest="report_batch_size",
+        type=int,
+        metavar="SIZE",
+        help="number of step reports posted at once. Defaults to {0}".format(DEFAULT_BATCH_SIZE),
+        required=False,
+        default=DEFAULT_BATCH_SIZE,
     )
+    parser_migrate.add_argument(
+        "--report-batch-interval",
+        dest="report_batch_interval",
+        type=float,
+        metavar="SECONDS",
+        help="maximum time a step report is queued. Defaults to {0}".format(DEFAULT_BATCH_INTERVAL),
+        required=False,
+        default=DEFAULT_BATCH_INTERVAL,
+    )
+    parser_migrate.add_argument(
+        "--report-async",
+        dest="report_async",
+        action="store_true",
+        help="Post step reports one by one from a background thread, the batch options are not used then",
+    )
+    parser_migrate.add_argument(
+        "--report-spool",
+        dest="report_spool",
+        metavar="PATH",
+        help="file keeping the step reports until they are confirmed, {{instance}} is replaced with the instance "
+        "name. Defaults to {0}".format(DEFAULT_SPOOL),
+        required=False,
+        default=DEFAULT_SPOOL,
+    )
+    parser_migrate.add_argument(
+        "--journal",
+        dest="journal",
+        metavar="PATH",
+        help="file recording the applied steps until the command succeeds, {{instance}} is replaced with the "
+        "instance name, pass an empty value to not keep it. Defaults to {0}".format(DEFAULT_JOURNAL),
+        required=False,
+        default=DEFAULT_JOURNAL,
+    )
+    parser_migrate.add_argument(
+        "--transaction",
+        dest="transaction",
+        metavar="[{0}]".format(', '.join(commands.TRANSACTION_MODES)),
+        choices=commands.TRANSACTION_MODES,
+        help="execute every SQL step in autocommit, or SQL steps of every migration or of the phase in one "
+        "transaction, if the database has transactional DDL. Defaults to step",
+        required=False,
+        default='step',
+    )
+    parser_migrate.add_argument(
+        "--db-pool-size",
+        dest="db_pool_size",
+        type=int,
+        metavar="SIZE",
+        help="database connection pool size. Defaults to the SQLAlchemy default of the dialect",
+        required=False,
+    )
+    parser_migrate.add_argument(
+        "--concurrency",
+        dest="concurrency",
+        type=int,
+        metavar="NUMBER",
+        help="number of independent migrations applied at the same time on separate connections, a migration is "
+        "applied only after its parent. Defaults to {0}".format(DEFAULT_CONCURRENCY),
+        required=False,
+        default=DEFAULT_CONCURRENCY,
+    )
+    parser_migrate.add_argument(
+        "--script-log",
+        dest="script_log",
+        metavar="PATH",
+        help="rotating log file of the full output of the scripts, {{instance}} is replaced with the instance name, "
+        "pass an empty value to not write it. Defaults to {0}".format(DEFAULT_SCRIPT_LOG),
+        required=False,
+        default=DEFAULT_SCRIPT_LOG,
+    )
+    parser_migrate.add_argument(
+        "--resume",
+        dest="resume",
+        action="store_true",
+        help="Resume the failed run: send its not sent step reports, skip the steps it applied",
+    )
+
+    def migrate(args):
+        """Apply the migrations to the instance, or to all the instances of the manifest."""
+        kwargs = dict(
+            url=args.url,
+            username=args.username,
+            password=args.password,
+            phase=args.phase,
+            migrations_dir=args.migrations_dir,
+            release=args.release,
+            case=args.case,
+            show=args.show,
+            report_batch_size=args.report_batch_size,
+            report_batch_interval=args.report_batch_interval,
+            report_async=args.report_async,
+            report_spool=args.report_spool,
+            journal=args.journal,
+            resume=args.resume,
+            transaction=args.transaction,
+            db_pool_size=args.db_pool_size,
+            script_log=args.script_log,
+            concurrency=args.concurrency,
+            client=args.client,
+        )
+        if args.manifest:
+            if args.instance or args.connection_string:
+                parser_migrate.error('--manifest is not allowed with --instance or --connection-string')
+            commands.migrate_many(manifest=args.manifest, jobs=args.jobs, log=args.log, **kwargs)
+        elif args.instance and args.connection_string:
+            commands.migrate(instance=args.instance, connection_string=args.connection_string, **kwargs)
+        else:
+            parser_migrate.error('--instance and --connection-string, or --manifest are required')
+
+    parser_migrate.set_defaults(func=migrate)
 
 
 def add_subparser_migration_data(subparsers):
@@ -137,13 +499,45 @@ def add_subparser_migration_data(subparsers):
         action="store_true",
         help="Only show what to be pushed, nothing will actually be pushed",
     )
+    parser_push.add_argument(
+        "--push-cache",
+        dest="push_cache",
+        metavar="PATH",
+        help="file with the content hashes of the pushed migrations, only new and changed migrations are pushed, "
+        "pass an empty value to push all of them. Defaults to {0}".format(DEFAULT_PUSH_CACHE),
+        required=False,
+        default=DEFAULT_PUSH_CACHE,
+    )
+    parser_push.add_argument(
+        "--check-server",
+        dest="check_server",
+        action="store_true",
+        help="also push the migrations which the deployment tool doesn't have, even if they were pushed before",
+    )
+    parser_push.add_argument(
+        "--concurrency",
+        dest="concurrency",
+        type=int,
+        metavar="NUMBER",
+        help="number of migrations pushed at the same time, a migration is pushed after its parent. "
+        "Defaults to {0}".format(DEFAULT_CONCURRENCY),
+        required=False,
+        default=DEFAULT_CONCURRENCY,
+    )
+    add_scan_cache_arguments(parser_push)
     parser_push.set_defaults(func=lambda args: commands.push_data(
         url=args.url,
         username=args.username,
         password=args.password,
         alembic_config=args.alembic_config,
         case=args.case,
-        show=args.show)
+        show=args.show,
+        push_cache=args.push_cache,
+        check_server=args.check_server,
+        concurrency=args.concurrency,
+        scan_cache=args.scan_cache,
+        rescan=args.rescan,
+        client=args.client)
     )
     parser_get_not_reviewed = migration_data_subparsers.add_parser(
         "get-not-reviewed",
@@ -162,13 +556,19 @@ def add_subparser_migration_data(subparsers):
         help="CI project",
         required=True,
     )
+    add_scan_cache_arguments(parser_get_not_reviewed)
+    add_output_argument(parser_get_not_reviewed)
     parser_get_not_reviewed.set_defaults(func=lambda args: commands.get_not_reviewed(
         url=args.url,
         username=args.username,
         password=args.password,
         alembic_config=args.alembic_config,
         ci_project=args.ci_project,
-        case=args.case)
+        case=args.case,
+        scan_cache=args.scan_cache,
+        rescan=args.rescan,
+        output=args.output,
+        client=args.client)
     )
     parser_get_not_applied = migration_data_subparsers.add_parser(
         "get-not-applied",
@@ -187,13 +587,16 @@ def add_subparser_migration_data(subparsers):
         help="release name",
         required=True,
     )
+    add_output_argument(parser_get_not_applied)
     parser_get_not_applied.set_defaults(func=lambda args: commands.get_not_applied(
         url=args.url,
         username=args.username,
         password=args.password,
         instance=args.instance,
         release=args.release,
-        case=args.case)
+        case=args.case,
+        output=args.output,
+        client=args.client)
     )
 
 
@@ -234,6 +637,7 @@ def add_subparser_case_data(subparsers):
         help="instance for deployment",
         required=True,
     )
+    add_output_argument(parser_get_revisions)
     parser_get_revisions.set_defaults(func=lambda args: commands.get_not_deployed_cases(
         url=args.url,
         username=args.username,
@@ -241,7 +645,9 @@ def add_subparser_case_data(subparsers):
         ci_project=args.ci_project,
         release=args.release,
         instance=args.instance,
-        case=args.case)
+        case=args.case,
+        output=args.output,
+        client=args.client)
     )
 
 
@@ -273,6 +679,15 @@ def add_subparser_deploy(subparsers):
         help="id of the deployed case",
         required=False,
     )
+    parser_deploy.add_argument(
+        "--max-log-size",
+        dest="max_log_size",
+        type=int,
+        metavar="CHARACTERS",
+        help="maximum size of the reported log, only its head and tail are reported if it's larger. "
+        "Defaults to the whole log",
+        required=False,
+    )
     parser_deploy.add_argument(
         'log',
         type=argparse.FileType('r'),
@@ -285,7 +700,9 @@ def add_subparser_deploy(subparsers):
         instance=args.instance,
         status=args.status,
         cases=args.cases,
-        log=args.log)
+        log=args.log,
+        max_log_size=args.max_log_size,
+        client=args.client)
     )
 
 
@@ -313,6 +730,7 @@ def add_subparser_graph(subparsers):
         help="Should it print output?",
         required=False
     )
+    add_scan_cache_arguments(parser_graph)
 
     parser_graph.set_defaults(func=lambda args: commands.graph(
         url=args.url,
@@ -320,5 +738,75 @@ def add_subparser_graph(subparsers):
         password=args.password,
         alembic_config=args.alembic_config,
         filename=args.filename,
-        verbose=args.verbose)
+        verbose=args.verbose,
+        scan_cache=args.scan_cache,
+        rescan=args.rescan,
+        client=args.client)
+    )
+
+
+def add_subparser_check(subparsers):
+    """Add a check subparser to main subparser collection."""
+    parser_check = subparsers.add_parser(
+        "check", help="check not reviewed and not applied migrations and not deployed cases at once")
+    parser_check.add_argument(
+        "--alembic-config",
+        dest="alembic_config",
+        metavar="PATH",
+        help="alembic config path",
+        required=True,
+    )
+    parser_check.add_argument(
+        "--ci-project",
+        dest="ci_project",
+        metavar="CI_PROJECT_NAME",
+        help="CI project",
+        required=True,
+    )
+    parser_check.add_argument(
+        "--instance",
+        dest="instance",
+        metavar="INSTANCE_NAME",
+        help="instance for migration application and deployment",
+        required=True,
+    )
+    parser_check.add_argument(
+        "--release",
+        dest="release",
+        metavar="RELEASE_NUMBER",
+        help="release name",
+        required=True,
+    )
+    parser_check.add_argument(
+        "--case",
+        dest="case",
+        type=int,
+        metavar="CASE_ID",
+        help="case id",
+        required=False,
+    )
+    parser_check.add_argument(
+        "--report",
+        dest="report",
+        metavar="PATH",
+        help="json report file of the checks, pass - to print it",
+        required=False,
+    )
+    add_scan_cache_arguments(parser_check)
+
+    add_output_argument(parser_check)
+    parser_check.set_defaults(func=lambda args: commands.check(
+        url=args.url,
+        username=args.username,
+        password=args.password,
+        alembic_config=args.alembic_config,
+        ci_project=args.ci_project,
+        instance=args.instance,
+        release=args.release,
+        case=args.case,
+        scan_cache=args.scan_cache,
+        rescan=args.rescan,
+        report=args.report,
+        output=args.output,
+        client=args.client)
     )
@@ -13,7 +13,6 @@ long_description = []
 install_requires = [
     'alembic',
     'alembic-offline>=1.2.0',
-    'capturer>=2.1',
     'requests',
     'six',
     'sqlalchemy',
@@ -0,0 +1,57 @@
+"""Test asyncio interface."""
+import sys
+
+import pytest
+
+from pdt_client import commands
+
+asyncio = pytest.importorskip('asyncio')
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 5), reason='asyncio interface needs python 3.5')
+
+
+@pytest.fixture
+def client():
+    """Asyncio deployment tool client."""
+    from pdt_client.aio import AsyncClient
+    return AsyncClient(url='http://example.com', username='user', password='password', pool_size=2)
+
+
+def run(coroutine):
+    """Run the coroutine in a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_post_many(mocker, client):
+    """Test posting the items concurrently, collecting the errors."""
+    def request(method, url, data, **kwargs):
+        response = mocker.Mock()
+        if data == '{"uid": "broken"}':
+            response.raise_for_status.side_effect = Exception('some error')
+            response.json.side_effect = ValueError
+        return response
+    mocked_request = mocker.patch('requests.Session.request', side_effect=request)
+    results = run(client.post_many('migrations', [{'uid': 'first'}, {'uid': 'broken'}, {'uid': 'second'}]))
+    assert [isinstance(result, Exception) for result in results] == [False, True, False]
+    assert mocked_request.call_count == 3
+    run(client.close())
+
+
+def test_list(mocker, client):
+    """Test getting the list page by page."""
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_request.return_value.json.side_effect = [{'results': [1, 2], 'next': 'http://example.com/next'}, [3]]
+    assert run(client.list('migrations')) == [1, 2, 3]
+
+
+def test_run_command(mocker, client):
+    """Test running the command with the client."""
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_request.return_value.json.return_value = []
+    run(client.run(commands.get_not_applied, instance='some', release='1510'))
+    mocked_request.assert_called_with(
+        'GET', 'http://example.com/api/migrations/',
+        params={'exclude_status': 'apl', 'instance': 'some', 'release': '1510', 'limit': 100}, timeout=None)
@@ -0,0 +1,106 @@
+"""Test local caches."""
+import json
+import os
+
+import pytest
+from alembic.config import Config
+
+from pdt_client.cache import PushCache, ScanCache
+
+
+def test_push_cache(tmpdir):
+    """Test that the pushed migration data is recorded per deployment tool."""
+    path = str(tmpdir.join('push.json'))
+    cache = PushCache(path, 'http://example.com')
+    assert not cache.is_pushed('a', {'uid': 'a'})
+    cache.pushed('a', {'uid': 'a'})
+    cache.save()
+    cache = PushCache(path, 'http://example.com')
+    assert cache.is_pushed('a', {'uid': 'a'})
+    assert not cache.is_pushed('a', {'uid': 'a', 'parent': 'b'})
+    assert not PushCache(path, 'http://other.example.com').is_pushed('a', {'uid': 'a'})
+
+
+@pytest.fixture
+def alembic_config(tmpdir):
+    """Alembic config of the script directory with two revisions."""
+    config = tmpdir.join('alembic.ini')
+    config.write('[alembic]\nscript_location = {0}\n'.format(tmpdir.join('migrations')))
+    tmpdir.join('migrations', 'env.py').write('', ensure=True)
+    tmpdir.join('migrations', 'scripts', 'script.py').write('print(1)', ensure=True)
+    tmpdir.join('migrations', 'versions', 'first.py').write(
+        "revision = 'first'\ndown_revision = None\n", ensure=True)
+    tmpdir.join('migrations', 'versions', 'second.py').write("revision = 'second'\ndown_revision = 'first'\n")
+    return Config(str(config))
+
+
+def get_migration_data(config, revision):
+    """Get the fake migration data, the second revision has a script step."""
+    steps = [{'type': 'python', 'script': 'print(1)', 'path': 'scripts/script.py'}] if revision == 'second' else []
+    return {
+        'revision': revision, 'attributes': {'case_id': 1 if revision == 'first' else 2},
+        'phases': {'before-deploy': {'steps': steps}}}
+
+
+def test_scan_cache(mocker, tmpdir, alembic_config):
+    """Test that only the changed revision files are parsed."""
+    mocked_get_migration_data = mocker.patch('pdt_client.cache.get_migration_data', side_effect=get_migration_data)
+    cache = ScanCache(str(tmpdir.join('scan.json')))
+
+    def scan():
+        mocked_get_migration_data.reset_mock()
+        revisions = [migration['revision'] for migration in cache.scan(alembic_config)]
+        return revisions, sorted(call[0][1] for call in mocked_get_migration_data.call_args_list)
+
+    assert scan() == (['first', 'second'], ['first', 'second'])
+    assert scan() == (['first', 'second'], [])
+
+    first = tmpdir.join('migrations', 'versions', 'first.py')
+    os.utime(str(first), (0, 0))
+    assert scan() == (['first', 'second'], [])
+
+    first.write("revision = 'first'\ndown_revision = None\nchanged = True\n")
+    assert scan() == (['first', 'second'], ['first'])
+
+    tmpdir.join('migrations', 'scripts', 'script.py').write('print(2)')
+    assert scan() == (['first', 'second'], ['second'])
+
+    tmpdir.join('migrations', 'versions', 'third.py').write("revision = 'third'\ndown_revision = 'second'\n")
+    assert scan() == (['first', 'second', 'third'], ['third'])
+
+    tmpdir.join('migrations', 'versions', 'third.py').remove()
+    assert scan() == (['first', 'second'], [])
+    assert scan() == (['first', 'second'], [])
+    assert [migration['revision'] for migration in cache.scan(alembic_config, case=2)] == ['second']
+
+    tmpdir.join('migrations', 'versions', 'second.py').remove()
+    tmpdir.join('migrations', 'versions', 'third.py').write("revision = 'third'\ndown_revision = 'first'\n")
+    assert scan() == (['first', 'third'], ['third'])
+
+    tmpdir.join('alembic.ini').write('\n', mode='a')
+    assert scan() == (['first', 'third'], ['first', 'third'])
+
+    cache.clear()
+    assert not tmpdir.join('scan.json').check()
+    assert scan() == (['first', 'third'], ['first', 'third'])
+
+
+def test_scan_cache_case(mocker, tmpdir, alembic_config):
+    """Test getting the migrations of the case from the index."""
+    mocker.patch('pdt_client.cache.get_migration_data', side_effect=get_migration_data)
+    tmpdir.join('migrations', 'versions', 'third.py').write("revision = 'third'\ndown_revision = 'second'\n")
+    cache = ScanCache(str(tmpdir.join('scan.json')))
+    assert [migration['revision'] for migration in cache.scan(alembic_config, case=2)] == ['second', 'third']
+    mocked_walk = mocker.patch('alembic.script.ScriptDirectory.walk_revisions')
+    assert [migration['revision'] for migration in cache.scan(alembic_config, case='1')] == ['first']
+    assert cache.scan(alembic_config, case=3) == []
+    assert not mocked_walk.called
+
+
+def test_scan_cache_broken(mocker, tmpdir, alembic_config):
+    """Test that the broken cache file is parsed again."""
+    mocker.patch('pdt_client.cache.get_migration_data', side_effect=get_migration_data)
+    path = tmpdir.join('scan.json')
+    path.write('{"fingerprint": ')
+    assert [migration['revision'] for migration in ScanCache(str(path)).scan(alembic_config)] == ['first', 'second']
+    assert len(json.loads(path.read())['order']) == 2
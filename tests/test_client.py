@@ -0,0 +1,267 @@
+"""Test client."""
+import json
+import os
+import time
+import zlib
+
+import mock
+import pytest
+import requests
+
+from pdt_client import profiling
+from pdt_client.cache import ResponseCache
+from pdt_client.client import Client
+
+
+@pytest.fixture
+def client():
+    """Deployment tool client."""
+    return Client(url='http://example.com', username='user', password='password', pool_size=2, timeout=5)
+
+
+def test_client_session(client):
+    """Test that all the requests share one authenticated session."""
+    assert client.session.auth == ('user', 'password')
+    assert client.session.headers['content-type'] == 'application/json'
+    assert client.session.headers['accept-encoding'] == 'gzip, deflate'
+    assert client.session.get_adapter('http://example.com') is client.session.get_adapter('https://example.com')
+    assert client.get_url('migrations') == 'http://example.com/api/migrations/'
+
+
+def test_client_post(mocker, client):
+    """Test posting data as json."""
+    mocked_request = mocker.patch('requests.Session.request')
+    client.post('deployment-reports', {'status': 'dpl', 'log': 'some log'})
+    mocked_request.assert_called_with(
+        'POST', 'http://example.com/api/deployment-reports/', data='{"log": "some log", "status": "dpl"}',
+        headers={'Idempotency-Key': 'c4ec37bb22470326cb447ddb1e3786159271580a'}, timeout=5)
+
+
+def test_client_post_not_compressed(mocker, client):
+    """Test that the body is not compressed by default."""
+    mocked_request = mocker.patch('requests.Session.request')
+    client.post('deployment-reports', {'log': 'some log ' * 10000})
+    assert 'Content-Encoding' not in mocked_request.call_args[1]['headers']
+
+
+@pytest.mark.parametrize('status', [400, 415])
+def test_client_post_compressed(mocker, client, status):
+    """Test that the large body is posted compressed, and uncompressed when the server doesn't support it."""
+    client.compress_threshold = 100
+    mocked_request = mocker.patch('requests.Session.request')
+    data = {'log': 'some log ' * 20}
+    client.post('deployment-reports', data)
+    kwargs = mocked_request.call_args[1]
+    assert kwargs['headers']['Content-Encoding'] == 'gzip'
+    assert json.loads(zlib.decompress(kwargs['data'], 16 + zlib.MAX_WBITS).decode('utf-8')) == data
+
+    mocked_request.reset_mock()
+    mocked_request.side_effect = [mock.Mock(status_code=status), mock.Mock(status_code=201)]
+    client.post('deployment-reports', data)
+    assert mocked_request.call_count == 2
+    kwargs = mocked_request.call_args[1]
+    assert 'Content-Encoding' not in kwargs['headers']
+    assert json.loads(kwargs['data']) == data
+    assert client.compress_threshold == 0
+
+    mocked_request.reset_mock()
+    mocked_request.side_effect = None
+    client.post('deployment-reports', data)
+    assert mocked_request.call_count == 1
+    assert 'Content-Encoding' not in mocked_request.call_args[1]['headers']
+
+
+def test_client_post_stream(mocker, client):
+    """Test that the streamed body is compressed incrementally, and streamed again uncompressed if rejected."""
+    bodies = []
+
+    def request(method, url, data, **kwargs):
+        bodies.append((kwargs.get('headers'), b''.join(data)))
+        return mock.Mock(status_code=400 if len(bodies) == 1 else 201)
+
+    mocker.patch('requests.Session.request', side_effect=request)
+    client.compress_threshold = 1
+    client.post_stream('deployment-reports', {'status': 'dpl'}, 'log', lambda: [u'some ', u'log'])
+    headers, body = bodies[0]
+    assert headers == {'Content-Encoding': 'gzip'}
+    assert zlib.decompress(body, 16 + zlib.MAX_WBITS) == b'{"status": "dpl", "log": "some log"}'
+    headers, body = bodies[1]
+    assert not headers
+    assert body == b'{"status": "dpl", "log": "some log"}'
+    assert client.compress_threshold == 0
+
+
+def test_client_error(mocker, client, capsys):
+    """Test that the error reply is printed and raised."""
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_request.return_value.raise_for_status.side_effect = Exception('some error')
+    mocked_request.return_value.json.return_value = {'detail': 'some detail'}
+    with pytest.raises(Exception):
+        client.get('migrations')
+    out, err = capsys.readouterr()
+    assert "{'detail': 'some detail'}" in out
+
+
+def test_client_iterate(mocker):
+    """Test iterating over the paginated list."""
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_request.return_value.json.side_effect = [
+        {'results': [1, 2], 'next': 'http://example.com/api/migrations/?limit=2&offset=2'},
+        {'results': [3], 'next': None},
+    ]
+    client = Client(url='http://example.com', username='user', password='password', timeout=5, page_size=2)
+    items = client.iterate('migrations', params={'ci_project': 'some_project'})
+    assert next(items) == 1
+    assert mocked_request.call_count == 1
+    assert list(items) == [2, 3]
+    assert mocked_request.call_args_list == [
+        mocker.call(
+            'GET', 'http://example.com/api/migrations/', params={'ci_project': 'some_project', 'limit': 2},
+            timeout=5),
+        mocker.call('GET', 'http://example.com/api/migrations/?limit=2&offset=2', params=None, timeout=5),
+    ]
+
+
+def test_client_iterate_not_paginated(mocker):
+    """Test iterating over the list of the server which doesn't paginate."""
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_request.return_value.json.return_value = [1, 2, 3]
+    client = Client(url='http://example.com', username='user', password='password', timeout=5, page_size=0)
+    assert list(client.iterate('cases')) == [1, 2, 3]
+    mocked_request.assert_called_once_with('GET', 'http://example.com/api/cases/', params={}, timeout=5)
+
+
+def test_client_iterate_pages_counted(mocker, client):
+    """Test getting the total count of the list items with the pages."""
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_request.return_value.json.side_effect = [
+        {'count': 3, 'results': [1, 2], 'next': 'http://example.com/api/migrations/?limit=2&offset=2'},
+        {'results': [3], 'next': None},
+        [1, 2, 3],
+    ]
+    assert list(client.iterate_pages('migrations', counted=True)) == [(3, [1, 2]), (None, [3])]
+    assert list(client.iterate_pages('migrations', counted=True)) == [(3, [1, 2, 3])]
+
+
+def test_client_error_not_json(mocker, client, capsys):
+    """Test that the error reply which is not json is printed as text and the http error is raised."""
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_request.return_value.raise_for_status.side_effect = requests.HTTPError('502 Bad Gateway')
+    mocked_request.return_value.json.side_effect = ValueError('No JSON object could be decoded')
+    mocked_request.return_value.text = '<html>Bad Gateway</html>'
+    with pytest.raises(requests.HTTPError):
+        client.get('migrations')
+    out, err = capsys.readouterr()
+    assert '<html>Bad Gateway</html>' in out
+
+
+def test_client_retry(mocker, client):
+    """Test that the transient failures are retried with backoff."""
+    mocked_sleep = mocker.patch('time.sleep')
+    mocker.patch('random.uniform', side_effect=lambda low, high: high)
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_request.side_effect = [
+        requests.ConnectionError('connection reset'), mock.Mock(status_code=503), mock.Mock(status_code=200)]
+    client.post('migration-step-reports', {'step': {'id': 1}})
+    assert mocked_request.call_count == 3
+    keys = set(call[1]['headers']['Idempotency-Key'] for call in mocked_request.call_args_list)
+    assert len(keys) == 1
+    assert mocked_sleep.call_args_list == [mock.call(0.5), mock.call(1.0)]
+
+
+def test_client_retry_exhausted(mocker, client):
+    """Test that the last failure is raised when the retries are exhausted."""
+    mocker.patch('time.sleep')
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_request.return_value.status_code = 502
+    mocked_request.return_value.raise_for_status.side_effect = requests.HTTPError('502 Bad Gateway')
+    with pytest.raises(requests.HTTPError):
+        client.get('migrations')
+    assert mocked_request.call_count == 4
+
+
+def test_client_no_retry(mocker, client):
+    """Test that the not idempotent requests and not retryable statuses are not retried."""
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_request.side_effect = requests.ConnectionError('connection reset')
+    with pytest.raises(requests.ConnectionError):
+        client.request('POST', 'migrations', data='{}')
+    assert mocked_request.call_count == 1
+    mocked_request.side_effect = None
+    mocked_request.return_value.status_code = 500
+    mocked_request.return_value.raise_for_status.side_effect = requests.HTTPError('500 Server Error')
+    with pytest.raises(requests.HTTPError):
+        client.get('migrations')
+    assert mocked_request.call_count == 2
+
+
+def test_client_cache(mocker, tmpdir):
+    """Test that the cached response is revalidated with its ETag and used again on 304 Not Modified."""
+    cache = ResponseCache(str(tmpdir.join('cache')))
+    client = Client(url='http://example.com', username='user', password='password', cache=cache)
+    mocked_request = mocker.patch('requests.Session.request')
+    response = requests.Response()
+    response.status_code = 200
+    response.headers['ETag'] = '"v1"'
+    response._content = b'[1, 2]'
+    mocked_request.return_value = response
+    assert client.get('migrations', params={'case': 1}, cache=True) == [1, 2]
+    assert 'headers' not in mocked_request.call_args[1]
+
+    not_modified = requests.Response()
+    not_modified.status_code = 304
+    mocked_request.return_value = not_modified
+    assert client.get('migrations', params={'case': 1}, cache=True) == [1, 2]
+    assert mocked_request.call_args[1]['headers'] == {'If-None-Match': '"v1"'}
+
+    mocked_request.return_value = response
+    client.get('migrations', params={'case': 2}, cache=True)
+    assert 'headers' not in mocked_request.call_args[1]
+
+
+def test_client_cache_ttl(mocker, tmpdir):
+    """Test that the fresh response is used without a request and only the query responses are cached."""
+    cache = ResponseCache(str(tmpdir.join('cache')), ttl=60)
+    client = Client(url='http://example.com', username='user', password='password', cache=cache)
+    mocked_request = mocker.patch('requests.Session.request')
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b'[1, 2]'
+    mocked_request.return_value = response
+    assert client.get('migrations', cache=True) == [1, 2]
+    assert client.get('migrations', cache=True) == [1, 2]
+    assert mocked_request.call_count == 1
+    client.get('migrations')
+    assert mocked_request.call_count == 2
+    mocker.patch('time.time', return_value=time.time() + 61)
+    client.get('migrations', cache=True)
+    assert mocked_request.call_count == 3
+
+
+def test_response_cache_size(tmpdir):
+    """Test that the least recently used responses are evicted above the maximum size."""
+    cache = ResponseCache(str(tmpdir), ttl=60, max_size=310)
+    for number in range(5):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = 'http://example.com/{0}'.format(number)
+        response._content = b'[' + b'1, ' * 20 + b'1]'
+        cache.store(number, response)
+        os.utime(cache.get_path(number), (number, number))
+    assert [cache.load(number) is not None for number in range(5)] == [False, False, False, True, True]
+
+
+def test_client_profile(mocker, client):
+    """Test that the requests are recorded as spans when profiling."""
+    response = mocker.Mock(status_code=200, content=b'[]')
+    mocker.patch('requests.Session.request', return_value=response)
+    profiler = profiling.Profiler()
+    profiling.enable(profiler)
+    try:
+        client.post('migrations', {'uid': 'some'})
+    finally:
+        profiling.disable(profiler)
+    [span] = profiler.spans
+    assert span['kind'] == 'http'
+    assert span['name'] == 'POST /api/migrations/'
+    assert span['attributes'] == {'method': 'POST', 'attempt': 0, 'status': 200, 'received': 2, 'sent': 15}
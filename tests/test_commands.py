@@ -1,37 +1,46 @@
 """Test commands."""
 from __future__ import print_function
 
+import io
+import json
+import multiprocessing
+
 import mock
 import pytest
 import sys
+import zlib
 
+from pdt_client import profiling
+from pdt_client.client import Client
 from pdt_client.commands import (
     _label_callback,
+    check,
     deploy,
+    generate_migration_graph,
     get_not_applied,
     get_not_deployed_cases,
     get_not_reviewed,
     graph,
+    iterate_not_applied,
     migrate,
+    migrate_many,
     push_data,
+    sql_transaction,
 )
+from pdt_client.metrics import Metrics
 
 
 @pytest.mark.parametrize('show', [False, True])
 def test_migrate(mocker, show):
     """Test migrate command."""
-    mocked_get = mocker.patch('requests.get')
-    mocked_post = mocker.patch('requests.post')
+    mocked_request = mocker.patch('requests.Session.request')
     mocked_engine = mocker.patch('sqlalchemy.create_engine')
     mocked_engine.return_value.dialect.name = 'sqlite'
     mocked_engine.return_value.execute.return_value.rowcount = 1
-    mocked_check_call = mocker.patch('pdt_client.commands.subprocess.check_call')
-
-    def print_log(*args):
-        print('some output log')
-        print('some error output log', file=sys.stderr)
-    mocked_check_call.side_effect = print_log
-    mocked_get.return_value.json.return_value = [
+    mocked_popen = mocker.patch('pdt_client.process.subprocess.Popen')
+    mocked_popen.return_value.stdout = io.BytesIO(b'some output log\nsome error output log\n')
+    mocked_popen.return_value.wait.return_value = 0
+    mocked_request.return_value.json.return_value = [
         {
             'uid': '123123',
             'pre_deploy_steps': [
@@ -65,26 +74,25 @@ def test_migrate(mocker, show):
         url='http://example.com', username='user', password='password', instance='some',
         phase='before-deploy', connection_string='sqlite:///', migrations_dir='/tmp', release='1510',
         show=show, case=33322)
-    mocked_get.assert_called_with(
-        'http://example.com/api/migrations/',
-        headers={'content-type': 'application/json'}, params={
-            'instance': 'some',
-            'exclude_status': 'apl',
-            'reviewed': True,
-            'release': '1510',
-            'case': 33322,
-        },
-        auth=('user', 'password'))
     if show:
+        mocked_request.assert_called_with(
+            'GET', 'http://example.com/api/migrations/', params={
+                'instance': 'some',
+                'exclude_status': 'apl',
+                'reviewed': True,
+                'release': '1510',
+                'case': 33322,
+                'limit': 100,
+            },
+            timeout=None)
         assert not mocked_engine.return_value.execute.called
     else:
         mocked_engine.return_value.execute.assert_called_with('some script')
-        mocked_post.assert_called_with(
-            'http://example.com/api/migration-step-reports/',
-            headers={'content-type': 'application/json'},
+        mocked_request.assert_any_call(
+            'POST', 'http://example.com/api/migration-step-reports/',
             data='{"log": "Executed SQL with rowcount: 1", "report": {"instance": '
             '{"name": "some"}, "migration": {"uid": "123123"}}, '
-            '"status": "apl", "step": {"id": 1}}', auth=('user', 'password'))
+            '"status": "apl", "step": {"id": 1}}', headers={'Idempotency-Key': mock.ANY}, timeout=None)
     migrate(
         url='http://example.com', username='user', password='password', instance='some',
         phase='after-deploy', connection_string='sqlite:///', migrations_dir='/tmp', release='1510',
@@ -93,41 +101,267 @@ def test_migrate(mocker, show):
         assert not mocked_engine.return_value.execute.called
     else:
         mocked_engine.return_value.execute.assert_called_with('some other script')
-        mocked_post.assert_called_with(
-            'http://example.com/api/migration-step-reports/',
-            headers={'content-type': 'application/json'},
+        mocked_request.assert_any_call(
+            'POST', 'http://example.com/api/migration-step-reports/',
             data='{"log": "Executed SQL with rowcount: 1", "report": {"instance": '
             '{"name": "some"}, "migration": {"uid": "123123"}}, '
-            '"status": "apl", "step": {"id": 2}}', auth=('user', 'password'))
+            '"status": "apl", "step": {"id": 2}}', headers={'Idempotency-Key': mock.ANY}, timeout=None)
     migrate(
         url='http://example.com', username='user', password='password', instance='some',
         phase='final', connection_string='sqlite:///', migrations_dir='/tmp', release='1510',
         show=show)
     if show:
-        assert not mocked_check_call.called
+        assert not mocked_popen.called
     else:
-        mocked_check_call.assert_called_with([sys.executable, '/some/path'])
-        mocked_post.assert_called_with(
-            'http://example.com/api/migration-step-reports/',
-            headers={'content-type': 'application/json'},
+        mocked_popen.assert_called_with([sys.executable, '/some/path'], stdout=mock.ANY, stderr=mock.ANY)
+        mocked_request.assert_any_call(
+            'POST', 'http://example.com/api/migration-step-reports/',
             data='{"log": "some output log\\nsome error output log", "report": {"instance": '
             '{"name": "some"}, "migration": {"uid": "123123"}}, '
-            '"status": "apl", "step": {"id": 3}}', auth=('user', 'password'))
-        mocked_check_call.side_effect = Exception('some error')
-        mocked_post.reset_mock()
-        mocked_post.return_value.raise_for_status.side_effect = Exception('some post error')
+            '"status": "apl", "step": {"id": 3}}', headers={'Idempotency-Key': mock.ANY}, timeout=None)
+        mocked_popen.side_effect = Exception('some error')
+        mocked_request.reset_mock()
+        post_response = mock.Mock()
+        post_response.raise_for_status.side_effect = Exception('some post error')
+        mocked_request.side_effect = lambda method, *args, **kwargs: (
+            post_response if method == 'POST' else mocked_request.return_value)
         with pytest.raises(Exception):
             migrate(
                 url='http://example.com', username='user', password='password', instance='some',
                 phase='final', connection_string='sqlite:///', migrations_dir='/tmp', release='1510',
                 show=show)
-        assert '"status": "err"' in mocked_post.call_args[1]['data']
-        assert "Traceback (most recent call last)" in mocked_post.call_args[1]['data']
+        assert '"status": "err"' in mocked_request.call_args[1]['data']
+        assert "Traceback (most recent call last)" in mocked_request.call_args[1]['data']
+
+
+def test_migrate_report_async(mocker, tmpdir):
+    """Test migrate command posting step reports from the background thread."""
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_engine = mocker.patch('sqlalchemy.create_engine')
+    mocked_engine.return_value.dialect.name = 'sqlite'
+    mocked_engine.return_value.execute.return_value.rowcount = 1
+    mocked_request.return_value.json.return_value = [
+        {
+            'uid': '123123',
+            'pre_deploy_steps': [
+                {'id': step_id, 'position': step_id, 'code': 'some script', 'type': 'sqlite'}
+                for step_id in range(3)
+            ],
+        }
+    ]
+    spool = tmpdir.join('{instance}.spool')
+    migrate(
+        url='http://example.com', username='user', password='password', instance='some',
+        phase='before-deploy', connection_string='sqlite:///', migrations_dir='/tmp', release='1510',
+        report_async=True, report_spool=str(spool))
+    posted = [call[1]['data'] for call in mocked_request.call_args_list if call[0][0] == 'POST']
+    assert ['"step": {{"id": {0}}}'.format(step_id) in data for step_id, data in enumerate(posted)] == [True] * 3
+    assert not tmpdir.join('some.spool').check()
+
+
+@pytest.mark.parametrize('fail', [False, True])
+def test_migrate_transaction(mocker, fail):
+    """Test migrate command executing SQL steps of the phase in one transaction."""
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_engine = mocker.patch('sqlalchemy.create_engine')
+    mocked_engine.return_value.dialect.name = 'postgresql'
+    connection = mocked_engine.return_value.connect.return_value
+    connection.execute.return_value.rowcount = 1
+    if fail:
+        connection.execute.side_effect = [mock.Mock(rowcount=1), mock.Mock(rowcount=2), Exception('some error')]
+    transaction = connection.begin.return_value
+    mocked_request.return_value.json.return_value = [
+        {
+            'uid': uid,
+            'pre_deploy_steps': [
+                {'id': step_id, 'position': 0, 'code': 'script {0}'.format(step_id), 'type': 'postgresql'}],
+        } for uid, step_id in (('first', 1), ('second', 2), ('third', 3))
+    ]
+
+    def posted():
+        return [call[1]['data'] for call in mocked_request.call_args_list if call[0][0] == 'POST']
+    posted_before_commit = []
+    transaction.commit.side_effect = lambda: posted_before_commit.extend(posted())
+    kwargs = dict(
+        url='http://example.com', username='user', password='password', instance='some',
+        phase='before-deploy', connection_string='postgresql:///', migrations_dir='/tmp', release='1510',
+        transaction='phase', db_pool_size=2)
+    if fail:
+        with pytest.raises(Exception):
+            migrate(**kwargs)
+        assert transaction.rollback.called
+        assert not transaction.commit.called
+        assert ['"status": "err"' in data for data in posted()] == [True] * 3
+        assert 'Rolled back' in posted()[0]
+    else:
+        migrate(**kwargs)
+        assert connection.execute.call_args_list == [mock.call('script {0}'.format(step_id)) for step_id in (1, 2, 3)]
+        transaction.commit.assert_called_once_with()
+        assert posted_before_commit == []
+        assert ['"status": "apl"' in data for data in posted()] == [True] * 3
+    mocked_engine.assert_called_with('postgresql:///', pool_size=2)
+    assert connection.begin.call_count == 1
+    assert not mocked_engine.return_value.execute.called
+
+
+def test_sql_transaction(mocker, capsys):
+    """Test that nothing is committed without a transaction, and the rollback error doesn't hide the step error."""
+    engine = mock.Mock()
+    engine.dialect.name = 'postgresql'
+    reporter = mock.Mock()
+    with sql_transaction(engine, 'migration', reporter) as transaction:
+        transaction.commit()
+    assert '-- Committing' not in capsys.readouterr().out
+    assert not engine.connect.called
+
+    reporter.report.side_effect = Exception('report error')
+    with pytest.raises(ValueError):
+        with sql_transaction(engine, 'migration', reporter) as transaction:
+            transaction.execute('some sql')
+            transaction.report(dict(status='apl', log='', step=dict(id=1)))
+            raise ValueError('step error')
+    assert engine.connect.return_value.begin.return_value.rollback.called
+    out, err = capsys.readouterr()
+    assert 'Failed to roll the transaction back' in out
+    assert 'report error' in err
+
+
+def test_migrate_resume(mocker, tmpdir):
+    """Test resuming migrate command after the failed step report."""
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_engine = mocker.patch('sqlalchemy.create_engine')
+    mocked_engine.return_value.dialect.name = 'sqlite'
+    mocked_engine.return_value.execute.return_value.rowcount = 1
+    migrations_response = mocked_request.return_value
+    migrations_response.json.return_value = [
+        {
+            'uid': '123123',
+            'pre_deploy_steps': [
+                {'id': step_id, 'position': step_id, 'code': 'script {0}'.format(step_id), 'type': 'sqlite'}
+                for step_id in range(3)
+            ],
+        }
+    ]
+    posted = []
+    failing_response = mock.Mock()
+    failing_response.raise_for_status.side_effect = Exception('some post error')
+    fail_step_report = ['"step": {"id": 1}']
+
+    def request(method, url, **kwargs):
+        if method == 'GET':
+            return migrations_response
+        if fail_step_report and fail_step_report[0] in kwargs['data']:
+            fail_step_report.pop()
+            return failing_response
+        posted.append(kwargs['data'])
+        return mock.Mock()
+    mocked_request.side_effect = request
+    journal = tmpdir.join('{instance}.log')
+    kwargs = dict(
+        url='http://example.com', username='user', password='password', instance='some',
+        phase='before-deploy', connection_string='sqlite:///', migrations_dir='/tmp', release='1510',
+        journal=str(journal))
+    with pytest.raises(Exception):
+        migrate(**kwargs)
+    assert tmpdir.join('some.log').check()
+    mocked_engine.return_value.execute.reset_mock()
+
+    migrate(resume=True, **kwargs)
+    mocked_engine.return_value.execute.assert_called_once_with('script 2')
+    assert ['"step": {{"id": {0}}}'.format(step_id) in data for step_id, data in enumerate(posted)] == [True] * 3
+    assert not tmpdir.join('some.log').check()
+
+
+def test_migrate_concurrency(mocker):
+    """Test migrate command applying independent migrations concurrently, parents first."""
+    mocked_request = mocker.patch('requests.Session.request')
+    mocked_engine = mocker.patch('sqlalchemy.create_engine')
+    mocked_engine.return_value.dialect.name = 'sqlite'
+    executed = []
+
+    def execute(code):
+        executed.append(code)
+        return mock.Mock(rowcount=1)
+    mocked_engine.return_value.execute.side_effect = execute
+    mocked_request.return_value.json.return_value = [
+        {
+            'uid': uid,
+            'parent': parent,
+            'pre_deploy_steps': [{'id': step_id, 'position': 0, 'code': uid, 'type': 'sqlite'}],
+        } for uid, parent, step_id in (('child', 'root', 1), ('root', 'applied', 2), ('other', None, 3))
+    ]
+    migrate(
+        url='http://example.com', username='user', password='password', instance='some',
+        phase='before-deploy', connection_string='sqlite:///', migrations_dir='/tmp', release='1510',
+        concurrency=2)
+    assert sorted(executed) == ['child', 'other', 'root']
+    assert executed.index('root') < executed.index('child')
+    posted = [call[1]['data'] for call in mocked_request.call_args_list if call[0][0] == 'POST']
+    assert len(posted) == 3
+
+
+@pytest.mark.skipif(
+    getattr(multiprocessing, 'get_start_method', lambda: 'fork')() != 'fork',
+    reason='mocks are passed to the pool processes by forking')
+def test_migrate_many(mocker, tmpdir, capsys):
+    """Test migrate command for the instances of the manifest."""
+    def migrate(instance, connection_string, **kwargs):
+        print('migrating {0} with {1}'.format(instance, connection_string))
+        if instance == 'broken':
+            raise Exception('some error')
+    mocker.patch('pdt_client.commands.migrate', side_effect=migrate)
+    manifest = tmpdir.join('manifest.json')
+    manifest.write(json.dumps({'first': 'sqlite:///first', 'second': 'sqlite:///second', 'broken': 'sqlite:///'}))
+    with pytest.raises(SystemExit) as exc_info:
+        migrate_many(
+            url='http://example.com', username='user', password='password', manifest=str(manifest),
+            phase='before-deploy', migrations_dir='/tmp', release='1510', jobs=2,
+            log=str(tmpdir.join('{instance}.log')))
+    assert exc_info.value.code == 1
+    assert tmpdir.join('first.log').read() == 'migrating first with sqlite:///first\n'
+    assert tmpdir.join('second.log').read() == 'migrating second with sqlite:///second\n'
+    assert 'Exception: some error' in tmpdir.join('broken.log').read()
+    out, err = capsys.readouterr()
+    assert "Failed to migrate these instances: ['broken']" in out
+
+
+@pytest.mark.parametrize('counted', [True, False])
+@pytest.mark.parametrize('applied', ['abcdefg', '', 'bcf'])
+def test_iterate_not_applied(counted, applied):
+    """Test that shifting pages of not applied migrations neither skip nor reorder migrations."""
+    not_applied = [dict(uid=uid) for uid in 'abcdefg']
+    requests = []
+
+    class FakeClient(object):
+
+        """Client paginating by offset over the shrinking list of not applied migrations."""
+
+        def iterate_pages(self, endpoint, params, counted):
+            offset = 0
+            while True:
+                requests.append(offset)
+                # the next link is given while the page is served
+                has_next = offset + 2 < len(not_applied)
+                yield (len(not_applied) if counted else None), not_applied[offset:offset + 2]
+                if not has_next:
+                    return
+                offset += 2
+
+    result = []
+    for migration in iterate_not_applied(FakeClient(), {}):
+        result.append(migration['uid'])
+        if migration['uid'] in applied:
+            not_applied.remove(migration)
+    assert result == list('abcdefg')
+    if counted and not applied:
+        # the pages don't shift, so they are requested only once
+        assert requests == [0, 2, 4, 6]
 
 
 def test_migration_data_push(mocker):
     """Test migration-data push command."""
-    mocked_requests = mocker.patch('requests.post')
+    mocked_requests = mocker.patch('requests.Session.request')
+    mocked_requests.return_value.json.return_value = []
     mocked_alembic = mocker.patch('pdt_client.commands.get_migrations_data')
     mocked_alembic.return_value = [
         {
@@ -156,17 +390,86 @@ def test_migration_data_push(mocker):
     push_data(
         url='http://example.com', username='user', password='password', alembic_config='some_config')
     mocked_requests.assert_called_with(
-        'http://example.com/api/migrations/', headers={
-            'content-type': 'application/json'},
+        'POST', 'http://example.com/api/migrations/',
         data='{"case": {"id": "33322"}, "final_steps": [{"code": "some script", "position": 0, "type": "pgsql"}], '
         '"parent": 1, "post_deploy_steps": [{"code": "some script", "position": 0, "type": "sh"}], '
         '"pre_deploy_steps": [{"code": "some script", "position": 0, "type": "mysql"}], "uid": 2}',
-        auth=('user', 'password'))
+        headers={'Idempotency-Key': mock.ANY}, timeout=None)
+
+
+def test_migration_data_push_cache(mocker, tmpdir):
+    """Test that only the new and changed migrations are pushed with the push cache."""
+    mocked_requests = mocker.patch('requests.Session.request')
+    mocked_requests.return_value.json.return_value = [{'uid': 'first'}]
+    mocked_alembic = mocker.patch('pdt_client.commands.get_migrations_data')
+    mocked_alembic.return_value = [
+        {'revision': revision, 'attributes': {'case_id': 33322}, 'down_revision': None, 'phases': {}}
+        for revision in ('first', 'second')]
+    kwargs = dict(
+        url='http://example.com', username='user', password='password', alembic_config='some_config',
+        push_cache=str(tmpdir.join('push.json')))
+
+    def pushed():
+        return [json.loads(call[1]['data'])['uid'] for call in mocked_requests.call_args_list if call[0][0] == 'POST']
+    push_data(**kwargs)
+    assert pushed() == ['first', 'second']
+    mocked_requests.reset_mock()
+    push_data(**kwargs)
+    assert pushed() == []
+    mocked_alembic.return_value[0]['attributes']['case_id'] = 33323
+    push_data(**kwargs)
+    assert pushed() == ['first']
+    mocked_requests.reset_mock()
+    push_data(check_server=True, **kwargs)
+    assert pushed() == ['second']
+
+
+def test_migration_data_push_case(mocker):
+    """Test pushing all the migrations of the case."""
+    mocked_requests = mocker.patch('requests.Session.request')
+    mocked_alembic = mocker.patch('pdt_client.commands.get_migrations_data')
+    mocked_alembic.return_value = [
+        {'revision': revision, 'attributes': {'case_id': case_id}, 'down_revision': None, 'phases': {}}
+        for revision, case_id in (('first', 33322), ('second', 33323), ('third', 33322))]
+    push_data(
+        url='http://example.com', username='user', password='password', alembic_config='some_config', case=33322)
+    assert [json.loads(call[1]['data'])['uid'] for call in mocked_requests.call_args_list] == ['first', 'third']
+
+
+def test_migration_data_push_concurrency(mocker, capsys):
+    """Test pushing the migrations concurrently, parents first, summarizing the failures."""
+    mocked_requests = mocker.patch('requests.Session.request')
+    pushed = []
+    failing_response = mock.Mock()
+    failing_response.raise_for_status.side_effect = Exception('some error')
+
+    def request(method, url, data, **kwargs):
+        uid = json.loads(data)['uid']
+        if uid == 'broken':
+            return failing_response
+        pushed.append(uid)
+        return mock.Mock()
+    mocked_requests.side_effect = request
+    mocked_alembic = mocker.patch('pdt_client.commands.get_migrations_data')
+    mocked_alembic.return_value = [
+        {'revision': revision, 'attributes': {'case_id': 33322}, 'down_revision': down_revision, 'phases': {}}
+        for revision, down_revision in (
+            ('root', None), ('left', 'root'), ('right', 'root'), ('broken', 'root'), ('child', 'broken'))]
+    with pytest.raises(SystemExit) as exc_info:
+        push_data(
+            url='http://example.com', username='user', password='password', alembic_config='some_config',
+            concurrency=3)
+    assert exc_info.value.code == 1
+    assert pushed[0] == 'root'
+    assert sorted(pushed) == ['left', 'right', 'root']
+    out, err = capsys.readouterr()
+    assert "Failed to push these migrations: ['broken']" in out
 
 
 def test_migration_data_get_not_reviewed(mocker):
     """Test migration-data get-not-reviewed command."""
-    mocked_requests = mocker.patch('requests.get')
+    mocked_requests = mocker.patch('requests.Session.request')
+    mocked_requests.return_value.json.return_value = []
     mocked_alembic = mocker.patch('pdt_client.commands.get_migrations_data')
     mocked_alembic.return_value = [
         {
@@ -197,15 +500,13 @@ def test_migration_data_get_not_reviewed(mocker):
             url='http://example.com', username='user', password='password', alembic_config='some_config',
             ci_project='some_project')
     mocked_requests.assert_called_with(
-        'http://example.com/api/migrations/',
-        headers={
-            'content-type': 'application/json'},
-        params={'ci_project': 'some_project', 'reviewed': True}, auth=('user', 'password'))
+        'GET', 'http://example.com/api/migrations/',
+        params={'ci_project': 'some_project', 'reviewed': True, 'limit': 100}, timeout=None)
 
 
 def test_migration_data_get_not_applied(mocker):
     """Test migration-data get-not-applied command."""
-    mocked_requests = mocker.patch('requests.get')
+    mocked_requests = mocker.patch('requests.Session.request')
     mocked_requests.return_value.json.return_value = [
         {
             'uid': '123123',
@@ -242,47 +543,175 @@ def test_migration_data_get_not_applied(mocker):
             url='http://example.com', username='user', password='password',
             instance='some_instance', release='1520')
     mocked_requests.assert_called_with(
-        'http://example.com/api/migrations/',
-        headers={'content-type': 'application/json'},
-        params={'instance': 'some_instance', 'exclude_status': 'apl', 'release': '1520'},
-        auth=('user', 'password'))
+        'GET', 'http://example.com/api/migrations/',
+        params={'instance': 'some_instance', 'exclude_status': 'apl', 'release': '1520', 'limit': 100},
+        timeout=None)
+
+
+def test_command_client(mocker):
+    """Test that the client created by the command is closed, and the passed one is kept open."""
+    mocker.patch('requests.Session.request')
+    mocked_close = mocker.patch('pdt_client.client.Client.close')
+    log = mock.Mock()
+    log.read.return_value = 'some log'
+    deploy(
+        url='http://example.com', username='user', password='password', status='dpl',
+        instance='some_instance', log=log, cases=[])
+    assert mocked_close.call_count == 1
+    deploy(
+        url='http://example.com', username='user', password='password', status='dpl',
+        instance='some_instance', log=log, cases=[],
+        client=Client(url='http://example.com', username='user', password='password'))
+    assert mocked_close.call_count == 1
 
 
 @pytest.mark.parametrize('revision', [None, '123123'])
 def test_deploy(mocker, revision):
     """Test deploy command."""
-    mocked_requests = mocker.patch('requests.post')
-    log = mock.Mock()
-    log.read.return_value = 'some log'
+    mocked_requests = mocker.patch('requests.Session.request')
     deploy(
         url='http://example.com', username='user', password='password', status='dpl',
-        instance='some_instance', log=log, cases=[123, 232])
+        instance='some_instance', log=io.StringIO(u'some "log"\n'), cases=[123, 232])
     mocked_requests.assert_called_with(
-        'http://example.com/api/deployment-reports/',
-        headers={'content-type': 'application/json'},
-        data='{"cases": [{"id": 123}, {"id": 232}], "instance": {"name": '
-        '"some_instance"}, "log": "some log", "status": "dpl"}',
-        auth=('user', 'password'))
+        'POST', 'http://example.com/api/deployment-reports/', data=mock.ANY, timeout=None)
+    assert b''.join(mocked_requests.call_args[1]['data']) == (
+        b'{"cases": [{"id": 123}, {"id": 232}], "instance": {"name": '
+        b'"some_instance"}, "status": "dpl", "log": "some \\"log\\"\\n"}')
+
+
+def test_deploy_compressed_rejected(mocker):
+    """Test that the log is read again when the compressed deployment report is rejected."""
+    bodies = []
+
+    def request(method, url, data, **kwargs):
+        bodies.append(b''.join(data))
+        return mock.Mock(status_code=400 if len(bodies) == 1 else 201)
+
+    mocker.patch('requests.Session.request', side_effect=request)
+    deploy(
+        url='http://example.com', username='user', password='password', status='dpl', instance='some_instance',
+        log=io.StringIO(u'some log'), cases=[],
+        client=Client(url='http://example.com', username='user', password='password', compress_threshold=1))
+    assert len(bodies) == 2
+    assert zlib.decompress(bodies[0], 16 + zlib.MAX_WBITS) == bodies[1]
+    assert json.loads(bodies[1].decode('utf-8'))['log'] == 'some log'
+
+
+@pytest.mark.parametrize('report', [None, 'report.json'])
+def test_check(mocker, tmpdir, capsys, report):
+    """Test check command: the three checks on one index by case id."""
+    lists = {
+        ('migrations', 'reviewed'): [{'uid': 'a1', 'case': {'id': 1}}],
+        ('migrations', 'apl'): [{'uid': 'b1', 'case': {'id': 2}}, {'uid': 'b2', 'case': {'id': 2}}],
+        ('cases', None): [{'id': 3, 'revision': 'abc', 'title': 'Some case'}],
+    }
+
+    def request(method, url, params, **kwargs):
+        key = url.rstrip('/').rsplit('/', 1)[1], 'reviewed' if params.get('reviewed') else params.get('exclude_status')
+        return mock.Mock(status_code=200, json=mock.Mock(return_value=lists[key]))
+
+    mocked_requests = mocker.patch('requests.Session.request', side_effect=request)
+    mocker.patch('pdt_client.commands.get_migrations_data', return_value=[
+        {'revision': 'r1', 'attributes': {'case_id': '1'}},
+        {'revision': 'r2', 'attributes': {'case_id': 2}},
+    ])
+    report_path = tmpdir.join(report) if report else None
+    with pytest.raises(SystemExit) as exc:
+        check(
+            url='http://example.com', username='user', password='password', alembic_config='alembic.ini',
+            ci_project='paylogic', instance='staging', release=1520, report=report_path and str(report_path))
+    assert exc.value.code == 3
+    assert mocked_requests.call_count == 3
+    out, err = capsys.readouterr()
+    assert out == (
+        'Got migration and case data\n'
+        'Found not reviewed migrations for these cases: [2]\n'
+        'Found not applied migrations for these cases: [2]\n'
+        '3\tabc\tSome case\n')
+    if report:
+        data = json.loads(report_path.read())
+        assert (data['status'], data['not_reviewed'], data['not_applied'], data['not_deployed']) == (3, [2], [2], [3])
+        assert data['cases']['2'] == dict(
+            revisions=['r2'], reviewed=False, not_applied=['b1', 'b2'], deployed=True, revision=None, title=None)
+
+
+def test_deploy_metrics(mocker):
+    """Test that the size of the reported log is recorded."""
+    response = mocker.Mock(status_code=201, content=b'{}')
+    mocker.patch('requests.Session.request', side_effect=lambda method, url, data, **kwargs: list(data) and response)
+    metrics = Metrics('deploy')
+    profiling.enable(metrics)
+    try:
+        deploy(
+            url='http://example.com', username='user', password='password', status='err',
+            instance='some_instance', log=io.StringIO(u'some log'), cases=[])
+    finally:
+        profiling.disable(metrics)
+    assert 'pdt_client_deploy_log_bytes_total{command="deploy",status="err"} 8.0\n' in metrics.format()
 
 
 def test_case_data_get_not_deployed_cases(mocker):
     """Test get_not_deployed command."""
-    mocked_requests = mocker.patch('requests.get')
+    mocked_requests = mocker.patch('requests.Session.request')
+    mocked_requests.return_value.json.return_value = []
     get_not_deployed_cases(
         url='http://example.com', username='user', password='password',
         ci_project='paylogic', release=1520, instance='some_instance')
     mocked_requests.assert_called_with(
-        'http://example.com/api/cases/',
-        headers={'content-type': 'application/json'},
-        params={'release': 1520, 'ci_project': 'paylogic', 'exclude_deployed_on': 'some_instance'},
-        auth=('user', 'password'))
+        'GET', 'http://example.com/api/cases/',
+        params={'release': 1520, 'ci_project': 'paylogic', 'exclude_deployed_on': 'some_instance', 'limit': 100},
+        timeout=None)
+
+
+def test_case_data_get_not_deployed_cases_jsonl(mocker, capsys):
+    """Test that the cases are streamed as json lines as soon as their page is received."""
+    pages = [
+        {'results': [{'id': 1, 'revision': 'abc', 'title': 'First'}], 'next': 'http://example.com/api/cases/?page=2'},
+        {'results': [{'id': 2, 'revision': 'def', 'title': 'Second'}], 'next': None},
+    ]
+    streamed = []
+
+    def request(method, url, **kwargs):
+        streamed.append(capsys.readouterr().out)
+        return mock.Mock(status_code=200, json=mock.Mock(return_value=pages[len(streamed) - 1]))
+
+    mocker.patch('requests.Session.request', side_effect=request)
+    get_not_deployed_cases(
+        url='http://example.com', username='user', password='password',
+        ci_project='paylogic', release=1520, instance='some_instance', output='jsonl')
+    streamed.append(capsys.readouterr().out)
+    assert streamed == [
+        '',
+        '{"id": 1, "revision": "abc", "title": "First"}\n',
+        '{"id": 2, "revision": "def", "title": "Second"}\n',
+    ]
+
+
+def test_migration_data_get_not_reviewed_jsonl(mocker, capsys):
+    """Test that the not reviewed cases are written as json lines and the messages go to the standard error."""
+    mocked_requests = mocker.patch('requests.Session.request')
+    mocked_requests.return_value.json.return_value = [{'uid': 'r1', 'case': {'id': 1}}]
+    mocker.patch('pdt_client.commands.get_migrations_data', return_value=[
+        {'revision': 'r1', 'attributes': {'case_id': 1}},
+        {'revision': 'r2', 'attributes': {'case_id': 2}},
+        {'revision': 'r3', 'attributes': {'case_id': 2}},
+    ])
+    with pytest.raises(SystemExit) as exc:
+        get_not_reviewed(
+            url='http://example.com', username='user', password='password', alembic_config='alembic.ini',
+            ci_project='paylogic', output='jsonl')
+    assert exc.value.code == 1
+    out, err = capsys.readouterr()
+    assert out == '{"case": 2, "revisions": ["r2", "r3"]}\n'
+    assert err == 'Got migration data\nFound not reviewed migrations for these cases: [2]\n'
 
 
 def test_graph(mocker, tmpdir, capsys):
     """Test graph command."""
-    mocked_requests = mocker.patch('requests.get')
-    mocked_alembic = mocker.patch('pdt_client.commands.generate_migration_graph')
-    mocked_alembic.return_value = "Hello"
+    mocked_requests = mocker.patch('requests.Session.request')
+    mocked_requests.return_value.json.return_value = []
+    mocker.patch('pdt_client.commands.iterate_migration_graph', return_value=iter(['Hel', 'lo']))
+    mocker.patch('pdt_client.commands.get_migrations_data', return_value=[])
     fp = tmpdir.join('test.dot')
     graph(
         url='http://example.com',
@@ -293,9 +722,7 @@ def test_graph(mocker, tmpdir, capsys):
         verbose=True
     )
     mocked_requests.assert_called_with(
-        'http://example.com/api/migrations/',
-        headers={'content-type': 'application/json'},
-        auth=('user', 'password'))
+        'GET', 'http://example.com/api/migrations/', params={'limit': 100}, timeout=None)
 
     assert fp.read() == "Hello"
     out, err = capsys.readouterr()
@@ -305,11 +732,11 @@ def test_graph(mocker, tmpdir, capsys):
 
 def test_graph_key_error(mocker, tmpdir):
     """Test unhappy path for graph command."""
-    mocked_requests = mocker.patch('requests.get')
+    mocked_requests = mocker.patch('requests.Session.request')
     mocked_requests.return_value = mock.Mock()
     mocked_requests.return_value.json = mock.Mock(return_value=[{}])
-    mocked_alembic = mocker.patch('pdt_client.commands.generate_migration_graph')
-    mocked_alembic.return_value = "Hello"
+    mocker.patch('pdt_client.commands.iterate_migration_graph', return_value=iter(['Hel', 'lo']))
+    mocker.patch('pdt_client.commands.get_migrations_data', return_value=[])
     fp = tmpdir.join('test.dot')
     graph(
         url='http://example.com',
@@ -320,13 +747,22 @@ def test_graph_key_error(mocker, tmpdir):
         verbose=False
     )
     mocked_requests.assert_called_with(
-        'http://example.com/api/migrations/',
-        headers={'content-type': 'application/json'},
-        auth=('user', 'password'))
+        'GET', 'http://example.com/api/migrations/', params={'limit': 100}, timeout=None)
 
     assert fp.read() == "Hello"
 
 
+def test_generate_migration_graph():
+    """Test generating the dot source of the revisions."""
+    migrations = [
+        {'revision': 'a', 'down_revision': None, 'attributes': {}},
+        {'revision': 'b', 'down_revision': 'a', 'attributes': {}},
+    ]
+    assert generate_migration_graph(migrations, lambda data: u'{0}\n"label"'.format(data['revision'])) == (
+        u'digraph revisions {\n\t"a" [label="a\\n\\"label\\""];\n\t"b" [label="b\\n\\"label\\""];\n\n'
+        u'\t"b" -> "a";\n}')
+
+
 def test_label_callback():
     """Test the label callback function."""
     release_numbers = dict(a='123')
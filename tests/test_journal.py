@@ -0,0 +1,45 @@
+"""Test journal."""
+import pytest
+
+from pdt_client.journal import Journal, open_journal
+
+
+def test_journal_resume(tmpdir):
+    """Test reading the journal of the previous run."""
+    path = str(tmpdir.join('journal.log'))
+    journal = Journal(path)
+    journal.step(1, 'apl', {'step': {'id': 1}})
+    journal.sent(1)
+    journal.step(2, 'apl', {'step': {'id': 2}})
+    journal.step(3, 'err', {'step': {'id': 3}})
+    journal.close()
+    with open(path, 'a') as fd:
+        fd.write('{"step": 4, "sta')
+
+    journal = Journal(path, resume=True)
+    assert [journal.applied(step_id) for step_id in (1, 2, 3, 4)] == [True, True, False, False]
+    assert journal.unsent() == [{'step': {'id': 2}}, {'step': {'id': 3}}]
+    journal.step(4, 'apl', {'step': {'id': 4}})
+    journal.sent(2)
+    journal.close()
+
+    journal = Journal(path, resume=True)
+    assert [journal.applied(step_id) for step_id in (1, 2, 3, 4)] == [True, True, False, True]
+    assert journal.unsent() == [{'step': {'id': 3}}, {'step': {'id': 4}}]
+    journal.close()
+    assert Journal(path).unsent() == []
+
+
+def test_open_journal(tmpdir):
+    """Test that the journal is removed only when the migrations succeeded."""
+    path = tmpdir.join('journal.log')
+    with pytest.raises(Exception):
+        with open_journal(str(path)) as journal:
+            journal.step(1, 'err', {'step': {'id': 1}})
+            raise Exception('some error')
+    assert path.check()
+    with open_journal(str(path), resume=True) as journal:
+        assert journal.unsent() == [{'step': {'id': 1}}]
+    assert not path.check()
+    with open_journal(None) as journal:
+        assert journal is None
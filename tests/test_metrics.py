@@ -0,0 +1,67 @@
+"""Test metrics."""
+import pytest
+
+from pdt_client import profiling
+from pdt_client.metrics import Metrics
+
+
+@pytest.fixture
+def metrics():
+    """Metrics collecting the spans."""
+    metrics = Metrics('migrate')
+    profiling.enable(metrics)
+    yield metrics
+    profiling.disable(metrics)
+
+
+def test_metrics(metrics):
+    """Test the metrics of the steps and the requests in the text format."""
+    metrics.record('sql', 'sqlite', 0, 0.02, {'status': 'apl', 'report': 300})
+    metrics.record('http', 'POST /api/migration-step-reports/', 0, 0.3, {'method': 'POST', 'status': 201, 'sent': 10})
+    metrics.record('http', 'POST /api/migration-step-reports/', 0, 0.1, {'method': 'POST', 'error': 'Timeout'})
+    text = metrics.format()
+    step = 'command="migrate",kind="sql",status="apl",type="sqlite"'
+    assert (
+        '# HELP pdt_client_step_duration_seconds Migration step execution time by step type.\n'
+        '# TYPE pdt_client_step_duration_seconds histogram\n'
+        'pdt_client_step_duration_seconds_bucket{{{0},le="0.005"}} 0\n'
+        'pdt_client_step_duration_seconds_bucket{{{0},le="0.01"}} 0\n'
+        'pdt_client_step_duration_seconds_bucket{{{0},le="0.025"}} 1\n'.format(step)) in text
+    assert 'pdt_client_step_duration_seconds_bucket{{{0},le="+Inf"}} 1\n'.format(step) in text
+    assert 'pdt_client_step_duration_seconds_sum{{{0}}} 0.02\n'.format(step) in text
+    assert 'pdt_client_step_report_bytes_bucket{{{0},le="1024"}} 1\n'.format(step) in text
+    request = 'command="migrate",endpoint="/api/migration-step-reports/"'
+    assert (
+        'pdt_client_http_requests_total{{{0},method="POST",status="201"}} 1.0\n'
+        'pdt_client_http_requests_total{{{0},method="POST",status="Timeout"}} 1.0\n'.format(request)) in text
+    assert 'pdt_client_http_sent_bytes_total{{{0}}} 10.0\n'.format(request) in text
+
+
+def test_metrics_command(metrics):
+    """Test the metrics of the command run."""
+    metrics.finish(success=False)
+    text = metrics.format()
+    assert 'pdt_client_command_success{command="migrate"} 0\n' in text
+    assert '# TYPE pdt_client_command_duration_seconds gauge\n' in text
+
+
+def test_write(metrics, tmpdir):
+    """Test writing the metrics file."""
+    metrics.record('deploy', 'dpl', 0, 1, {'sent': 100})
+    path = tmpdir.join('pdt-client.prom')
+    metrics.write(str(path))
+    assert path.read() == (
+        '# HELP pdt_client_deploy_log_bytes_total Deployment log characters reported by status.\n'
+        '# TYPE pdt_client_deploy_log_bytes_total counter\n'
+        'pdt_client_deploy_log_bytes_total{command="migrate",status="dpl"} 100.0\n')
+    assert tmpdir.listdir() == [path]
+
+
+def test_push(metrics, mocker):
+    """Test pushing the metrics to the gateway."""
+    mocked_put = mocker.patch('requests.put')
+    metrics.push('http://localhost:9091/metrics/job/pdt-client', timeout=5)
+    mocked_put.assert_called_once_with(
+        'http://localhost:9091/metrics/job/pdt-client', data=metrics.format().encode('utf-8'),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}, timeout=5)
+    mocked_put.return_value.raise_for_status.assert_called_once_with()
@@ -0,0 +1,58 @@
+"""Test script running."""
+import io
+import sys
+
+import pytest
+
+from pdt_client.process import OutputBuffer, read_log, run_script, subprocess
+
+
+def test_output_buffer():
+    """Test that only the first and the last lines are kept."""
+    output = OutputBuffer(head=2, tail=3)
+    for number in range(10):
+        output.append('line {0}\n'.format(number))
+    assert output.get_text('some.log') == (
+        'line 0\nline 1\n'
+        '... skipped lines with count: 5, full output is in the log file: some.log ...\n'
+        'line 7\nline 8\nline 9')
+
+
+def test_output_buffer_short():
+    """Test that the short output is kept as is."""
+    output = OutputBuffer(head=2, tail=3)
+    for number in range(4):
+        output.append('line {0}\n'.format(number))
+    assert output.get_text() == 'line 0\nline 1\nline 2\nline 3'
+
+
+def test_run_script(tmpdir, capsys):
+    """Test that the output is streamed to the console and to the log file."""
+    log = tmpdir.join('scripts.log')
+    script = "import sys\nfor i in range(5): print(i)\nsys.stderr.write('error')\n"
+    text = run_script([sys.executable, '-c', script], log=str(log), head=1, tail=1)
+    assert text == '0\n... skipped lines with count: 4, full output is in the log file: {0} ...\nerror'.format(log)
+    out, err = capsys.readouterr()
+    assert out == '0\n1\n2\n3\n4\nerror'
+    assert '0\n1\n2\n3\n4\nerror\n' in log.read()
+
+
+def test_run_script_error():
+    """Test that the failed script raises with its output."""
+    with pytest.raises(subprocess.CalledProcessError) as exc:
+        run_script([sys.executable, '-c', "print('some output'); raise SystemExit(3)"])
+    assert exc.value.returncode == 3
+    assert exc.value.output == 'some output'
+
+
+def test_read_log():
+    """Test reading the whole log chunk by chunk."""
+    assert list(read_log(io.StringIO(u'0123456789'), chunk_size=4)) == ['0123', '4567', '89']
+
+
+def test_read_log_max_size():
+    """Test that only the head and the tail of the large log are read."""
+    log = u''.join(str(number % 10) for number in range(100))
+    assert ''.join(read_log(io.StringIO(log), max_size=10, chunk_size=3)) == (
+        '01234\n... skipped characters with count: 90 ...\n56789')
+    assert ''.join(read_log(io.StringIO(log[:8]), max_size=10, chunk_size=3)) == log[:8]
@@ -0,0 +1,58 @@
+"""Test timing instrumentation."""
+import json
+
+import pytest
+
+from pdt_client import profiling
+
+
+@pytest.fixture
+def profiler():
+    """Enabled profiler."""
+    profiler = profiling.Profiler()
+    profiling.enable(profiler)
+    yield profiler
+    profiling.disable(profiler)
+
+
+def test_span_disabled():
+    """Test that nothing is recorded without a profiler."""
+    with profiling.span('sql', 'sqlite') as info:
+        assert info is None
+
+
+def test_span(profiler):
+    """Test that the spans are recorded with their attributes, also the failed ones."""
+    with profiling.span('http', 'GET /api/migrations/', method='GET') as info:
+        info['received'] = 10
+    with pytest.raises(ValueError):
+        with profiling.span('sql', 'sqlite', step=1):
+            raise ValueError
+    assert [(span['kind'], span['name'], span['attributes']) for span in profiler.spans] == [
+        ('http', 'GET /api/migrations/', {'method': 'GET', 'received': 10}),
+        ('sql', 'sqlite', {'step': 1, 'error': 'ValueError'}),
+    ]
+
+
+def test_summary(profiler, capsys):
+    """Test the spans summary by kind and name."""
+    for duration in (1, 3):
+        profiler.record('http', 'POST /api/migrations/', 0, duration, {'sent': 5})
+    profiler.record('scan', 'alembic', 0, 2, {})
+    summary = profiler.get_summary()
+    assert [(group['kind'], group['count'], group['total'], group['mean'], group['max'], group['sent'])
+            for group in summary] == [('http', 2, 4, 2, 3, 10), ('scan', 1, 2, 2, 2, 0)]
+    profiler.print_summary()
+    out, err = capsys.readouterr()
+    assert 'http  POST /api/migrations/  2      4.000s  2.000s  3.000s  10    0' in err
+
+
+def test_write_trace(profiler, tmpdir):
+    """Test writing the spans in the trace event format."""
+    profiler.record('graph', 'render', profiler.start + 1, 0.5, {'revisions': 3})
+    path = tmpdir.join('trace.json')
+    profiler.write_trace(str(path))
+    [event] = json.loads(path.read())['traceEvents']
+    assert event['name'] == 'render'
+    assert event['cat'] == 'graph'
+    assert (event['ph'], event['ts'], event['dur'], event['args']) == ('X', 1000000, 500000, {'revisions': 3})
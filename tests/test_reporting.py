@@ -0,0 +1,104 @@
+"""Test reporting."""
+import mock
+import pytest
+import requests
+
+from pdt_client.reporting import BatchStepReporter, StepReporter, ThreadedStepReporter, get_reporter, read_spool
+
+
+def test_get_reporter():
+    """Test choosing the reporter by the batch size."""
+    client = mock.Mock()
+    assert type(get_reporter(client)) is StepReporter
+    reporter = get_reporter(client, batch_size=10, batch_interval=2)
+    assert isinstance(reporter, BatchStepReporter)
+    assert (reporter.batch_size, reporter.interval) == (10, 2)
+
+
+def test_batch_reporter():
+    """Test that the reports are posted in batches and the rest on exit."""
+    client = mock.Mock()
+    with BatchStepReporter(client, batch_size=2, interval=60) as reporter:
+        reporter.report({'step': {'id': 1}})
+        assert not client.post.called
+        reporter.report({'step': {'id': 2}})
+        client.post.assert_called_once_with('migration-step-reports/bulk', [{'step': {'id': 1}}, {'step': {'id': 2}}])
+        reporter.report({'step': {'id': 3}})
+    client.post.assert_called_with('migration-step-reports/bulk', [{'step': {'id': 3}}])
+
+
+def test_batch_reporter_interval(mocker):
+    """Test that the queue is flushed when the oldest report waited longer than the interval."""
+    mocker.patch('time.time', side_effect=[0, 0, 11])
+    client = mock.Mock()
+    reporter = BatchStepReporter(client, batch_size=10, interval=10)
+    reporter.report({'step': {'id': 1}})
+    assert not client.post.called
+    reporter.report({'step': {'id': 2}})
+    client.post.assert_called_once_with('migration-step-reports/bulk', [{'step': {'id': 1}}, {'step': {'id': 2}}])
+
+
+def test_batch_reporter_no_bulk_endpoint():
+    """Test falling back to posting the reports one by one."""
+    client = mock.Mock()
+    response = mock.Mock(status_code=404)
+
+    def post(endpoint, data):
+        if endpoint.endswith('/bulk'):
+            raise requests.HTTPError(response=response)
+    client.post.side_effect = post
+    reporter = BatchStepReporter(client, batch_size=2)
+    reporter.report({'step': {'id': 1}})
+    reporter.report({'step': {'id': 2}})
+    reporter.report({'step': {'id': 3}})
+    reporter.close()
+    assert client.post.call_args_list == [
+        mock.call('migration-step-reports/bulk', [{'step': {'id': 1}}, {'step': {'id': 2}}]),
+        mock.call('migration-step-reports', {'step': {'id': 1}}),
+        mock.call('migration-step-reports', {'step': {'id': 2}}),
+        mock.call('migration-step-reports', {'step': {'id': 3}}),
+    ]
+
+
+def test_batch_reporter_error():
+    """Test that errors other than a missing bulk endpoint are raised."""
+    client = mock.Mock()
+    client.post.side_effect = requests.HTTPError(response=mock.Mock(status_code=500))
+    reporter = BatchStepReporter(client, batch_size=1)
+    with pytest.raises(requests.HTTPError):
+        reporter.report({'step': {'id': 1}})
+
+
+def test_threaded_reporter(tmpdir):
+    """Test that the reports are posted in order and the spool file is removed once all are confirmed."""
+    client = mock.Mock()
+    spool = tmpdir.join('reports.spool')
+    with get_reporter(client, spool=str(spool)) as reporter:
+        assert isinstance(reporter, ThreadedStepReporter)
+        for step_id in range(5):
+            reporter.report({'step': {'id': step_id}})
+    assert client.post.call_args_list == [
+        mock.call('migration-step-reports', {'step': {'id': step_id}}) for step_id in range(5)]
+    assert not spool.check()
+
+
+def test_threaded_reporter_spool(tmpdir):
+    """Test that not confirmed reports are kept in the spool file and are posted first by the next run."""
+    client = mock.Mock()
+    client.post.side_effect = [None, Exception('some error'), Exception('some error')]
+    spool = tmpdir.join('reports.spool')
+    reporter = ThreadedStepReporter(client, str(spool), retries=1, retry_delay=0)
+    reporter.report({'step': {'id': 1}})
+    reporter.report({'step': {'id': 2}})
+    reporter.report({'step': {'id': 3}})
+    with pytest.raises(RuntimeError):
+        reporter.close()
+    assert read_spool(str(spool)) == [{'step': {'id': 2}}, {'step': {'id': 3}}]
+
+    client.post.reset_mock()
+    client.post.side_effect = None
+    with ThreadedStepReporter(client, str(spool)) as reporter:
+        reporter.report({'step': {'id': 4}})
+    assert client.post.call_args_list == [
+        mock.call('migration-step-reports', {'step': {'id': step_id}}) for step_id in (2, 3, 4)]
+    assert not spool.check()
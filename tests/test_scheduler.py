@@ -0,0 +1,107 @@
+"""Test migration scheduling."""
+import threading
+
+import pytest
+
+from pdt_client.scheduler import get_parents, run_dag, run_parallel
+
+
+def test_get_parents():
+    """Test getting the parents of the migration."""
+    assert get_parents({'uid': 'a'}) == ()
+    assert get_parents({'uid': 'a', 'parent': None}) == ()
+    assert get_parents({'uid': 'a', 'parent': 'b'}) == ('b',)
+    assert get_parents({'uid': 'a', 'parent': ['b', 'c']}) == ('b', 'c')
+
+
+def test_run_dag():
+    """Test that the independent branches run concurrently and the children after their parents."""
+    migrations = [
+        {'uid': 'merge', 'parent': ['left', 'right']},
+        {'uid': 'left', 'parent': 'root'},
+        {'uid': 'right', 'parent': 'root'},
+        {'uid': 'root', 'parent': 'applied'},
+    ]
+    branches = threading.Barrier(2) if hasattr(threading, 'Barrier') else None
+    applied = []
+
+    def apply(migration):
+        if branches is not None and migration['uid'] in ('left', 'right'):
+            # both branches have to be running at the same time to pass the barrier
+            branches.wait(timeout=5)
+        applied.append(migration['uid'])
+
+    run_dag(migrations, apply, concurrency=2)
+    assert applied[0] == 'root'
+    assert sorted(applied[1:3]) == ['left', 'right']
+    assert applied[3] == 'merge'
+
+
+def test_run_dag_error():
+    """Test that no migrations are started after the failure and the error is raised."""
+    migrations = [
+        {'uid': 'root'},
+        {'uid': 'child', 'parent': 'root'},
+        {'uid': 'other'},
+    ]
+    applied = []
+
+    def apply(migration):
+        if migration['uid'] == 'root':
+            raise Exception('some error')
+        applied.append(migration['uid'])
+
+    with pytest.raises(Exception) as exc_info:
+        run_dag(migrations, apply, concurrency=1)
+    assert str(exc_info.value) == 'some error'
+    assert applied == []
+
+
+def test_run_dag_keep_going():
+    """Test that only the descendants of the failed migration are not applied with keep_going."""
+    migrations = [
+        {'uid': 'root'},
+        {'uid': 'child', 'parent': 'root'},
+        {'uid': 'other'},
+        {'uid': 'broken'},
+    ]
+    applied = []
+
+    def apply(migration):
+        if migration['uid'] in ('root', 'broken'):
+            raise Exception('some error')
+        applied.append(migration['uid'])
+
+    failed = run_dag(migrations, apply, concurrency=2, keep_going=True)
+    assert sorted(migration['uid'] for migration, exc_info in failed) == ['broken', 'root']
+    assert applied == ['other']
+
+
+def test_run_dag_cycle():
+    """Test that the cyclic parent links are detected."""
+    with pytest.raises(ValueError):
+        run_dag([{'uid': 'a', 'parent': 'b'}, {'uid': 'b', 'parent': 'a'}], lambda migration: None)
+
+
+def test_run_parallel():
+    """Test that the functions run at the same time and their results are collected by name."""
+    barrier = threading.Barrier(2) if hasattr(threading, 'Barrier') else None
+
+    def call(result):
+        if barrier is not None:
+            barrier.wait(timeout=5)
+        return result
+
+    assert run_parallel({'first': lambda: call(1), 'second': lambda: call(2)}) == {'first': 1, 'second': 2}
+
+
+def test_run_parallel_error():
+    """Test that the error is raised after all the functions finished."""
+    finished = []
+
+    def fail():
+        raise ValueError('some error')
+
+    with pytest.raises(ValueError):
+        run_parallel({'fail': fail, 'other': lambda: finished.append(True)})
+    assert finished == [True]
@@ -1,6 +1,7 @@
 """Test script."""
 import pytest
 
+from pdt_client.client import Client
 from pdt_client.script import main
 
 
@@ -31,7 +32,39 @@ def test_migrate(monkeypatch, mocker):
     mocked_command.assert_called_with(
         case=None, username='username', instance='test', connection_string='sqlite:///', phase='before-deploy',
         migrations_dir='/tmp', url='http://deployment.paylogic.eu', password='password',
-        release='1510', show=False)
+        release='1510', show=False, report_batch_size=1, report_batch_interval=5,
+        report_async=False, report_spool='pdt-step-reports-{instance}.spool',
+        journal='pdt-journal-{instance}.log', resume=False, transaction='step', db_pool_size=None,
+        script_log='pdt-scripts-{instance}.log', concurrency=1,
+        client=equals_any(Client))
+
+
+def test_migrate_manifest(monkeypatch, mocker):
+    """Test script entry point: migrate the instances of the manifest."""
+    mocked_command = mocker.patch('pdt_client.commands.migrate_many')
+    monkeypatch.setattr('sys.argv', [
+        '', '--username=username', '--password=password', 'migrate', '--manifest=instances.json', '--jobs=8',
+        '--phase=before-deploy', '--migrations-dir=/tmp', '--release=1510'])
+    main()
+    mocked_command.assert_called_with(
+        case=None, username='username', manifest='instances.json', jobs=8, log='{instance}.log',
+        phase='before-deploy', migrations_dir='/tmp', url='http://deployment.paylogic.eu', password='password',
+        release='1510', show=False, report_batch_size=1, report_batch_interval=5,
+        report_async=False, report_spool='pdt-step-reports-{instance}.spool',
+        journal='pdt-journal-{instance}.log', resume=False, transaction='step', db_pool_size=None,
+        script_log='pdt-scripts-{instance}.log', concurrency=1,
+        client=equals_any(Client))
+
+
+@pytest.mark.parametrize('args', [[], ['--manifest=instances.json', '--instance=test']])
+def test_migrate_instance_required(monkeypatch, args):
+    """Test script entry point: migrate requires either the instance or the manifest."""
+    monkeypatch.setattr('sys.argv', [
+        '', '--username=username', '--password=password', 'migrate', '--phase=before-deploy',
+        '--migrations-dir=/tmp', '--release=1510'] + args)
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+    assert exc_info.value.code == 2
 
 
 @pytest.mark.parametrize('case', [33322, None])
@@ -44,8 +77,9 @@ def test_migration_data_push(monkeypatch, mocker, case):
     ] + case_args + ['push', '--alembic-config=some_alembic_config'])
     main()
     mocked_command.assert_called_with(
-        case=case, alembic_config='some_alembic_config', show=False,
-        url='http://deployment.paylogic.eu', username='username', password='password')
+        case=case, alembic_config='some_alembic_config', show=False, push_cache='.pdt-push-cache.json',
+        check_server=False, scan_cache='.pdt-scan-cache.json', rescan=False, concurrency=1,
+        url='http://deployment.paylogic.eu', username='username', password='password', client=equals_any(Client))
 
 
 @pytest.mark.parametrize('case', [33322, None])
@@ -59,8 +93,21 @@ def test_migration_data_get_not_reviewed(monkeypatch, mocker, case):
     main()
     mocked_command.assert_called_with(
         case=case, alembic_config='some_alembic_config', username='username',
-        ci_project='some_project',
-        password='password', url='http://deployment.paylogic.eu')
+        ci_project='some_project', scan_cache='.pdt-scan-cache.json', rescan=False, output='text',
+        password='password', url='http://deployment.paylogic.eu', client=equals_any(Client))
+
+
+def test_check(monkeypatch, mocker):
+    """Test script entry point: check."""
+    mocked_command = mocker.patch('pdt_client.commands.check')
+    monkeypatch.setattr('sys.argv', [
+        '', '--username=username', '--password=password', 'check', '--alembic-config=alembic.ini',
+        '--ci-project=some_project', '--instance=staging', '--release=1510', '--report=-', '--output=jsonl'])
+    main()
+    mocked_command.assert_called_with(
+        url='http://deployment.paylogic.eu', username='username', password='password', alembic_config='alembic.ini',
+        ci_project='some_project', instance='staging', release='1510', case=None,
+        scan_cache='.pdt-scan-cache.json', rescan=False, report='-', output='jsonl', client=equals_any(Client))
 
 
 @pytest.mark.parametrize('case', [33322, None])
@@ -70,12 +117,12 @@ def test_migration_data_get_not_applied(monkeypatch, mocker, case):
     case_args = ['--case={0}'.format(case)] if case else []
     monkeypatch.setattr('sys.argv', [
         '', '--username=username', '--password=password', 'migration-data',
-    ] + case_args + ['get-not-applied', '--instance=some_instance', '--release=1520'])
+    ] + case_args + ['get-not-applied', '--instance=some_instance', '--release=1520', '--output=jsonl'])
     main()
     mocked_command.assert_called_with(
         case=case, username='username',
         password='password', url='http://deployment.paylogic.eu',
-        instance='some_instance', release='1520')
+        instance='some_instance', release='1520', output='jsonl', client=equals_any(Client))
 
 
 @pytest.mark.parametrize('case', [33322, None])
@@ -92,7 +139,8 @@ def test_case_data_get_not_deployed(monkeypatch, mocker, case):
         ci_project='some_project',
         release='1520',
         instance='some_instance',
-        password='password', url='http://deployment.paylogic.eu')
+        output='text',
+        password='password', url='http://deployment.paylogic.eu', client=equals_any(Client))
 
 
 @pytest.mark.parametrize('revision', ['123123', None])
@@ -109,4 +157,70 @@ def test_deploy(monkeypatch, mocker, revision, cases):
     mocked_command.assert_called_with(
         status='dpl', username='username',
         log=equals_any(), url='http://deployment.paylogic.eu',
-        instance='some-instance', password='password', cases=cases)
+        instance='some-instance', password='password', cases=cases, max_log_size=None, client=equals_any(Client))
+
+
+def test_client_options(monkeypatch, mocker):
+    """Test script entry point: deployment tool client options."""
+    mocked_command = mocker.patch('pdt_client.commands.deploy')
+    mocked_close = mocker.patch('pdt_client.client.Client.close')
+    monkeypatch.setattr('sys.argv', [
+        '', '--username=username', '--password=password', '--pool-size=3', '--timeout=2.5', '--page-size=0',
+        '--retries=5', '--retry-backoff=0.1', '--retry-status=500', '--retry-status=503', '--http-cache-ttl=30',
+        '--compress-threshold=0',
+        'deploy', '--instance=some-instance', '--status=dpl', '/dev/null'])
+    main()
+    client = mocked_command.call_args[1]['client']
+    assert client.timeout == 2.5
+    assert client.page_size == 0
+    assert (client.retries, client.retry_backoff, client.retry_statuses) == (5, 0.1, frozenset((500, 503)))
+    assert (client.cache.path, client.cache.ttl) == ('.pdt-http-cache', 30)
+    assert client.compress_threshold == 0
+    assert client.session.auth == ('username', 'password')
+    assert client.session.get_adapter('http://deployment.paylogic.eu')._pool_maxsize == 3
+    mocked_close.assert_called_once_with()
+
+
+def test_graph(monkeypatch, mocker):
+    """Test script entry point: graph."""
+    mocked_command = mocker.patch('pdt_client.commands.graph')
+    monkeypatch.setattr('sys.argv', [
+        '', '--username=username', '--password=password', 'graph', '--filename=graph.dot',
+        '--alembic-config=alembic.ini', '--quiet'])
+    main()
+    mocked_command.assert_called_with(
+        url='http://deployment.paylogic.eu', username='username', password='password', alembic_config='alembic.ini',
+        filename='graph.dot', verbose=False, scan_cache='.pdt-scan-cache.json', rescan=False,
+        client=equals_any(Client))
+
+
+def test_profile(monkeypatch, mocker, tmpdir, capsys):
+    """Test script entry point: the profile summary and trace of the command."""
+    from pdt_client.profiling import span
+
+    def deploy(**kwargs):
+        with span('http', 'POST /api/deployment-reports/'):
+            pass
+
+    mocker.patch('pdt_client.commands.deploy', side_effect=deploy)
+    trace = tmpdir.join('trace.json')
+    monkeypatch.setattr('sys.argv', [
+        '', '--username=username', '--password=password', '--profile', '--profile-trace={0}'.format(trace),
+        'deploy', '--instance=some-instance', '--status=dpl', '/dev/null'])
+    main()
+    out, err = capsys.readouterr()
+    assert '-- Profile of the command run in' in err
+    assert 'http  POST /api/deployment-reports/  1' in err
+    assert '"cat": "http"' in trace.read()
+
+
+def test_metrics(monkeypatch, mocker, tmpdir):
+    """Test script entry point: the metrics file of the failed command."""
+    mocker.patch('pdt_client.commands.get_not_reviewed', side_effect=SystemExit(2))
+    path = tmpdir.join('pdt-client.prom')
+    monkeypatch.setattr('sys.argv', [
+        '', '--username=username', '--password=password', '--metrics-file={0}'.format(path),
+        'migration-data', 'get-not-reviewed', '--alembic-config=alembic.ini', '--ci-project=some'])
+    with pytest.raises(SystemExit):
+        main()
+    assert 'pdt_client_command_success{command="migration-data get-not-reviewed"} 0\n' in path.read()
@@ -0,0 +1,52 @@
+"""Test command line startup imports."""
+import subprocess
+import sys
+
+import pytest
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7), reason='-X importtime needs python 3.7')
+
+HEAVY_MODULES = frozenset(('alembic', 'alembic_offline', 'sqlalchemy'))
+SUBCOMMANDS = [
+    ['migrate'],
+    ['migration-data', 'push'],
+    ['migration-data', 'get-not-reviewed'],
+    ['migration-data', 'get-not-applied'],
+    ['case-data', 'get-not-deployed'],
+    ['deploy'],
+    ['graph'],
+    ['check'],
+]
+
+
+def get_imported(args):
+    """Run the command line script with -X importtime and get the names of the imported top level packages."""
+    code = 'import sys; from pdt_client.script import main; sys.argv[0] = "pdt-client"; main()'
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', code] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    return frozenset(
+        line.split('|')[-1].strip().split('.')[0]
+        for line in stderr.decode('utf-8').splitlines() if line.startswith('import time:'))
+
+
+@pytest.mark.parametrize('subcommand', SUBCOMMANDS)
+def test_help_imports(subcommand):
+    """Test that the help of the subcommands doesn't import the database, alembic or HTTP libraries."""
+    imported = get_imported(subcommand + ['--help'])
+    assert 'pdt_client' in imported
+    assert not imported & (HEAVY_MODULES | frozenset(['requests']))
+
+
+@pytest.mark.parametrize('subcommand', [
+    ['deploy', '--instance=some', '--status=dpl', '/dev/null'],
+    ['migration-data', 'get-not-applied', '--instance=some', '--release=1510'],
+    ['case-data', 'get-not-deployed', '--instance=some', '--release=1510', '--ci-project=some'],
+])
+def test_command_imports(subcommand):
+    """Test that the commands not touching the database or the revisions don't import SQLAlchemy or alembic."""
+    imported = get_imported([
+        '--username=user', '--password=password', '--url=http://127.0.0.1:9', '--retries=0', '--http-cache=',
+    ] + subcommand)
+    assert 'requests' in imported
+    assert not imported & HEAVY_MODULES